@@ -0,0 +1,145 @@
+"""
+Compare the DatabaseEmbedder embedding backends: resident memory, load
+time, embedding throughput and retrieval hit rate on a fixed question set.
+
+    python -m benchmarks.bench_backends --backends bert bert-int8 minilm hashing --tables 256
+
+Each backend runs in a fresh process, so that its memory is measured alone.
+Hit rate is the share of QUESTIONS whose expected table is in the top
+--top-n, by embeddings alone and by the hybrid ranking of
+get_similar_tables() (embeddings fused with BM25 over names).
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import resource
+import time
+
+from benchmarks.bench_embeddings import make_table_definitions
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+
+SCHEMA = {
+    "customers": ["id", "first_name", "last_name", "email", "created_at"],
+    "orders": ["id", "customer_id", "order_date", "status", "total_amount"],
+    "order_items": ["id", "order_id", "product_id", "quantity", "unit_price"],
+    "products": ["id", "name", "category_id", "price", "sku"],
+    "categories": ["id", "name", "parent_id"],
+    "suppliers": ["id", "company_name", "contact_email", "country"],
+    "inventory": ["id", "product_id", "warehouse_id", "quantity_on_hand"],
+    "warehouses": ["id", "name", "city", "country"],
+    "shipments": ["id", "order_id", "carrier", "shipped_at", "delivered_at", "tracking_number"],
+    "payments": ["id", "order_id", "amount", "method", "paid_at"],
+    "refunds": ["id", "payment_id", "amount", "reason", "refunded_at"],
+    "reviews": ["id", "product_id", "customer_id", "rating", "body", "created_at"],
+    "employees": ["id", "first_name", "last_name", "department_id", "hire_date", "salary"],
+    "departments": ["id", "name", "budget"],
+    "locations": ["id", "name", "latitude", "longitude", "country"],
+    "flights": ["id", "origin_location_id", "destination_location_id", "departs_at", "arrives_at"],
+    "bookings": ["id", "flight_id", "customer_id", "seat", "booked_at"],
+    "coupons": ["id", "code", "discount_percent", "expires_at"],
+    "support_tickets": ["id", "customer_id", "subject", "status", "opened_at", "closed_at"],
+    "page_views": ["id", "session_id", "url", "viewed_at"],
+    "sessions": ["id", "customer_id", "started_at", "device"],
+    "currencies": ["id", "code", "exchange_rate"],
+    "taxes": ["id", "country", "rate"],
+    "audit_logs": ["id", "actor", "action", "logged_at"],
+}
+
+# (question, the table it needs)
+QUESTIONS = [
+    ("Get me the locations with the name Bariloche", "locations"),
+    ("Which customers signed up after September 23?", "customers"),
+    ("What is the average star rating of each product?", "reviews"),
+    ("How much money did we refund last month and why?", "refunds"),
+    ("List packages that were delivered late by each carrier", "shipments"),
+    ("Who earns the most in each department?", "employees"),
+    ("How many units of stock are left in each warehouse?", "inventory"),
+    ("Which flights depart from Buenos Aires tomorrow?", "flights"),
+    ("Show seat reservations made by frequent travellers", "bookings"),
+    ("Which promo codes expire this week?", "coupons"),
+    ("How many complaints are still open?", "support_tickets"),
+    ("Which pages are visited most?", "page_views"),
+    ("What devices do visitors browse with?", "sessions"),
+    ("Convert totals to euros using the latest rates", "currencies"),
+    ("What sales tax applies in Argentina?", "taxes"),
+    ("Who deleted records yesterday?", "audit_logs"),
+    ("Which vendors ship from China?", "suppliers"),
+    ("What are the best selling products by quantity?", "order_items"),
+    ("How were orders paid, card or transfer?", "payments"),
+    ("Which subcategories belong to electronics?", "categories"),
+    ("What is each team's annual budget?", "departments"),
+    ("How many purchases were cancelled?", "orders"),
+]
+
+
+def max_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend_name, n_tables, top_n):
+    from postgres_da_ai_agent.modules.embeddings.embeddings import (
+        DatabaseEmbedder,
+        create_embedding_backend,
+    )
+
+    rss_before = max_rss_mb()
+
+    start = time.perf_counter()
+    backend = create_embedding_backend(backend_name)
+    load_time = time.perf_counter() - start
+    rss_loaded = max_rss_mb()
+
+    texts = list(make_table_definitions(n_tables, 40).values())
+    backend.embed(texts[:8])
+    start = time.perf_counter()
+    backend.embed(texts)
+    embed_time = time.perf_counter() - start
+
+    database_embedder = DatabaseEmbedder(backend=backend)
+    database_embedder.add_tables({
+        table_name: PostgresDB.format_create_table_stmt(
+            table_name, [(column_name, "text") for column_name in column_names])
+        for table_name, column_names in SCHEMA.items()
+    })
+
+    embedding_hits = hybrid_hits = 0
+    for question, table_name in QUESTIONS:
+        embedding_hits += table_name in database_embedder.get_similar_tables_via_embeddings(question, top_n)
+        hybrid_hits += table_name in database_embedder.get_similar_tables(question, top_n)
+
+    return {
+        "backend": backend_name,
+        "dimension": backend.dimension,
+        "rss_mb": rss_loaded - rss_before,
+        "load_s": load_time,
+        "tables_per_s": n_tables / embed_time,
+        "embedding_hit_rate": embedding_hits / len(QUESTIONS),
+        "hybrid_hit_rate": hybrid_hits / len(QUESTIONS),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["bert", "bert-int8", "minilm", "hashing"])
+    parser.add_argument("--tables", type=int, default=256,
+                        help="Synthetic table definitions embedded to measure throughput")
+    parser.add_argument("--top-n", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'backend':>10} | {'dim':>5} | {'RSS MB':>7} | {'load s':>6} | {'tables/s':>9}"
+          f" | {f'emb hit@{args.top_n}':>9} | {f'hybrid hit@{args.top_n}':>12}")
+
+    spawn = multiprocessing.get_context("spawn")
+    for backend_name in args.backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            result = executor.submit(run_backend, backend_name, args.tables, args.top_n).result()
+
+        print(
+            f"{result['backend']:>10} | {result['dimension']:>5} | {result['rss_mb']:>7.0f} | {result['load_s']:>6.2f}"
+            f" | {result['tables_per_s']:>9.1f} | {result['embedding_hit_rate']:>9.0%} | {result['hybrid_hit_rate']:>12.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark table embedding throughput: the per-table add_table() loop vs
+batched add_tables() at several batch sizes.
+
+    python -m benchmarks.bench_embeddings --tables 256 --batch-sizes 1 8 32 64 --threads 8
+
+Table definitions are synthetic, with a random number of columns so that
+batches contain definitions of different lengths.
+"""
+import argparse
+import random
+import time
+
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
+
+COLUMN_TYPES = ["integer", "text", "uuid", "timestamp without time zone",
+                "numeric(12,2)", "boolean", "character varying(255)"]
+
+
+def make_table_definitions(n_tables, max_columns, seed=0):
+    rng = random.Random(seed)
+    return {
+        f"table_{t:05d}": PostgresDB.format_create_table_stmt(
+            f"table_{t:05d}",
+            [
+                (f"column_{c}", rng.choice(COLUMN_TYPES))
+                for c in range(rng.randint(2, max_columns))
+            ],
+        )
+        for t in range(n_tables)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", type=int, default=256)
+    parser.add_argument("--max-columns", type=int, default=40)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    map_table_name_to_table_def = make_table_definitions(
+        args.tables, args.max_columns)
+
+    embedder = DatabaseEmbedder(num_threads=args.threads)
+
+    start = time.perf_counter()
+    for table_name, table_def in map_table_name_to_table_def.items():
+        embedder.add_table(table_name, table_def)
+    elapsed = time.perf_counter() - start
+    print(f"{'add_table loop':>20} | {args.tables / elapsed:>8.1f} tables/sec")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        embedder.add_tables(map_table_name_to_table_def, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{f'add_tables bs={batch_size}':>20} | {args.tables / elapsed:>8.1f} tables/sec")
+
+
+if __name__ == "__main__":
+    main()
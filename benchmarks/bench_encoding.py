@@ -0,0 +1,66 @@
+"""
+Benchmark run_sql result encodings: tokens (cl100k_base, as counted by
+llm.count_tokens) and encode time per format, on synthetic rows.
+
+    python -m benchmarks.bench_encoding --rows 10 100 1000 --columns 8
+"""
+import argparse
+from datetime import datetime, timedelta
+import random
+import time
+
+from postgres_da_ai_agent.modules.encoding.encoding import ENCODERS, fit_to_token_budget
+from postgres_da_ai_agent.modules.llm.llm import count_tokens
+
+
+def make_rows(n_rows, n_columns, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 9, 23)
+    generators = [
+        lambda: rng.randint(1, 10**6),
+        lambda: rng.choice(["bariloche", "barrancas", "mendoza", "rosario", None]),
+        lambda: start + timedelta(minutes=rng.randint(0, 10**5)),
+        lambda: round(rng.uniform(-90, 90), 6),
+        lambda: rng.choice([True, False]),
+    ]
+    columns = [f"column_{c}" for c in range(n_columns)]
+    kinds = [generators[c % len(generators)] for c in range(n_columns)]
+    rows = [tuple(kind() for kind in kinds) for _ in range(n_rows)]
+    return columns, rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--token-budget", type=int, default=2000,
+                        help="Also time fitting each result to this many tokens")
+    args = parser.parse_args()
+
+    for n_rows in args.rows:
+        columns, rows = make_rows(n_rows, args.columns)
+        print(f"\n{n_rows} rows x {args.columns} columns")
+        print(f"{'format':>14} | {'tokens':>8} | {'vs json':>7} | {'encode ms':>9} | {'fit ms':>8} | {'rows in budget':>14}")
+
+        json_tokens = None
+        for name, encoder in ENCODERS.items():
+            start = time.perf_counter()
+            row_texts = [encoder.row(columns, row) for row in rows]
+            text = encoder.encode(columns, row_texts)
+            encode_time = time.perf_counter() - start
+
+            tokens = count_tokens(text)
+            json_tokens = json_tokens or tokens
+
+            start = time.perf_counter()
+            kept = fit_to_token_budget(encoder, columns, row_texts, args.token_budget)
+            fit_time = time.perf_counter() - start
+
+            print(
+                f"{name:>14} | {tokens:>8} | {tokens / json_tokens:>6.0%} | {encode_time * 1000:>9.2f}"
+                f" | {fit_time * 1000:>8.2f} | {len(kept):>14}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Offline end-to-end benchmark: every stage of answering a question, timed
+separately, against a generated schema and a deterministic fake LLM.
+
+    python -m benchmarks.bench_end_to_end --database-url postgresql://localhost/bench \
+        --tables 200 --columns 10 --fk-density 1.5 --rows 5000 --output bench_e2e.json
+
+The schema is generated as 'bench_*' tables in the public schema of
+--database-url (use a throwaway database: the introspection stages read the
+whole public schema) and dropped afterwards unless --keep. No OpenAI key or
+network access is needed: openai.ChatCompletion.create is replaced by a fake
+that answers each agent deterministically, the Sr_Data_Analyst with a
+run_sql call and the fast path with a confident query.
+
+Stages: introspection, model_load, embedding, retrieval, fk_expansion,
+prompt_building, orchestration (conversation time minus fake LLM and run_sql
+time), run_sql, and conversation and fast_path, the whole answer by the data
+engineering team and by the fast path (see --llm-latency-ms). Results are written as JSON; with --baseline, stages whose median
+got slower than the baseline by more than --tolerance are reported and the
+exit code is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import openai
+from openai.util import convert_to_openai_object
+import psycopg2
+
+ENTITIES = [
+    "customer", "order", "product", "invoice", "payment", "shipment", "supplier", "employee",
+    "store", "region", "category", "review", "campaign", "ticket", "account", "location",
+]
+ATTRIBUTES = [
+    ("name", "varchar(255)", "'name ' || g"),
+    ("status", "varchar(32)", "(ARRAY['open','closed','pending'])[1 + g % 3]"),
+    ("amount", "numeric(12,2)", "(g * 7919 % 100000) / 100.0"),
+    ("created_at", "timestamp", "timestamp '2023-01-01' + g * interval '1 minute'"),
+    ("quantity", "integer", "g % 97"),
+    ("email", "varchar(255)", "'user' || g || '@example.com'"),
+    ("city", "varchar(64)", "(ARRAY['bariloche','mendoza','rosario','salta'])[1 + g % 4]"),
+    ("score", "double precision", "(g * 31 % 1000) / 10.0"),
+    ("is_active", "boolean", "g % 2 = 0"),
+    ("code", "varchar(16)", "md5(g::text)"),
+]
+
+
+class Timings:
+    """
+    Durations per stage, summarized as count, mean, median, p95, min, max
+    """
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def summary(self):
+        result = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[stage] = {
+                "count": len(samples),
+                "mean": round(statistics.fmean(samples), 6),
+                "median": round(statistics.median(samples), 6),
+                "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 6),
+                "min": round(ordered[0], 6),
+                "max": round(ordered[-1], 6),
+            }
+        return result
+
+
+class BenchSchema:
+    """
+    A generated schema: 'n_tables' tables of 'n_columns' columns, each table
+    referencing on average 'fk_density' earlier tables, 'n_rows' rows each
+    """
+
+    def __init__(self, n_tables, n_columns, fk_density, n_rows, seed=0):
+        rng = random.Random(seed)
+        self.n_rows = n_rows
+        self.tables = {}
+        self.foreign_keys = {}
+
+        for t in range(n_tables):
+            entity = ENTITIES[t % len(ENTITIES)]
+            name = f"bench_{entity}_{t:04d}"
+            self.tables[name] = [
+                (f"{entity}_{attribute}", sql_type, expression)
+                for attribute, sql_type, expression in rng.sample(ATTRIBUTES, min(n_columns, len(ATTRIBUTES)))
+            ]
+
+            earlier = list(self.tables)[:-1]
+            n_fks = int(fk_density) + (rng.random() < fk_density % 1)
+            self.foreign_keys[name] = rng.sample(earlier, min(n_fks, len(earlier)))
+
+    def create(self, conn):
+        with conn.cursor() as cur:
+            self.drop(conn)
+            for name, columns in self.tables.items():
+                definitions = ["id serial PRIMARY KEY"]
+                definitions += [f"{column} {sql_type}" for column, sql_type, _ in columns]
+                definitions += [f"{parent}_id integer REFERENCES {parent}(id)" for parent in self.foreign_keys[name]]
+                cur.execute(f"CREATE TABLE {name} ({', '.join(definitions)})")
+
+                insert_columns = [column for column, _, _ in columns]
+                expressions = [expression for _, _, expression in columns]
+                insert_columns += [f"{parent}_id" for parent in self.foreign_keys[name]]
+                expressions += [f"1 + g % {self.n_rows}" for _ in self.foreign_keys[name]]
+                cur.execute(
+                    f"INSERT INTO {name} ({', '.join(insert_columns)}) "
+                    f"SELECT {', '.join(expressions)} FROM generate_series(1, {self.n_rows}) AS g"
+                )
+            cur.execute("ANALYZE")
+
+    def drop(self, conn):
+        with conn.cursor() as cur:
+            for name in reversed(list(self.tables)):
+                cur.execute(f"DROP TABLE IF EXISTS {name} CASCADE")
+
+    def questions(self, n, seed=0):
+        """
+        (question, sql) pairs over random tables, joining a parent table when
+        there is one
+        """
+        rng = random.Random(seed)
+        pairs = []
+        for name in rng.sample(list(self.tables), min(n, len(self.tables))):
+            column = self.tables[name][0][0]
+            entity = name.split("_")[1]
+            parents = self.foreign_keys[name]
+            if parents:
+                parent = parents[0]
+                parent_column = self.tables[parent][0][0]
+                question = f"How many {entity} rows are there per {parent_column.replace('_', ' ')}?"
+                sql = (
+                    f"SELECT p.{parent_column}, COUNT(*) AS total FROM {name} c "
+                    f"JOIN {parent} p ON c.{parent}_id = p.id "
+                    f"GROUP BY p.{parent_column} ORDER BY total DESC LIMIT 10"
+                )
+            else:
+                question = f"Show the latest {entity} rows with their {column.replace('_', ' ')}"
+                sql = f"SELECT * FROM {name} ORDER BY id DESC LIMIT 20"
+            pairs.append((question, sql))
+        return pairs
+
+
+class FakeChatCompletion:
+    """
+    Deterministic stand-in for openai.ChatCompletion.create.
+
+    The Sr_Data_Analyst answers with a run_sql call of 'sql', then reports the
+    result, the Product_Manager approves, the fast path answers with 'sql' and
+    full confidence and every other agent answers with 'sql'.
+    """
+
+    def __init__(self, analyst_system_message, approver_system_message, fast_path_system_message=None, latency=0.0):
+        self.analyst_system_message = analyst_system_message
+        self.approver_system_message = approver_system_message
+        self.fast_path_system_message = fast_path_system_message
+        self.latency = latency
+        self.sql = "SELECT 1"
+        self.calls = 0
+        self.elapsed = 0.0
+
+    def create(self, *args, **params):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+
+        messages = params.get("messages", [])
+        system_message = messages[0].get("content") if messages else None
+        if system_message == self.analyst_system_message and messages[-1].get("role") != "function":
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {"name": "run_sql", "arguments": json.dumps({"sql": self.sql})},
+            }
+        elif system_message == self.analyst_system_message:
+            message = {"role": "assistant", "content": f"Results:\n{messages[-1].get('content')}"}
+        elif system_message == self.approver_system_message:
+            message = {"role": "assistant", "content": "APPROVED"}
+        elif system_message == self.fast_path_system_message:
+            message = {
+                "role": "assistant",
+                "content": json.dumps({"sql": self.sql, "confidence": 1.0, "ambiguities": []}),
+            }
+        else:
+            message = {"role": "assistant", "content": f"Here is the query:\n{self.sql}"}
+
+        prompt_tokens = sum(len(str(m.get("content") or "")) // 4 for m in messages)
+        response = convert_to_openai_object({
+            "id": f"fake-{self.calls}",
+            "object": "chat.completion",
+            "model": params.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+        })
+
+        self.calls += 1
+        self.elapsed += time.perf_counter() - started
+        return response
+
+
+def compare_with_baseline(result, baseline_path, tolerance):
+    """
+    Stages whose median grew by more than 'tolerance' (a fraction) since the baseline
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)["stages"]
+
+    regressions = []
+    for stage, stats in result["stages"].items():
+        if stage not in baseline or not baseline[stage]["median"]:
+            continue
+        ratio = stats["median"] / baseline[stage]["median"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                {"stage": stage, "baseline": baseline[stage]["median"], "median": stats["median"], "ratio": round(ratio, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"),
+                        help="Throwaway database the schema is generated in (or BENCH_DATABASE_URL)")
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--fk-density", type=float, default=1.0,
+                        help="Average number of foreign keys per table")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per table")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of the cheap stages (introspection, retrieval, prompt, run_sql)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0,
+                        help="Simulated latency of every fake completion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_e2e.json")
+    parser.add_argument("--baseline", help="Previous --output to compare medians with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown of a stage median over the baseline, as a fraction")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tables")
+    args = parser.parse_args()
+
+    assert args.database_url, "--database-url or BENCH_DATABASE_URL is required"
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+    from postgres_da_ai_agent.modules.agents.agents import create_data_engineering_agents
+    from postgres_da_ai_agent.modules.config.config import (
+        get_history_compaction_config,
+        get_schema_prompt_config,
+    )
+    from postgres_da_ai_agent.modules.db.db import PostgresDB
+    from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
+    from postgres_da_ai_agent.modules.fastpath.fastpath import FastPath
+    from postgres_da_ai_agent.modules.history.history import HistoryCompaction
+    from postgres_da_ai_agent.modules.orchestrator.orchestrator import Orchestrator
+    from postgres_da_ai_agent.modules.pipeline.pipeline import get_first_prompt
+    from postgres_da_ai_agent.modules.prompts.prompts import (
+        DATA_ANALYST_PROMPT,
+        FAST_PATH_PROMPT,
+        PRODUCT_MANAGER_PROMPT,
+        get_first_instruction_pompt,
+    )
+
+    fake = FakeChatCompletion(
+        DATA_ANALYST_PROMPT, PRODUCT_MANAGER_PROMPT, FAST_PATH_PROMPT, args.llm_latency_ms / 1000)
+    openai.ChatCompletion.create = fake.create
+
+    schema = BenchSchema(args.tables, args.columns, args.fk_density, args.rows, args.seed)
+    questions = schema.questions(args.questions, args.seed)
+    timings = Timings()
+
+    setup_conn = psycopg2.connect(args.database_url)
+    setup_conn.autocommit = True
+    with setup_conn.cursor() as cur:
+        cur.execute("SHOW server_version")
+        server_version = cur.fetchone()[0]
+
+    print(f"Generating {args.tables} tables x {args.rows} rows...")
+    with timings.timer("schema_generation"):
+        schema.create(setup_conn)
+
+    try:
+        with PostgresDB() as db:
+            db.connect_with_url(args.database_url)
+
+            for _ in range(args.repeat):
+                with timings.timer("introspection"):
+                    map_table_name_to_table_def = db.get_table_definition_map_for_embeddings()
+                    foreign_keys = db.get_foreign_keys()
+                db.conn.rollback()
+
+            with timings.timer("model_load"):
+                database_embedder = DatabaseEmbedder()
+
+            with timings.timer("embedding"):
+                database_embedder.add_tables(map_table_name_to_table_def)
+            database_embedder.set_foreign_keys(foreign_keys)
+
+            schema_prompt_config = get_schema_prompt_config()
+            history_compaction_config = get_history_compaction_config()
+            for _ in range(args.repeat):
+                for question, _ in questions:
+                    with timings.timer("retrieval"):
+                        similar_tables = database_embedder.get_similar_tables(question)
+
+                    with timings.timer("fk_expansion"):
+                        similar_tables += database_embedder.get_related_tables(similar_tables)
+
+                    with timings.timer("prompt_building"):
+                        if schema_prompt_config:
+                            table_definitions = database_embedder.get_compact_table_definitions_from_names(
+                                question, similar_tables, **schema_prompt_config)
+                        else:
+                            table_definitions = database_embedder.get_table_definitions_from_names(similar_tables)
+                        prompt = get_first_instruction_pompt(
+                            question, table_definitions, compact=bool(schema_prompt_config))
+
+            for _ in range(args.repeat):
+                for _, sql in questions:
+                    with timings.timer("run_sql"):
+                        db.run_sql(sql)
+                    db.conn.rollback()
+
+            run_sql_time = [0.0]
+            run_sql = db.run_sql
+
+            def timed_run_sql(sql):
+                started = time.perf_counter()
+                try:
+                    return run_sql(sql)
+                finally:
+                    run_sql_time[0] += time.perf_counter() - started
+
+            db.run_sql = timed_run_sql
+
+            successes = fast_path_answers = 0
+            for question, sql in questions:
+                fake.sql = sql
+                prompt = get_first_prompt(database_embedder, question)
+
+                llm_time_before, run_sql_time[0] = fake.elapsed, 0.0
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    orchestrator = Orchestrator(
+                        "bench", create_data_engineering_agents(db),
+                        compaction=HistoryCompaction(**history_compaction_config) if history_compaction_config else None,
+                    )
+                    success, _ = orchestrator.sequential_conversation(prompt)
+                elapsed = time.perf_counter() - started
+
+                successes += success
+                timings.add("conversation", elapsed)
+                timings.add("orchestration", elapsed - (fake.elapsed - llm_time_before) - run_sql_time[0])
+
+                with timings.timer("fast_path"):
+                    fast_path_answers += FastPath(db).run(prompt)["answered"]
+                db.conn.rollback()
+    finally:
+        if not args.keep:
+            schema.drop(setup_conn)
+        setup_conn.close()
+
+    result = {
+        "config": {
+            "tables": args.tables,
+            "columns": args.columns,
+            "fk_density": args.fk_density,
+            "rows": args.rows,
+            "questions": len(questions),
+            "repeat": args.repeat,
+            "llm_latency_ms": args.llm_latency_ms,
+            "seed": args.seed,
+        },
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "postgres": server_version,
+        },
+        "conversations": {
+            "count": len(questions),
+            "successful": successes,
+            "fast_path_answered": fast_path_answers,
+            "llm_calls": fake.calls,
+        },
+        "stages": timings.summary(),
+    }
+
+    exit_code = 0
+    if args.baseline:
+        result["regressions"] = compare_with_baseline(result, args.baseline, args.tolerance)
+        exit_code = 1 if result["regressions"] else 0
+
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    print(f"{'stage':>18} | {'count':>5} | {'median ms':>10} | {'p95 ms':>10}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:>18} | {stats['count']:>5} | {stats['median'] * 1000:>10.2f} | {stats['p95'] * 1000:>10.2f}")
+    for regression in result.get("regressions", []):
+        print(f"⚠️ {regression['stage']} regressed: x{regression['ratio']} of the baseline median")
+    print(f"Results written to {args.output}")
+
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark schema introspection: one catalog query per table vs a single bulk query.
+
+Round trips are counted by wrapping the cursor. By default the catalog is a
+synthetic one served from memory with a simulated network round trip, so the
+benchmark runs without a database:
+
+    python -m benchmarks.bench_introspection --tables 10 100 1000 4000 --rtt-ms 1
+
+Pass --database-url to time both modes against the public schema of a real
+database instead (read only, nothing is created).
+"""
+import argparse
+import time
+
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+
+
+class CountingCursor:
+    """
+    Proxy a cursor, counting round trips and optionally sleeping on each one
+    """
+
+    def __init__(self, cur, rtt=0.0):
+        self.cur = cur
+        self.rtt = rtt
+        self.round_trips = 0
+
+    def execute(self, sql, params=None):
+        self.round_trips += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+        return self.cur.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cur, name)
+
+
+class FakeCatalogCursor:
+    """
+    Answer the introspection queries of PostgresDB from a synthetic catalog
+    """
+
+    def __init__(self, n_tables, n_columns):
+        self.catalog = {
+            f"table_{t:05d}": [
+                (attnum, f"column_{attnum}", "character varying(255)")
+                for attnum in range(1, n_columns + 1)
+            ]
+            for t in range(n_tables)
+        }
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        if "pg_tables" in sql:
+            self.rows = [(name,) for name in self.catalog]
+        elif "relname = %s" in sql:
+            name = params[0]
+            self.rows = [(name, *col) for col in self.catalog.get(name, [])]
+        else:
+            self.rows = [
+                (name, *col)
+                for name in sorted(self.catalog)
+                for col in self.catalog[name]
+            ]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def run_mode(db, bulk):
+    db.cur.round_trips = 0
+    start = time.perf_counter()
+    definitions = db.get_table_definition_map_for_embeddings(bulk=bulk)
+    elapsed = time.perf_counter() - start
+    return definitions, db.cur.round_trips, elapsed
+
+
+def bench(db, label):
+    per_table, per_table_trips, per_table_time = run_mode(db, bulk=False)
+    bulk, bulk_trips, bulk_time = run_mode(db, bulk=True)
+    assert per_table == bulk, "bulk and per-table definitions differ"
+    print(
+        f"{label:>12} | per-table: {per_table_trips:>6} trips {per_table_time * 1000:>10.1f} ms"
+        f" | bulk: {bulk_trips:>2} trips {bulk_time * 1000:>8.1f} ms"
+        f" | speedup x{per_table_time / max(bulk_time, 1e-9):.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--columns", type=int, default=12)
+    parser.add_argument("--rtt-ms", type=float, default=0.5,
+                        help="Simulated round trip latency for the fake catalog")
+    parser.add_argument("--database-url",
+                        help="Benchmark against a real database instead")
+    args = parser.parse_args()
+
+    if args.database_url:
+        with PostgresDB() as db:
+            db.connect_with_url(args.database_url)
+            db.cur = CountingCursor(db.cur)
+            bench(db, "live")
+        return
+
+    for n_tables in args.tables:
+        db = PostgresDB()
+        db.cur = CountingCursor(
+            FakeCatalogCursor(n_tables, args.columns), rtt=args.rtt_ms / 1000
+        )
+        bench(db, f"{n_tables} tables")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark lexical retrieval: building the BM25 index over table and column
+names, and looking questions up in it, against the substring scan it
+replaced. Synthetic definitions, no model or database needed.
+
+    python -m benchmarks.bench_lexical --tables 1000 10000 40000 --columns 8
+"""
+import argparse
+import random
+import statistics
+import time
+
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.lexical.lexical import LexicalIndex
+
+WORDS = (
+    "user account order item product category location city country address payment invoice "
+    "shipment warehouse stock supplier customer employee department salary review rating "
+    "session event campaign coupon discount tax currency price status note tag label"
+).split()
+
+TYPES = ["integer", "text", "timestamp without time zone", "numeric(10,2)", "boolean"]
+
+
+def make_definitions(n_tables, n_columns, seed=0):
+    rng = random.Random(seed)
+    definitions = {}
+    while len(definitions) < n_tables:
+        table_name = "_".join(rng.sample(WORDS, rng.randint(1, 3))) + f"s_{len(definitions)}"
+        columns = [("id", "integer")] + [
+            ("_".join(rng.sample(WORDS, rng.randint(1, 2))) + rng.choice(["", "_id", "_at", "_name"]),
+             rng.choice(TYPES))
+            for _ in range(n_columns - 1)
+        ]
+        definitions[table_name] = PostgresDB.format_create_table_stmt(table_name, columns)
+    return definitions
+
+
+def make_questions(n_questions, seed=1):
+    rng = random.Random(seed)
+    return [
+        f"Get me the {rng.choice(WORDS)}s of every {rng.choice(WORDS)} with a {rng.choice(WORDS)} after September 23"
+        for _ in range(n_questions)
+    ]
+
+
+def substring_scan(table_names, query):
+    """
+    The word match lexical retrieval replaced
+    """
+    tables = []
+    for table_name in table_names:
+        if table_name.lower() in query.lower():
+            tables.append(table_name)
+    return tables
+
+
+def time_lookups(lookup, questions):
+    durations = []
+    for question in questions:
+        start = time.perf_counter()
+        lookup(question)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000, max(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", type=int, nargs="+", default=[1000, 10000, 40000])
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--questions", type=int, default=200)
+    args = parser.parse_args()
+
+    questions = make_questions(args.questions)
+
+    print(f"{'tables':>7} | {'identifiers':>11} | {'build ms':>8} | {'search p50 ms':>13} | {'search max ms':>13}"
+          f" | {'mentions p50 ms':>15} | {'substring p50 ms':>16}")
+
+    for n_tables in args.tables:
+        definitions = make_definitions(n_tables, args.columns)
+
+        start = time.perf_counter()
+        lexical_index = LexicalIndex(definitions)
+        build_time = time.perf_counter() - start
+
+        search_p50, search_max = time_lookups(lambda q: lexical_index.search(q, 10), questions)
+        mentions_p50, _ = time_lookups(lexical_index.mentioned_tables, questions)
+        table_names = list(definitions)
+        substring_p50, _ = time_lookups(lambda q: substring_scan(table_names, q), questions)
+
+        print(
+            f"{n_tables:>7} | {n_tables * (args.columns + 1):>11} | {build_time * 1000:>8.1f} | {search_p50:>13.3f}"
+            f" | {search_max:>13.3f} | {mentions_p50:>15.3f} | {substring_p50:>16.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
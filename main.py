@@ -1,95 +1,204 @@
+# imported first so that start-up metrics are relative to process start
+from postgres_da_ai_agent.modules.metrics.metrics import run_metrics
 import os
 import dotenv
 import argparse
-from postgres_da_ai_agent.modules.orchestrator.orchestrator import Orchestrator
-from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
-from postgres_da_ai_agent.modules.file.file import write_file
-from postgres_da_ai_agent.modules.utils.utils import get_date
-from postgres_da_ai_agent.modules.db.db import PostgresDB
-from postgres_da_ai_agent.modules.prompts.prompts import (
-    get_first_instruction_pompt,
-)
-from postgres_da_ai_agent.modules.agents.agents import (
-    admin_user_proxy_agent,
-    data_engineer_agent,
-    sr_data_analyst_agent,
-    product_manager_agent,
-    text_report_agent,
-)
+from concurrent.futures import ThreadPoolExecutor
 
-dotenv.load_dotenv()
+# Heavy modules (torch, transformers, autogen, openai) are imported inside the
+# functions that need them, so that --help and commands that don't talk to the
+# LLM start right away.
 
-assert os.environ.get(
-    "DATABASE_URL"), "POSTGRES_CONNECTION_URL not found in .env file"
-assert os.environ.get(
-    "OPENAI_API_KEY"), "OPENAI_API_KEY not found in .env file"
+dotenv.load_dotenv()
 
 DB_URL = os.environ.get("DATABASE_URL")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+SCHEMA_INDEX_PATH = os.environ.get("SCHEMA_INDEX_PATH", ".schema_index")
+METRICS_PATH = os.environ.get("METRICS_PATH", "metrics.jsonl")
+TRACE_PATH = os.environ.get("TRACE_PATH")
 
-AGENT_TEAM_NAME = "::: 🤖 Postgres Data Analytics Multi-Agent Team 🤖 :::"
 VIZ_AGENT_TEAM_NAME = "::: 🤖 Postgres Data Analytics Viz Team 🤖 :::"
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--prompt", help="The prompt for the AI model")
-    args = parser.parse_args()
+def assert_env(*names):
+    for name in names:
+        assert os.environ.get(name), f"{name} not found in .env file"
+
+
+def build_index(index_path, batch_size=32, num_threads=None):
+    """
+    Embed every table definition and persist the embeddings to 'index_path'.
+    Tables whose definition did not change since the last build are reused.
+    """
+    from postgres_da_ai_agent.modules.db.db import PostgresDB
+    from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
 
     with PostgresDB() as db:
         db.connect_with_url(DB_URL)
+        map_table_name_to_table_def = db.get_table_definition_map_for_embeddings()
+        foreign_keys = db.get_foreign_keys()
 
-        # table_definitions = db.get_table_definitions_for_prompt()
+    database_embedder = DatabaseEmbedder(num_threads=num_threads)
+    database_embedder.set_foreign_keys(foreign_keys)
 
-        map_table_name_to_table_def = db.get_table_definition_map_for_embeddings()
+    stale_tables = database_embedder.load_index(
+        index_path, map_table_name_to_table_def, batch_size)
+
+    database_embedder.save_index(index_path)
+
+    print(
+        f"Schema index written to {index_path}: {len(map_table_name_to_table_def)} tables, {len(stale_tables)} embedded")
+
+
+def timed(name, fn, *args):
+    """
+    Run fn(*args), recording its duration in the run metrics
+    """
+    with run_metrics.timer(name):
+        return fn(*args)
+
+
+def load_database_embedder():
+    from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
+
+    return DatabaseEmbedder()
+
+
+def load_schema_index(index_path):
+    from postgres_da_ai_agent.modules.embeddings.embeddings import get_embedding_index_name, get_schema_index_path
+    from postgres_da_ai_agent.modules.index.index import SchemaIndex
+
+    index_name = get_embedding_index_name()
+    return SchemaIndex(get_schema_index_path(index_path, index_name)).load(index_name)
+
+
+def create_agents(db):
+    from postgres_da_ai_agent.modules.agents.agents import create_data_engineering_agents
+
+    return create_data_engineering_agents(db)
+
+
+def warm_up(db, index_path):
+    """
+    Run the independent start-up stages concurrently: catalog and foreign
+    keys fetch, model load, index load and agent construction. The index is
+    then reconciled with the catalog, only changed or new tables are
+    embedded.
+    """
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        catalog_future = executor.submit(
+            timed, "warm_up_catalog", db.get_table_definition_map_for_embeddings)
+        foreign_keys_future = executor.submit(
+            timed, "warm_up_foreign_keys", db.get_foreign_keys)
+        embedder_future = executor.submit(
+            timed, "warm_up_model", load_database_embedder)
+        index_future = executor.submit(
+            timed, "warm_up_index", load_schema_index, index_path)
+        agents_future = executor.submit(
+            timed, "warm_up_agents", create_agents, db)
+
+        map_table_name_to_table_def = catalog_future.result()
+        database_embedder = embedder_future.result()
+        database_embedder.set_foreign_keys(foreign_keys_future.result())
+
+        stale_tables = database_embedder.merge_index(
+            index_future.result(), map_table_name_to_table_def)
+
+        if stale_tables:
+            database_embedder.save_index(index_path)
+
+        return database_embedder, agents_future.result()
+
+
+def install_llm_cache():
+    """
+    Share a disk-backed response cache between the agents and llm.prompt()
+    """
+    from postgres_da_ai_agent.modules.cache.cache import ResponseCache, install_response_cache
+    from postgres_da_ai_agent.modules.config.config import get_llm_cache_config
+
+    llm_cache_config = get_llm_cache_config()
+    if llm_cache_config is None:
+        return None
+
+    llm_cache = ResponseCache(**llm_cache_config)
+    install_response_cache(llm_cache)
+    return llm_cache
+
+
+def create_result_cache():
+    from postgres_da_ai_agent.modules.cache.cache import STALE_RESULTS_WARNING, QueryResultCache
+    from postgres_da_ai_agent.modules.config.config import get_result_cache_config
 
-        database_embedder = DatabaseEmbedder()
+    result_cache_config = get_result_cache_config()
+    if result_cache_config is None:
+        return None
+    print(STALE_RESULTS_WARNING)
+    return QueryResultCache(**result_cache_config)
 
-        for table_name, table_def in map_table_name_to_table_def.items():
-            database_embedder.add_table(table_name, table_def)
 
-        similar_tables = database_embedder.get_similar_tables(args.prompt)
+def run_prompt(user_prompt, index_path):
+    from postgres_da_ai_agent.modules.config.config import get_run_sql_config, get_stream_config
+    from postgres_da_ai_agent.modules.db.db import PostgresDB
+    from postgres_da_ai_agent.modules.file.file import write_file
+    from postgres_da_ai_agent.modules.utils.utils import get_date
+    from postgres_da_ai_agent.modules.pipeline.pipeline import run_adaptive
 
-        table_definitions = database_embedder.get_table_definitions_from_names(
-            similar_tables)
+    llm_cache = install_llm_cache()
+    result_cache = create_result_cache()
 
-        prompt = get_first_instruction_pompt(args.prompt, table_definitions)
+    with PostgresDB(**get_run_sql_config(), result_cache=result_cache) as db:
+        db.connect_with_url(DB_URL)
+
+        # table_definitions = db.get_table_definitions_for_prompt()
+
+        database_embedder, data_engineering_agents = warm_up(db, index_path)
+
+        run_metrics.mark("warm_up_done")
 
         """
-            Sequential agents
+            Fast path, escalating to the sequential agents
         """
 
-        data_engineering_agents = [
-            admin_user_proxy_agent,
-            data_engineer_agent,
-            sr_data_analyst_agent,
-            product_manager_agent,
-        ]
-
-        data_engineer_agent_orchestrator = Orchestrator(
-            name=AGENT_TEAM_NAME,
-            agents=data_engineering_agents,
-        )
-
-        success, data_engineer_messages = data_engineer_agent_orchestrator.sequential_conversation(
-            prompt)
-
-        # Here we grab, reversed, the last message content that does not contains APPROVED
-        try:
-            date = get_date()
-            data_analyst_result = data_engineer_messages[-7]["content"]
-            print(f"Writing file data_analyst_result_{date}")
-            write_file(f"data_analyst_result_{date}.txt", data_analyst_result)
-        except IndexError:
+        data_engineering_result = run_adaptive(
+            db, database_embedder, user_prompt, agents=data_engineering_agents, stream=get_stream_config())
+
+        print(
+            f"⏱️ Time to first LLM request: {run_metrics.values.get('time_to_first_llm_request')}s")
+        for stream in data_engineering_result["streams"]:
+            print(
+                f"⏱️ Streamed {stream['completion_tokens']} tokens: first token after {stream['time_to_first_token']}s, "
+                f"{stream['tokens_per_second']} tokens/s")
+        if llm_cache:
+            llm_cache_stats = llm_cache.stats()
+            run_metrics.record("llm_cache_hits", llm_cache_stats["hits"])
+            run_metrics.record("llm_cache_misses", llm_cache_stats["misses"])
+            print(
+                f"🗄️ LLM cache: {llm_cache_stats['hits']} hits, {llm_cache_stats['misses']} misses")
+        if result_cache:
+            result_cache_stats = result_cache.stats()
+            run_metrics.record("result_cache_hits", result_cache_stats["hits"])
+            run_metrics.record("result_cache_misses", result_cache_stats["misses"])
+            print(
+                f"🗄️ run_sql cache: {result_cache_stats['hits']} hits, {result_cache_stats['misses']} misses")
+        run_metrics.write(
+            METRICS_PATH, success=data_engineering_result["success"], mode=data_engineering_result["mode"])
+
+        data_analyst_result = data_engineering_result["result"]
+        if data_analyst_result is None:
             print("No data analyst result found")
             print("Exiting...")
             return
 
+        date = get_date()
+        print(f"Writing file data_analyst_result_{date}")
+        write_file(f"data_analyst_result_{date}.txt", data_analyst_result)
+
         # Broadcasting agents
 
         # data_viz_agents = [
-        #     admin_user_proxy_agent,
-        #     text_report_agent,
+        #     create_admin_user_proxy_agent(),
+        #     create_text_report_agent(),
         # ]
 
         # data_viz_orchestrator = Orchestrator(
@@ -101,12 +210,98 @@ def main():
 
         # data_viz_orchestrator.broadcast_conversation(data_viz_prompt)
 
-        data_eng_team_cost, data_eng_tokens = data_engineer_agent_orchestrator.get_cost_and_tokens()
-
         # data_viz_team_cost, data_viz_tokens = data_viz_orchestrator.get_cost_and_tokens()
 
         print(
-            f"ℹ️ Data eng cost: ${data_eng_team_cost}, Tokens: {data_eng_tokens}")
+            f"ℹ️ Data eng cost: ${data_engineering_result['cost']}, Tokens: {data_engineering_result['tokens']}")
+        for agent_name, agent_usage in data_engineering_result["usage"]["by_agent"].items():
+            print(
+                f"   {agent_name}: ${round(agent_usage['cost'], 4)}, prompt tokens: {agent_usage['prompt_tokens']}, completion tokens: {agent_usage['completion_tokens']}")
+
+
+def run_batch(questions_path, output_path, index_path, workers):
+    from postgres_da_ai_agent.modules.batch.batch import run_batch as run_question_batch
+    from postgres_da_ai_agent.modules.server.server import AgentServer
+    from postgres_da_ai_agent.modules.utils.utils import get_date
+
+    output_path = output_path or f"batch_results_{get_date()}.jsonl"
+
+    summary = run_question_batch(
+        AgentServer(DB_URL, index_path, pool_size=workers, watch_schema=False), questions_path, output_path, workers)
+
+    run_metrics.write(METRICS_PATH, **summary)
+
+    print(
+        f"📊 {summary['succeeded']}/{summary['questions']} questions succeeded in {summary['elapsed']}s "
+        f"({summary['questions_per_minute']} questions/minute, {workers} workers), cost: ${summary['cost']}")
+    print(f"Results written to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompt", help="The prompt for the AI model")
+    parser.add_argument(
+        "--index-path", default=SCHEMA_INDEX_PATH, help="Directory of the persisted schema embedding index")
+    parser.add_argument(
+        "--batch", help="Answer every question of a JSONL file, one {\"question\": ...} per line")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Questions answered concurrently in --batch mode")
+    parser.add_argument(
+        "--output", help="JSONL file the --batch answers are appended to (default batch_results_<date>.jsonl)")
+    parser.add_argument(
+        "--trace", default=TRACE_PATH, help="Write a Chrome trace (JSON) of the run to this file")
+
+    subparsers = parser.add_subparsers(dest="command")
+    index_parser = subparsers.add_parser(
+        "index", help="Manage the schema embedding index")
+    index_parser.add_argument("index_command", choices=["build"])
+    index_parser.add_argument(
+        "--batch-size", type=int, default=32, help="Table definitions embedded per model call")
+    index_parser.add_argument(
+        "--threads", type=int, default=None, help="Torch threads used for embedding")
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Answer prompts over HTTP with a warm model, index and connections")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument(
+        "--pool-size", type=int, default=4, help="Database connections, i.e. prompts answered concurrently")
+
+    args = parser.parse_args()
+
+    if not args.trace:
+        return run_command(args)
+
+    from postgres_da_ai_agent.modules.tracing.tracing import tracer
+
+    tracer.enable()
+    try:
+        return run_command(args)
+    finally:
+        tracer.export(args.trace)
+
+
+def run_command(args):
+    if args.command == "index":
+        assert_env("DATABASE_URL")
+        build_index(args.index_path, args.batch_size, args.threads)
+        return
+
+    assert_env("DATABASE_URL", "OPENAI_API_KEY")
+
+    if args.command == "serve":
+        from postgres_da_ai_agent.modules.server.server import AgentServer, serve
+
+        serve(AgentServer(DB_URL, args.index_path, args.pool_size), args.host, args.port)
+        return
+
+    if args.batch:
+        run_batch(args.batch, args.output, args.index_path, args.workers)
+        return
+
+    assert args.prompt, "--prompt or --batch is required"
+
+    run_prompt(args.prompt, args.index_path)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,9 @@
-import os
-import dotenv
 from autogen import (
     AssistantAgent,
     UserProxyAgent,
 )
 from postgres_da_ai_agent.modules.file.file import write_file
-from postgres_da_ai_agent.modules.config.config import gpt4_config, write_file_config
+from postgres_da_ai_agent.modules.config.config import get_gpt4_config, get_write_file_config
 from postgres_da_ai_agent.modules.utils.utils import in_termination_msg
 from postgres_da_ai_agent.modules.prompts.prompts import (
     USER_PROXY_PROMPT,
@@ -16,64 +14,80 @@ from postgres_da_ai_agent.modules.prompts.prompts import (
 )
 from postgres_da_ai_agent.modules.db.db import PostgresDB
 
-dotenv.load_dotenv()
+# Agents are built by factories instead of at import time: every call returns
+# agents with their own conversation state, and run_sql is bound to the
+# PostgresDB the caller passes in.
 
-assert os.environ.get(
-    "DATABASE_URL"), "POSTGRES_CONNECTION_URL not found in .env file"
+write_file_function_map = {
+    "write_file": write_file
+}
 
-DB_URL = os.environ.get("DATABASE_URL")
 
-db = PostgresDB()
-db.connect_with_url(DB_URL)
+def create_admin_user_proxy_agent():
+    return UserProxyAgent(
+        name="Admin",
+        system_message=USER_PROXY_PROMPT,
+        code_execution_config=False,
+        human_input_mode="NEVER",
+        is_termination_msg=in_termination_msg,
+    )
 
-function_map = {
-    "run_sql": db.run_sql
-}
 
-write_file_function_map = {
-    "write_file": write_file
-}
+def create_data_engineer_agent():
+    return AssistantAgent(
+        name="Data_Engineer",
+        llm_config=get_gpt4_config(),
+        system_message=DATA_ENGINEER_PROMPT,
+        code_execution_config=False,
+        human_input_mode="NEVER",
+        is_termination_msg=in_termination_msg,
+    )
 
-admin_user_proxy_agent = UserProxyAgent(
-    name="Admin",
-    system_message=USER_PROXY_PROMPT,
-    code_execution_config=False,
-    human_input_mode="NEVER",
-    is_termination_msg=in_termination_msg,
-)
 
-data_engineer_agent = AssistantAgent(
-    name="Data_Engineer",
-    llm_config=gpt4_config,
-    system_message=DATA_ENGINEER_PROMPT,
-    code_execution_config=False,
-    human_input_mode="NEVER",
-    is_termination_msg=in_termination_msg,
-)
+def create_sr_data_analyst_agent(db: PostgresDB):
+    function_map = {
+        "run_sql": db.run_sql
+    }
 
-sr_data_analyst_agent = AssistantAgent(
-    name="Sr_Data_Analyst",
-    llm_config=gpt4_config,
-    system_message=DATA_ANALYST_PROMPT,
-    human_input_mode="NEVER",
-    code_execution_config=False,
-    is_termination_msg=in_termination_msg,
-    function_map=function_map,
-)
+    return AssistantAgent(
+        name="Sr_Data_Analyst",
+        llm_config=get_gpt4_config(),
+        system_message=DATA_ANALYST_PROMPT,
+        human_input_mode="NEVER",
+        code_execution_config=False,
+        is_termination_msg=in_termination_msg,
+        function_map=function_map,
+    )
 
-product_manager_agent = AssistantAgent(
-    name="Product_Manager",
-    llm_config=gpt4_config,
-    system_message=PRODUCT_MANAGER_PROMPT,
-    human_input_mode="NEVER",
-    code_execution_config=False,
-    is_termination_msg=in_termination_msg,
-)
 
-text_report_agent = AssistantAgent(
-    name="Text_Report_Analyst",
-    llm_config=write_file_config,
-    system_message=TEXT_REPORT_ANALYSIS_PROMPT,
-    human_input_mode="NEVER",
-    function_map=write_file_function_map
-)
+def create_product_manager_agent():
+    return AssistantAgent(
+        name="Product_Manager",
+        llm_config=get_gpt4_config(),
+        system_message=PRODUCT_MANAGER_PROMPT,
+        human_input_mode="NEVER",
+        code_execution_config=False,
+        is_termination_msg=in_termination_msg,
+    )
+
+
+def create_text_report_agent():
+    return AssistantAgent(
+        name="Text_Report_Analyst",
+        llm_config=get_write_file_config(),
+        system_message=TEXT_REPORT_ANALYSIS_PROMPT,
+        human_input_mode="NEVER",
+        function_map=write_file_function_map
+    )
+
+
+def create_data_engineering_agents(db: PostgresDB):
+    """
+    The sequential data engineering team, in conversation order
+    """
+    return [
+        create_admin_user_proxy_agent(),
+        create_data_engineer_agent(),
+        create_sr_data_analyst_agent(db),
+        create_product_manager_agent(),
+    ]
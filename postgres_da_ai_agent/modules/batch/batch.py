@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import time
+from postgres_da_ai_agent.modules.server.server import AgentServer
+
+# Batch mode: one warm AgentServer (model, schema index, connection pool)
+# answers every question of a JSONL file, 'workers' at a time.
+#
+# Input, one question per line:  {"id": "q1", "question": "..."}
+# ("prompt" is accepted instead of "question", "id" defaults to the line number)
+#
+# Output, one line per question, in the order they finish:
+#   {"id", "question", "success", "mode", "result", "cost", "tokens", "usage", "duration", "error"}
+
+
+def read_questions(path: str) -> list:
+    """
+    (id, question) of every non-empty line of 'path'
+    """
+    questions = []
+    with open(path) as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {"question": entry}
+            question = entry.get("question") or entry.get("prompt")
+            if not question:
+                raise ValueError(f"{path}:{line_number} has no 'question'")
+            questions.append((entry.get("id", line_number), question))
+    return questions
+
+
+def answer_question(agent_server: AgentServer, question_id, question: str) -> dict:
+    """
+    One output line, errors included instead of raised
+    """
+    started = time.perf_counter()
+    try:
+        result = agent_server.answer(question)
+        error = None
+    except Exception as e:
+        result = {}
+        error = str(e)
+
+    return {
+        "id": question_id,
+        "question": question,
+        "success": bool(result.get("success")),
+        "mode": result.get("mode"),
+        "result": result.get("result"),
+        "cost": result.get("cost"),
+        "tokens": result.get("tokens"),
+        "usage": (result.get("usage") or {}).get("by_agent"),
+        "duration": round(time.perf_counter() - started, 3),
+        "error": error,
+    }
+
+
+def run_batch(agent_server: AgentServer, questions_path: str, output_path: str, workers: int = 4) -> dict:
+    """
+    Answer every question of 'questions_path', appending each answer to
+    'output_path' as soon as it is ready. Returns a summary with the
+    throughput in questions per minute.
+    """
+    questions = read_questions(questions_path)
+
+    agent_server.start()
+
+    started = time.perf_counter()
+    succeeded = 0
+    cost = 0.0
+
+    try:
+        with open(output_path, "a") as output, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(answer_question, agent_server, question_id, question)
+                for question_id, question in questions
+            ]
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                line = future.result()
+                output.write(json.dumps(line, default=str) + "\n")
+                output.flush()
+
+                succeeded += line["success"]
+                cost += line["cost"] or 0
+                print(
+                    f"📝 [{done}/{len(questions)}] {line['id']}: {'✅' if line['success'] else '❌'} in {line['duration']}s")
+    finally:
+        agent_server.close()
+
+    elapsed = time.perf_counter() - started
+
+    return {
+        "questions": len(questions),
+        "succeeded": succeeded,
+        "cost": round(cost, 4),
+        "elapsed": round(elapsed, 3),
+        "questions_per_minute": round(len(questions) / elapsed * 60, 2) if elapsed else None,
+        "workers": workers,
+    }
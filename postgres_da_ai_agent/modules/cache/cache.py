@@ -0,0 +1,344 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import openai
+from openai.util import convert_to_openai_object
+from postgres_da_ai_agent.modules.streaming.streaming import install_stream_hook
+from postgres_da_ai_agent.modules.usage.usage import install_usage_hook, uninstall_usage_hook
+
+# Request parameters that change what the model answers. Everything else
+# (timeouts, api keys, retry settings) is left out of the cache key.
+RESPONSE_KEY_PARAMS = [
+    "model",
+    "engine",
+    "messages",
+    "functions",
+    "function_call",
+    "temperature",
+    "top_p",
+    "n",
+    "stop",
+    "max_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "logit_bias",
+]
+
+
+class ResponseCache:
+    """
+    Content-addressed, disk-backed cache of chat completion responses.
+
+    Entries live in a sqlite file, keyed by a hash of the request parameters
+    that determine the answer. Entries older than 'max_age' seconds are
+    treated as misses, and once the cache grows past 'max_bytes' the least
+    recently used entries are evicted. By default only deterministic
+    requests (temperature 0) are cached.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+        only_deterministic: bool = True,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.only_deterministic = only_deterministic
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+
+    def key_for(self, params: dict):
+        """
+        Cache key of a request, None if the request must not be cached
+        """
+        if params.get("stream"):
+            return None
+        if self.only_deterministic and params.get("temperature", 1) != 0:
+            return None
+
+        key_params = {name: params[name] for name in RESPONSE_KEY_PARAMS if name in params}
+        canonical = json.dumps(key_params, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+
+            self.conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, response: dict):
+        payload = json.dumps(response, default=str)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now),
+            )
+            self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used ones past max_bytes
+        """
+        evicted = self.conn.execute(
+            "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+        ).rowcount
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            freed = 0
+            keys = []
+            for key, size in self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access"
+            ):
+                if total - freed <= self.max_bytes:
+                    break
+                keys.append(key)
+                freed += size
+            self.conn.executemany(
+                "DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+            evicted += len(keys)
+
+        self.evictions += evicted
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+_original_chat_completion_create = None
+
+
+def install_response_cache(cache: ResponseCache):
+    """
+    Route every openai.ChatCompletion.create call through 'cache'.
+
+    Both llm.prompt() and the autogen agents end up calling
+    openai.ChatCompletion.create, so this makes them share one cache.
+    Cached responses carry "cached": True. Streamed responses (modules/streaming)
+    are cached once assembled.
+
+    Whatever the install order, the cache wraps the stream hook and the usage
+    hook (modules/usage), if installed, is put back on top of the cache, so
+    each completion is recorded once, cached or not.
+    """
+    global _original_chat_completion_create
+
+    install_stream_hook()
+    records_usage = uninstall_usage_hook()
+
+    if _original_chat_completion_create is None:
+        _original_chat_completion_create = openai.ChatCompletion.create
+    create = _original_chat_completion_create
+
+    def cached_create(*args, **params):
+        key = None if args else cache.key_for(params)
+        if key is None:
+            return create(*args, **params)
+
+        cached = cache.get(key)
+        if cached is not None:
+            cached["cached"] = True
+            return convert_to_openai_object(cached)
+
+        response = create(**params)
+        cache.set(key, response.to_dict_recursive())
+        return response
+
+    openai.ChatCompletion.create = cached_create
+    if records_usage:
+        install_usage_hook()
+
+
+def uninstall_response_cache():
+    global _original_chat_completion_create
+
+    if _original_chat_completion_create is not None:
+        records_usage = uninstall_usage_hook()
+        openai.ChatCompletion.create = _original_chat_completion_create
+        _original_chat_completion_create = None
+        if records_usage:
+            install_usage_hook()
+
+
+# Functions whose result changes between calls, queries using them are never cached
+VOLATILE_SQL_PATTERN = re.compile(
+    r"\b(now|random|clock_timestamp|statement_timestamp|timeofday|nextval|currval|setval|"
+    r"gen_random_uuid|uuid_generate_v\d\w*|txid_current|pg_sleep)\s*\(|"
+    r"\bcurrent_(date|time|timestamp|user)\b|\blocaltime(stamp)?\b",
+    re.IGNORECASE,
+)
+
+QUOTED_SQL_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapse whitespace and lowercase everything outside quoted literals and
+    identifiers, and drop the trailing semicolon
+    """
+    parts = QUOTED_SQL_PATTERN.split(sql.strip().rstrip(";").strip())
+    return "".join(
+        part if idx % 2 else re.sub(r"\s+", " ", part).lower()
+        for idx, part in enumerate(parts)
+    )
+
+
+STALE_RESULTS_WARNING = (
+    "⚠️ RUN_SQL_CACHE is on: writes by other clients can take about a second to invalidate "
+    "cached run_sql results, a stale result can be served meanwhile")
+
+
+class QueryResultCache:
+    """
+    In-memory cache of run_sql results (the statuses of
+    PostgresDB.run_sql_status), keyed by normalized SQL text.
+
+    Each entry remembers the tables the query read and their modification
+    counters (see PostgresDB.get_table_versions) at the time it ran. A hit is
+    only served after checking the counters are unchanged. Entries are also
+    dropped after 'ttl' seconds, and the least recently used ones are evicted
+    to stay under 'max_bytes'.
+
+    The cache is best-effort, not exact: other clients' writes only show in
+    the counters once their backend flushes its statistics, up to about a
+    second after they commit, and a stale result can be served until then.
+    Writes made through run_sql clear it right away. Only turn it on
+    (RUN_SQL_CACHE=1) where that staleness is acceptable, see
+    STALE_RESULTS_WARNING.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (status, relations, versions, created), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def key_for(self, sql: str, settings: tuple = ()):
+        """
+        Cache key of a query, None if its result can't be cached
+        """
+        if VOLATILE_SQL_PATTERN.search(sql):
+            return None
+        return (normalize_sql(sql), settings)
+
+    def get(self, key):
+        """
+        The (status, relations, versions) cached for 'key', None if missing
+        or expired. The caller must check the versions are still current.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[3] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[:3]
+
+    def record_hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def invalidate(self, key):
+        """
+        Drop an entry whose tables changed since it was cached
+        """
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.stale += 1
+            self.misses += 1
+
+    def set(self, key, status: dict, relations: list, versions: dict):
+        """
+        Cache 'status', its size being the length of its result text
+        """
+        if len(status["result"]) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (status, relations, versions, time.monotonic())
+            self.size += len(status["result"])
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+    def _remove(self, key):
+        status = self.entries.pop(key)[0]
+        self.size -= len(status["result"])
@@ -1,54 +1,229 @@
-from autogen import config_list_from_models
-
-base_config = {
-    "use_cache": False,
-    "temperature": 0,
-    "config_list": config_list_from_models(["gpt-4"]),
-    "request_timeout": 120,
-}
-
-gpt4_config = {
-    **base_config,
-    "functions": [
-        {
-            "name": "run_sql",
-            "description": "Run the SQL query agains the DB",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "sql": {
-                        "type": "string",
-                        "description": "SQL query to run against the DB",
-                    },
+from functools import lru_cache
+import os
+
+EMBEDDING_MODEL_NAME = "bert-base-uncased"
+
+# Configs are built on demand: config_list_from_models pulls in autogen and
+# reads the environment, which commands that never call the LLM don't need.
+
+
+@lru_cache(maxsize=None)
+def get_config_list(model: str = "gpt-4"):
+    from autogen import config_list_from_models
+
+    return config_list_from_models([model])
+
+
+def get_base_config():
+    return {
+        "use_cache": False,
+        "temperature": 0,
+        "config_list": get_config_list("gpt-4"),
+        "request_timeout": 120,
+    }
+
+
+def get_run_sql_config():
+    """
+    PostgresDB settings for the results run_sql hands back to the agents,
+    see modules/encoding for the formats
+    """
+    return {
+        "result_format": os.environ.get("RUN_SQL_RESULT_FORMAT", "json"),
+        "token_budget": int(os.environ.get("RUN_SQL_TOKEN_BUDGET", "0")) or None,
+        **get_sql_sandbox_config(),
+    }
+
+
+def get_sql_sandbox_config():
+    """
+    Limits on the queries run_sql executes, 0 turns a limit off: read-only
+    transaction, statement timeout (ms), work_mem, and the planner's
+    estimated total cost and rows past which a query is rejected unrun
+    """
+    return {
+        "read_only": os.environ.get("RUN_SQL_READ_ONLY", "1") != "0",
+        "statement_timeout": int(os.environ.get("RUN_SQL_STATEMENT_TIMEOUT", 30_000)) or None,
+        "work_mem": os.environ.get("RUN_SQL_WORK_MEM", "64MB") or None,
+        "max_total_cost": float(os.environ.get("RUN_SQL_MAX_TOTAL_COST", 1_000_000)) or None,
+        "max_estimated_rows": float(os.environ.get("RUN_SQL_MAX_ESTIMATED_ROWS", 1_000_000)) or None,
+    }
+
+
+def get_llm_cache_config():
+    """
+    ResponseCache settings, None when LLM_CACHE=0 turns the cache off
+    """
+    if os.environ.get("LLM_CACHE", "1") == "0":
+        return None
+    return {
+        "path": os.environ.get("LLM_CACHE_PATH", ".llm_cache/responses.sqlite3"),
+        "max_bytes": int(os.environ.get("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+        "max_age": float(os.environ.get("LLM_CACHE_MAX_AGE", 7 * 24 * 3600)),
+    }
+
+
+def get_result_cache_config():
+    """
+    QueryResultCache settings for run_sql, None unless RUN_SQL_CACHE=1 turns
+    the cache on. Off by default because it can serve stale results: other
+    clients' writes invalidate it only once Postgres reports them in
+    pg_stat_all_tables, up to about a second after they commit.
+    """
+    if os.environ.get("RUN_SQL_CACHE", "0") != "1":
+        return None
+    return {
+        "max_bytes": int(os.environ.get("RUN_SQL_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        "ttl": float(os.environ.get("RUN_SQL_CACHE_TTL", 300)),
+    }
+
+
+def get_schema_watch_config():
+    """
+    SchemaWatcher settings, None when SCHEMA_WATCH_INTERVAL=0 turns the
+    watcher off
+    """
+    interval = float(os.environ.get("SCHEMA_WATCH_INTERVAL", 60))
+    if not interval:
+        return None
+    return {
+        "interval": interval,
+        "channel": os.environ.get("SCHEMA_WATCH_CHANNEL") or None,
+    }
+
+
+def get_embedding_backend_config():
+    """
+    The DatabaseEmbedder backend: bert (default), bert-int8, minilm or
+    hashing, and optionally the model it loads
+    """
+    return {
+        "backend": os.environ.get("EMBEDDING_BACKEND", "bert"),
+        "model_name": os.environ.get("EMBEDDING_MODEL") or None,
+    }
+
+
+def get_schema_prompt_config():
+    """
+    Compact, column-pruned table definitions in the first prompt, None when
+    SCHEMA_PROMPT_COMPACT=0 keeps the full CREATE TABLE definitions
+    """
+    if os.environ.get("SCHEMA_PROMPT_COMPACT", "1") == "0":
+        return None
+    return {
+        "max_columns": int(os.environ.get("SCHEMA_PROMPT_MAX_COLUMNS", 12)) or None,
+        "token_budget": int(os.environ.get("SCHEMA_PROMPT_TOKEN_BUDGET", 1500)) or None,
+    }
+
+
+def get_history_compaction_config():
+    """
+    HistoryCompaction settings for the agents' chat history, None when
+    HISTORY_TOKEN_CEILING=0 turns compaction off. HISTORY_TOKEN_CEILINGS
+    sets ceilings per agent, as "Sr_Data_Analyst=6000,Product_Manager=2000".
+    """
+    token_ceiling = int(os.environ.get("HISTORY_TOKEN_CEILING", 3000))
+    if not token_ceiling:
+        return None
+    agent_token_ceilings = {}
+    for entry in os.environ.get("HISTORY_TOKEN_CEILINGS", "").split(","):
+        if "=" in entry:
+            agent_name, ceiling = entry.split("=", 1)
+            agent_token_ceilings[agent_name.strip()] = int(ceiling)
+    return {
+        "token_ceiling": token_ceiling,
+        "digest_tokens": int(os.environ.get("HISTORY_DIGEST_TOKENS", 200)),
+        "agent_token_ceilings": agent_token_ceilings,
+    }
+
+
+def get_fk_expansion_config():
+    """
+    ForeignKeyGraph.expand settings for the tables added next to the similar
+    ones, None when FK_EXPANSION_HOPS=0 turns the expansion off
+    """
+    hops = int(os.environ.get("FK_EXPANSION_HOPS", 2))
+    if not hops:
+        return None
+    return {
+        "hops": hops,
+        "limit": int(os.environ.get("FK_EXPANSION_LIMIT", 3)),
+    }
+
+
+def get_stream_config() -> bool:
+    """
+    Whether the interactive CLI streams the fast path completion and the
+    final turn of the conversation, STREAM_COMPLETIONS=0 waits for whole
+    responses. The server and batch mode never stream.
+    """
+    return os.environ.get("STREAM_COMPLETIONS", "1") != "0"
+
+
+def get_fast_path_config():
+    """
+    FastPath settings, None when ADAPTIVE_MODE=0 sends every prompt to the
+    whole data engineering team
+    """
+    if os.environ.get("ADAPTIVE_MODE", "1") == "0":
+        return None
+    return {
+        "min_confidence": float(os.environ.get("FAST_PATH_MIN_CONFIDENCE", 0.8)),
+        "model": os.environ.get("FAST_PATH_MODEL", "gpt-4"),
+    }
+
+
+RUN_SQL_FUNCTIONS = [
+    {
+        "name": "run_sql",
+        "description": "Run the SQL query agains the DB",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "sql": {
+                    "type": "string",
+                    "description": "SQL query to run against the DB",
                 },
-                "required": ["sql"],
-            }
+            },
+            "required": ["sql"],
         }
-    ]
-}
+    }
+]
+
+
+def get_gpt4_config():
+    return {
+        **get_base_config(),
+        "functions": RUN_SQL_FUNCTIONS,
+    }
+
 
 # write file configuration
 
-write_file_config = {
-    **base_config,
-    "functions": [
-        {
-            "name": "write_file",
-            "description": "Write text to a file",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "file_name": {
-                        "type": "string",
-                        "description": "File name to write to",
-                    },
-                    "content": {
-                        "type": "string",
-                        "description": "Text to write to the file",
-                    },
+WRITE_FILE_FUNCTIONS = [
+    {
+        "name": "write_file",
+        "description": "Write text to a file",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "file_name": {
+                    "type": "string",
+                    "description": "File name to write to",
+                },
+                "content": {
+                    "type": "string",
+                    "description": "Text to write to the file",
                 },
-                "required": ["file_name", "content"],
-            }
+            },
+            "required": ["file_name", "content"],
         }
-    ]
-}
\ No newline at end of file
+    }
+]
+
+
+def get_write_file_config():
+    return {
+        **get_base_config(),
+        "functions": WRITE_FILE_FUNCTIONS,
+    }
@@ -1,58 +1,830 @@
-from datetime import datetime
+from contextlib import contextmanager
 import json
+import threading
+import time
+import uuid
 import psycopg2
-from psycopg2.sql import SQL, Identifier
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.sql import SQL, Identifier, Literal
+from postgres_da_ai_agent.modules.encoding.encoding import (
+    TRUNCATION_NOTE_TOKENS,
+    choose_encoder,
+    fit_to_token_budget,
+    get_encoder,
+    json_default,
+)
+from postgres_da_ai_agent.modules.graph.graph import ForeignKeyGraph
+from postgres_da_ai_agent.modules.llm.llm import count_tokens
+from postgres_da_ai_agent.modules.statements.statements import (
+    EXPLAINABLE_KEYWORDS,
+    is_row_returning,
+    split_statements,
+    statement_keyword,
+)
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
+
+
+# the error of the result run_sql() returns instead of running a query over
+# the plan limits
+QUERY_REJECTED = "QUERY_REJECTED"
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no pooled connection became available in time
+    """
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of postgres connections.
+
+    Connections are created on demand up to 'max_size'; past that, acquire()
+    waits for one to be released. Connections idle for longer than
+    'health_check_interval' seconds are checked with a 'SELECT 1' before being
+    handed out, and released connections are rolled back, so a failed
+    statement never leaks an aborted transaction to the next user.
+    """
+
+    def __init__(self, url: str, max_size: int = 4, health_check_interval: float = 30.0):
+        self.url = url
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.condition = threading.Condition()
+        # (connection, last release time), most recently released last
+        self.idle = []
+        self.size = 0
+        self.in_use = 0
+        self.closed = False
+
+        self.created = 0
+        self.discarded = 0
+        self.acquisitions = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self, timeout: float = None):
+        """
+        Check out a healthy connection, waiting up to 'timeout' seconds
+        (forever if None) when all 'max_size' connections are in use
+        """
+        started = time.perf_counter()
+        deadline = None if timeout is None else started + timeout
+
+        while True:
+            conn, last_used = self._reserve(deadline)
+
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(self.url)
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.created += 1
+                break
+
+            if self._is_healthy(conn, last_used):
+                break
+
+            self._discard(conn)
+
+        waited = time.perf_counter() - started
+        with self.condition:
+            self.in_use += 1
+            self.acquisitions += 1
+            self.total_wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection, rolling back any open transaction
+        """
+        healthy = not conn.closed
+        if healthy and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+
+        with self.condition:
+            self.in_use -= 1
+            if healthy and not self.closed:
+                self.idle.append((conn, time.monotonic()))
+                self.condition.notify()
+                return
+
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "max_size": self.max_size,
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "created": self.created,
+                "discarded": self.discarded,
+                "acquisitions": self.acquisitions,
+                "total_wait_time": round(self.total_wait_time, 4),
+                "avg_wait_time": round(self.total_wait_time / self.acquisitions, 4) if self.acquisitions else 0.0,
+                "max_wait_time": round(self.max_wait_time, 4),
+            }
+
+    def close(self):
+        """
+        Close the idle connections; connections in use are closed on release
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn, _last_used in idle:
+            self._discard(conn)
+
+    def _reserve(self, deadline):
+        """
+        Take an idle connection, or a slot to open a new one (returns None)
+        """
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise PoolTimeoutError("The connection pool is closed")
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None, None
+
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No connection available after waiting, all {self.max_size} are in use")
+                self.condition.wait(remaining)
+
+    def _is_healthy(self, conn, last_used) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.discarded += 1
+            self.condition.notify()
 
 
 class PostgresDB:
     """
     A class to manage postgres connections and queries
+
+    Either connected to a single dedicated connection (connect_with_url), or
+    to a ConnectionPool (connect_with_pool), in which case every query checks
+    out a connection for its own duration and the object can be shared by
+    many threads. session() pins one pooled connection, e.g. per conversation.
+
+    run_sql() streams query results from a server-side cursor and stops at
+    'max_rows' rows or 'max_bytes' bytes of output, whichever comes first,
+    so a careless 'SELECT *' never pulls a whole table into memory.
+
+    Results are encoded with 'result_format' (see modules/encoding: json,
+    compact_json, columnar, csv, tsv or auto) and, given a 'token_budget',
+    rows are dropped ('head' keeps the first ones, 'even' samples across the
+    result) until the encoded result fits.
+
+    Given a 'result_cache' (modules/cache QueryResultCache), repeated queries
+    are answered from it as long as none of the tables they read changed,
+    as far as the statistics collector knows (see get_table_versions).
+
+    run_sql() queries run sandboxed: in a 'read_only' transaction, with a
+    'statement_timeout' (milliseconds) and a 'work_mem' cap, if set. With
+    'max_total_cost' or 'max_estimated_rows', a query whose plan is estimated
+    above either is not run: run_sql() returns why, with the plan and hints,
+    so the agent can rewrite it.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_rows=1000,
+        max_bytes=1_000_000,
+        fetch_size=500,
+        count_omitted_rows=0,
+        result_format="json",
+        token_budget=None,
+        sampling="head",
+        result_cache=None,
+        read_only=False,
+        statement_timeout=None,
+        work_mem=None,
+        max_total_cost=None,
+        max_estimated_rows=None,
+    ):
         self.conn = None
         self.cur = None
+        self.pool = None
+        # serializes use of the dedicated connection's cursor across threads
+        self.lock = threading.RLock()
+
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.fetch_size = fetch_size
+        # when a result is truncated, skip over up to this many more rows
+        # server-side to report how many were left out. Off by default: the
+        # server still has to produce every row it skips.
+        self.count_omitted_rows = count_omitted_rows
+        self.result_format = result_format
+        self.token_budget = token_budget
+        self.sampling = sampling
+        # shared with the sessions, so cached results outlive a conversation
+        self.result_cache = result_cache
+        self.read_only = read_only
+        self.statement_timeout = statement_timeout
+        self.work_mem = work_mem
+        self.max_total_cost = max_total_cost
+        self.max_estimated_rows = max_estimated_rows
+
+    @property
+    def settings(self):
+        return {
+            "max_rows": self.max_rows,
+            "max_bytes": self.max_bytes,
+            "fetch_size": self.fetch_size,
+            "count_omitted_rows": self.count_omitted_rows,
+            "result_format": self.result_format,
+            "token_budget": self.token_budget,
+            "sampling": self.sampling,
+            "result_cache": self.result_cache,
+            "read_only": self.read_only,
+            "statement_timeout": self.statement_timeout,
+            "work_mem": self.work_mem,
+            "max_total_cost": self.max_total_cost,
+            "max_estimated_rows": self.max_estimated_rows,
+        }
+
+    @property
+    def sandbox_settings(self) -> list:
+        """
+        (setting, value) applied to the transaction of each run_sql() query
+        """
+        settings = []
+        if self.read_only:
+            settings.append(("transaction_read_only", "on"))
+        if self.statement_timeout:
+            settings.append(("statement_timeout", str(int(self.statement_timeout))))
+        if self.work_mem:
+            settings.append(("work_mem", str(self.work_mem)))
+        return settings
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.cur:
-            self.cur.close()
-        if self.conn:
-            self.conn.close()
+        self.close()
 
     def connect_with_url(self, url):
         self.conn = psycopg2.connect(url)
         self.cur = self.conn.cursor()
 
+    def connect_with_pool(self, url, max_size=4, health_check_interval=30.0):
+        self.pool = ConnectionPool(url, max_size, health_check_interval)
+
     def close(self):
         if self.cur:
             self.cur.close()
         if self.conn:
             self.conn.close()
+        if self.pool:
+            self.pool.close()
+
+    @contextmanager
+    def cursor(self, name=None):
+        """
+        Cursor for one unit of work: the dedicated connection's cursor, or a
+        connection checked out of the pool for the duration of the block.
+        Any error rolls the transaction back before being re-raised.
+
+        With a 'name' the cursor is a server-side (named) cursor.
+        """
+        if self.pool is None:
+            with self.lock:
+                cur = self.cur if name is None else self.conn.cursor(name=name)
+                try:
+                    yield cur
+                except Exception:
+                    if self.conn is not None and not self.conn.closed:
+                        self.conn.rollback()
+                    raise
+                finally:
+                    if name is not None:
+                        cur.close()
+            return
+
+        with self.pool.connection() as conn:
+            with conn.cursor(name=name) as cur:
+                yield cur
+
+    @contextmanager
+    def connection(self):
+        """
+        The connection for one unit of work: the dedicated connection, or one
+        checked out of the pool for the duration of the block. Any error
+        rolls the transaction back before being re-raised.
+        """
+        if self.pool is None:
+            with self.lock:
+                try:
+                    yield self.conn
+                except Exception:
+                    if self.conn is not None and not self.conn.closed:
+                        self.conn.rollback()
+                    raise
+            return
+
+        with self.pool.connection() as conn:
+            yield conn
 
-    def run_sql(self, sql) -> str:
+    @contextmanager
+    def session(self):
+        """
+        A PostgresDB pinned to one pooled connection until the block exits.
+        Without a pool, this is the object itself.
+        """
+        if self.pool is None:
+            yield self
+            return
+
+        with self.pool.connection() as conn:
+            session_db = PostgresDB(**self.settings)
+            session_db.conn = conn
+            session_db.cur = conn.cursor()
+            try:
+                yield session_db
+            finally:
+                session_db.cur.close()
+
+    def run_sql(self, sql, max_rows=None, max_bytes=None) -> str:
         """
         Run a SQL query against the postgres database
+
+        Queries are streamed from a server-side cursor. The result stops at
+        'max_rows' rows or 'max_bytes' bytes (defaulting to the instance
+        settings) and is fitted to the token budget, if any. A truncation
+        note telling how many rows were left out is appended after it.
+
+        A query the planner estimates over 'max_total_cost' or
+        'max_estimated_rows' is not run, the rejection is returned instead.
+        With either limit set, 'sql' must be a single statement EXPLAIN can
+        plan: several statements, or one EXPLAIN can't check, are rejected
+        the same way.
+        """
+        return self.run_query(sql, max_rows, max_bytes)["result"]
+
+    def run_sql_status(self, sql, max_rows=None, max_bytes=None) -> dict:
+        """
+        run_sql(), for callers that act on the outcome rather than pass the
+        result on to an agent:
+            "result": what run_sql() returns, "Error: ..." if the query failed
+            "rows": the number of rows in the result, None if the statement
+                returns none
+            "rejected": whether the plan limits kept the query from running
+            "error": the database error, None if there was none
+        """
+        try:
+            return self.run_query(sql, max_rows, max_bytes)
+        except psycopg2.Error as e:
+            return {"result": f"Error: {e}", "rows": None, "rejected": False, "error": str(e).strip()}
+
+    def run_query(self, sql, max_rows=None, max_bytes=None) -> dict:
+        """
+        run_sql(), returning the status run_sql_status() does but raising
+        database errors
+        """
+        with tracer.span("run_sql", sql=sql):
+            statements = split_statements(sql)
+            if len(statements) == 1:
+                sql = statements[0]
+
+            plan = None
+            if self.max_total_cost or self.max_estimated_rows:
+                rejection = self.check_statements(statements)
+                if rejection is None:
+                    plan = self.explain(sql)
+                    rejection = self.check_plan(plan)
+                if rejection is not None:
+                    tracer.annotate(rejected=True)
+                    return {"result": rejection, "rows": None, "rejected": True, "error": None}
+            return self.run_sql_cached(sql, max_rows, max_bytes, plan)
+
+    def run_sql_cached(self, sql, max_rows=None, max_bytes=None, plan=None) -> dict:
+        """
+        run_query() through the result cache, if any. 'plan' is the query's
+        plan if explain() was already called.
+        """
+        max_rows = self.max_rows if max_rows is None else max_rows
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+        if self.result_cache is None:
+            return self.execute_sql(sql, max_rows, max_bytes)
+
+        if not self.is_single_query(sql):
+            # may write to any table, forget everything cached so far
+            self.result_cache.clear()
+            return self.execute_sql(sql, max_rows, max_bytes)
+
+        key = self.result_cache.key_for(
+            sql, (max_rows, max_bytes, self.result_format, self.token_budget, self.sampling))
+
+        # only reads are cached, a hit needs no plan
+        cached = self.result_cache.get(key) if key is not None else None
+        if cached is not None:
+            status, relations, versions = cached
+            if self.get_table_versions(relations) == versions:
+                self.result_cache.record_hit()
+                tracer.annotate(cache="hit")
+                return status
+            self.result_cache.invalidate(key)
+
+        if plan is None:
+            plan = self.explain(sql)
+        if self.plan_writes(plan):
+            # e.g. WITH d AS (DELETE ... RETURNING *) SELECT * FROM d
+            self.result_cache.clear()
+            tracer.annotate(cache="write")
+            return self.execute_sql(sql, max_rows, max_bytes)
+        if key is None:
+            return self.execute_sql(sql, max_rows, max_bytes)
+
+        relations = self.get_query_relations(sql, plan)
+        # versions are read before running the query: a change made while it
+        # runs makes the entry stale instead of going unnoticed
+        versions = self.get_table_versions(relations) if relations else None
+        status = self.execute_sql(sql, max_rows, max_bytes)
+
+        if versions is not None:
+            self.result_cache.set(key, status, relations, versions)
+        return status
+
+    def execute_sql(self, sql, max_rows, max_bytes) -> dict:
+        """
+        Run 'sql' and return the status of its bounded, encoded result,
+        bypassing the cache
+        """
+        if self.is_single_query(sql):
+            try:
+                return self.execute_sandboxed(sql, max_rows, max_bytes, name=f"run_sql_{uuid.uuid4().hex}")
+            except psycopg2.errors.FeatureNotSupported:
+                # e.g. data-modifying statements in WITH can't be declared as a cursor
+                pass
+
+        return self.execute_sandboxed(sql, max_rows, max_bytes)
+
+    def execute_sandboxed(self, sql, max_rows, max_bytes, name=None) -> dict:
+        """
+        Run 'sql' in the sandbox, through a server-side cursor if 'name' is
+        given. The cursor is closed before the sandbox rolls the transaction
+        back: a named cursor can't be closed once its transaction ended.
+        """
+        with self.connection() as conn, self.sandbox(conn):
+            with conn.cursor(name=name) as cur:
+                cur.execute(sql)
+                return self.fetch_bounded(cur, max_rows, max_bytes)
+
+    @contextmanager
+    def sandbox(self, conn):
+        """
+        Apply the sandbox settings to the current transaction of 'conn' for
+        the duration of the block, then roll the transaction back so they
+        don't outlive it. Cursors opened in the block must be closed in it.
+        """
+        settings = self.sandbox_settings
+        if not settings:
+            yield
+            return
+
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT " + ", ".join(["set_config(%s, %s, true)"] * len(settings)),
+                [value for setting in settings for value in setting],
+            )
+        try:
+            yield
+        finally:
+            if not conn.closed:
+                conn.rollback()
+
+    def explain(self, sql) -> dict:
+        """
+        The root node of the estimated plan of 'sql', not running it
+        """
+        with tracer.span("catalog.explain"), self.cursor() as cur:
+            cur.execute("EXPLAIN (FORMAT JSON, VERBOSE) " + sql.strip().rstrip(";"))
+            plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def check_statements(self, statements: list):
+        """
+        None if 'statements' is a single statement the plan limits can be
+        checked on, otherwise the rejection run_sql() returns
+        """
+        if len(statements) != 1:
+            return self.rejection(
+                f"The input has {len(statements)} SQL statements, only a single statement can be run. "
+                "Send the statements one at a time.")
+        keyword = statement_keyword(statements[0])
+        if keyword not in EXPLAINABLE_KEYWORDS:
+            return self.rejection(
+                f"{keyword.upper()} statements can't be checked against the plan limits, "
+                f"only {', '.join(k.upper() for k in EXPLAINABLE_KEYWORDS)} statements can be run.")
+        return None
+
+    def check_plan(self, plan: dict):
+        """
+        None if 'plan' is within max_total_cost and max_estimated_rows,
+        otherwise the rejection run_sql() returns: json with the reasons, the
+        estimates, the top of the plan and hints to make the query cheaper
+        """
+        total_cost, estimated_rows = plan["Total Cost"], plan["Plan Rows"]
+
+        reasons = []
+        if self.max_total_cost and total_cost > self.max_total_cost:
+            reasons.append(
+                f"estimated cost {total_cost:.0f} is over the limit of {self.max_total_cost:.0f}")
+        if self.max_estimated_rows and estimated_rows > self.max_estimated_rows:
+            reasons.append(
+                f"estimated {estimated_rows:.0f} rows, over the limit of {self.max_estimated_rows:.0f}")
+        if not reasons:
+            return None
+
+        tracer.annotate(total_cost=total_cost, estimated_rows=estimated_rows)
+        return self.rejection(
+            f"The query was not run: {' and '.join(reasons)}. Rewrite it to be cheaper and run it again.",
+            total_cost=round(total_cost),
+            estimated_rows=round(estimated_rows),
+            max_total_cost=self.max_total_cost,
+            max_estimated_rows=self.max_estimated_rows,
+            plan=self.summarize_plan(plan),
+            hints=self.plan_hints(plan, estimated_rows),
+        )
+
+    @staticmethod
+    def rejection(reason: str, **details) -> str:
+        """
+        The result run_sql() returns instead of running a query
+        """
+        return json.dumps({"error": QUERY_REJECTED, "reason": reason, **details}, indent=1)
+
+    @staticmethod
+    def summarize_plan(plan: dict, max_nodes: int = 12) -> list:
+        """
+        The first 'max_nodes' nodes of 'plan', one indented line each
+        """
+        lines = []
+        nodes = [(plan, 0)]
+        while nodes and len(lines) < max_nodes:
+            node, depth = nodes.pop()
+            relation = f" on {node['Relation Name']}" if "Relation Name" in node else ""
+            lines.append(
+                f"{'  ' * depth}{node['Node Type']}{relation} (cost={node['Total Cost']:.0f} rows={node['Plan Rows']:.0f})")
+            nodes.extend((child, depth + 1) for child in reversed(node.get("Plans", [])))
+        return lines
+
+    def plan_hints(self, plan: dict, estimated_rows: float) -> list:
+        """
+        What to change in a rejected query, from the shape of its plan
+        """
+        hints = []
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            children = node.get("Plans", [])
+            nodes.extend(children)
+
+            if node["Node Type"] == "Nested Loop" and len(children) == 2:
+                outer_rows, inner_rows = children[0]["Plan Rows"], children[1]["Plan Rows"]
+                if outer_rows > 1 and inner_rows > 1 and node["Plan Rows"] >= outer_rows * inner_rows / 2:
+                    hints.append(
+                        "A join has no join condition and pairs every row with every other row: join on the foreign key columns.")
+            elif node["Node Type"] == "Seq Scan" and "Filter" not in node and node["Plan Rows"] > 100_000:
+                hints.append(
+                    f"{node.get('Relation Name')} is read whole ({node['Plan Rows']:.0f} rows): filter it with a WHERE clause.")
+
+        if self.max_estimated_rows and estimated_rows > self.max_estimated_rows:
+            hints.append("Return fewer rows: aggregate (COUNT, SUM, GROUP BY) or add a LIMIT.")
+        return list(dict.fromkeys(hints))
+
+    @staticmethod
+    def plan_writes(plan: dict) -> bool:
+        """
+        Whether 'plan' inserts, updates or deletes rows (has a ModifyTable
+        node), whatever the statement starts with
         """
-        self.cur.execute(sql)
-        columns = [desc[0] for desc in self.cur.description]
-        res = self.cur.fetchall()
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            if node["Node Type"] == "ModifyTable":
+                return True
+            nodes.extend(node.get("Plans", []))
+        return False
+
+    def get_query_relations(self, sql, plan: dict = None) -> list:
+        """
+        The tables and materialized views the plan of 'sql' reads, as
+        "schema.name", views being expanded to their underlying tables.
+        'plan' is the plan explain() returned, if already known.
+        """
+        if plan is None:
+            plan = self.explain(sql)
+
+        relations = set()
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            if "Relation Name" in node:
+                relations.add(f"{node.get('Schema', 'public')}.{node['Relation Name']}")
+            nodes.extend(node.get("Plans", []))
+        return sorted(relations)
+
+    def get_table_versions(self, relations):
+        """
+        Modification counters of 'relations' ("schema.name") from
+        pg_stat_all_tables: rows inserted, updated and deleted, plus the
+        relfilenode, which changes on TRUNCATE and table rewrites.
+        None if a relation has no statistics, e.g. a foreign table.
+
+        Other backends report their counters once their transaction commits,
+        up to about a second later. Writes made through run_sql itself clear
+        the result cache right away.
+        """
+        with tracer.span("catalog.get_table_versions") as span, self.cursor() as cur:
+            # statistics are otherwise snapshotted for the whole transaction
+            cur.execute("""
+            SELECT pg_stat_clear_snapshot();
+            SELECT s.schemaname || '.' || s.relname,
+                s.n_tup_ins, s.n_tup_upd, s.n_tup_del, c.relfilenode
+            FROM pg_stat_all_tables s
+            JOIN pg_class c ON c.oid = s.relid
+            WHERE s.schemaname || '.' || s.relname = ANY(%s)
+            """, (list(relations),))
+            rows = cur.fetchall()
+            span.set(rows=len(rows))
+
+        versions = {row[0]: tuple(row[1:]) for row in rows}
+        if len(versions) < len(relations):
+            return None
+        return versions
+
+    @staticmethod
+    def is_single_query(sql: str) -> bool:
+        """
+        Whether 'sql' is a single row-returning statement, i.e. can be run
+        through a server-side cursor. Comments, string literals, quoted
+        identifiers and dollar-quoted bodies are told apart from the
+        statement boundaries.
+        """
+        statements = split_statements(sql)
+        return len(statements) == 1 and is_row_returning(statements[0])
+
+    def fetch_bounded(self, cur, max_rows, max_bytes) -> dict:
+        """
+        Fetch an executed cursor in batches of 'fetch_size' rows, encoding
+        rows as they arrive and stopping early at 'max_rows' rows or
+        'max_bytes' bytes of output, then fit the result to the token budget.
+        Returns the status of run_sql_status().
+        """
+        # named cursors only get a description once something was fetched,
+        # client cursors can't fetch from a statement that returns no rows
+        batch = cur.fetchmany(self.fetch_size) if cur.name else None
+
+        if cur.description is None:
+            result = json.dumps({"status": cur.statusmessage, "rowcount": cur.rowcount})
+            return {"result": result, "rows": None, "rejected": False, "error": None}
+
+        columns = [desc[0] for desc in cur.description]
+        if batch is None:
+            batch = cur.fetchmany(self.fetch_size)
+
+        if self.result_format == "auto":
+            encoder = choose_encoder(columns, batch[:20])
+        else:
+            encoder = get_encoder(self.result_format)
+
+        row_texts = []
+        size = len(encoder.header(columns)) + len(encoder.footer())
+        limits_reached = []
+        unused_in_batch = 0
+
+        while batch:
+            for idx, row in enumerate(batch):
+                if len(row_texts) >= max_rows:
+                    limits_reached.append(f"{max_rows} rows")
+                else:
+                    row_text = encoder.row(columns, row)
+                    if size + len(row_text) + len(encoder.separator) > max_bytes:
+                        limits_reached.append(f"{max_bytes} bytes")
+                    else:
+                        row_texts.append(row_text)
+                        size += len(row_text) + len(encoder.separator)
+                        continue
+
+                unused_in_batch = len(batch) - idx
+                break
+
+            if limits_reached:
+                break
+            batch = cur.fetchmany(self.fetch_size)
+
+        fetched = len(row_texts)
+        stopped_early = bool(limits_reached)
+
+        if self.token_budget and (
+            stopped_early or count_tokens(encoder.encode(columns, row_texts)) > self.token_budget
+        ):
+            row_texts = fit_to_token_budget(
+                encoder, columns, row_texts, self.token_budget, self.sampling, TRUNCATION_NOTE_TOKENS)
+            if len(row_texts) < fetched:
+                limits_reached.append(f"{self.token_budget} tokens")
+
+        result = encoder.encode(columns, row_texts)
 
-        list_of_dicts = [dict(zip(columns, row)) for row in res]
+        tracer.annotate(
+            format=encoder.name, rows=len(row_texts), fetched=fetched, truncated=bool(limits_reached))
 
-        json_result = json.dumps(list_of_dicts, indent=4, default=self.datetime_handler)
+        status = {"result": result, "rows": len(row_texts), "rejected": False, "error": None}
+        if not limits_reached:
+            return status
 
-        return json_result
+        omitted, at_least = fetched - len(row_texts), False
+        if stopped_early:
+            remaining, at_least = self.count_remaining_rows(cur, unused_in_batch)
+            omitted = None if remaining is None else omitted + remaining
+
+        if self.sampling == "even" and len(row_texts) < fetched:
+            shown_text = f"showing {len(row_texts)} rows sampled evenly from the first {fetched}"
+        else:
+            shown_text = f"showing the first {len(row_texts)} rows"
+        if omitted is None:
+            omitted_text = "More rows were"
+        else:
+            omitted_text = f"{'At least ' if at_least else ''}{omitted} more rows were"
+
+        status["result"] = (
+            f"{result}\n"
+            f"-- TRUNCATED: {shown_text}. {omitted_text} left out "
+            f"(limit: {', '.join(limits_reached)}). Use filters, aggregates or a LIMIT to see the rest."
+        )
+        return status
+
+    def count_remaining_rows(self, cur, unused_in_batch):
+        """
+        (number of result rows not fetched yet, whether it is only a lower
+        bound), (None, False) if unknown
+        """
+        if not cur.name:
+            # client-side cursors hold the whole result, rowcount is exact
+            return cur.rowcount - cur.rownumber + unused_in_batch, False
+
+        if not self.count_omitted_rows:
+            return None, False
+
+        # skip over the rest of the result server-side, without transferring
+        # it, stopping after count_omitted_rows rows
+        with cur.connection.cursor() as move_cur:
+            move_cur.execute(
+                SQL("MOVE FORWARD {} IN {}").format(Literal(int(self.count_omitted_rows)), Identifier(cur.name)))
+            moved = move_cur.rowcount
+        return moved + unused_in_batch, moved >= self.count_omitted_rows
 
     def datetime_handler(self, obj):
         """
         Handle datetime objects when serializing to JSON.
         """
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return str(obj)  # or just return the object unchanged, or another default value
+        return json_default(obj)
 
     def get_table_definition(self, table_name):
         """
@@ -68,14 +840,99 @@ class PostgresDB:
         JOIN pg_namespace ON pg_namespace.oid = pg_class.relnamespace
         JOIN pg_attribute ON pg_attribute.attrelid = pg_class.oid
         WHERE pg_attribute.attnum > 0
+            AND NOT pg_attribute.attisdropped
             AND pg_class.relname = %s
             AND pg_namespace.nspname = 'public'  -- Assuming you're interested in public schema
+        ORDER BY pg_attribute.attnum
+        """
+        with tracer.span("catalog.get_table_definition", table=table_name) as span, self.cursor() as cur:
+            cur.execute(get_def_stmt, (table_name,))
+            rows = cur.fetchall()
+            span.set(rows=len(rows))
+        return self.format_create_table_stmt(
+            table_name, [(row[2], row[3]) for row in rows]
+        )
+
+    def get_all_table_definitions(self, table_names: list = None):
+        """
+        Generate the 'create' definition for every table in the public schema
+        with a single catalog query, instead of one query per table.
+        Returns a dict of table name -> definition, ordered by table name.
+
+        With 'table_names', only those tables are fetched.
+        """
+
+        # Join conditions on pg_attribute live in the ON clause so that tables
+        # without any (live) column still show up with an empty definition.
+        get_all_defs_stmt = """
+        SELECT pg_class.relname as tablename,
+            pg_attribute.attnum,
+            pg_attribute.attname,
+            format_type(atttypid, atttypmod)
+        FROM pg_class
+        JOIN pg_namespace ON pg_namespace.oid = pg_class.relnamespace
+        LEFT JOIN pg_attribute ON pg_attribute.attrelid = pg_class.oid
+            AND pg_attribute.attnum > 0
+            AND NOT pg_attribute.attisdropped
+        WHERE pg_class.relkind IN ('r', 'p')
+            AND pg_namespace.nspname = 'public'
+            AND (%(table_names)s IS NULL OR pg_class.relname = ANY(%(table_names)s))
+        ORDER BY pg_class.relname, pg_attribute.attnum
+        """
+        with tracer.span("catalog.get_all_table_definitions") as span, self.cursor() as cur:
+            cur.execute(get_all_defs_stmt, {"table_names": None if table_names is None else list(table_names)})
+            rows = cur.fetchall()
+            span.set(rows=len(rows))
+
+        columns_by_table = {}
+        for table_name, _attnum, column_name, column_type in rows:
+            columns = columns_by_table.setdefault(table_name, [])
+            if column_name is not None:
+                columns.append((column_name, column_type))
+
+        return {
+            table_name: self.format_create_table_stmt(table_name, columns)
+            for table_name, columns in columns_by_table.items()
+        }
+
+    def get_table_fingerprints(self):
+        """
+        A hash of the columns (names and types, in order) and foreign keys of
+        every table in the public schema, to tell which definitions changed
+        without fetching them. Returns a dict of table name -> md5.
+        """
+        get_fingerprints_stmt = """
+        SELECT pg_class.relname,
+            md5(coalesce(string_agg(
+                pg_attribute.attname || ' ' || format_type(atttypid, atttypmod), ','
+                ORDER BY pg_attribute.attnum), '') || '|' || coalesce((
+                SELECT string_agg(pg_get_constraintdef(con.oid), ',' ORDER BY con.conname)
+                FROM pg_constraint con
+                WHERE con.conrelid = pg_class.oid AND con.contype = 'f'
+            ), ''))
+        FROM pg_class
+        JOIN pg_namespace ON pg_namespace.oid = pg_class.relnamespace
+        LEFT JOIN pg_attribute ON pg_attribute.attrelid = pg_class.oid
+            AND pg_attribute.attnum > 0
+            AND NOT pg_attribute.attisdropped
+        WHERE pg_class.relkind IN ('r', 'p')
+            AND pg_namespace.nspname = 'public'
+        GROUP BY pg_class.oid, pg_class.relname
+        """
+        with tracer.span("catalog.get_table_fingerprints") as span, self.cursor() as cur:
+            cur.execute(get_fingerprints_stmt)
+            rows = cur.fetchall()
+            span.set(rows=len(rows))
+        return dict(rows)
+
+    @staticmethod
+    def format_create_table_stmt(table_name, columns):
+        """
+        Render a 'create' definition from a list of (column name, column type)
         """
-        self.cur.execute(get_def_stmt, (table_name,))
-        rows = self.cur.fetchall()
         create_table_stmt = "CREATE TABLE {} (\n".format(table_name)
-        for row in rows:
-            create_table_stmt += "{} {},\n".format(row[2], row[3])
+        for column_name, column_type in columns:
+            create_table_stmt += "{} {},\n".format(column_name, column_type)
         create_table_stmt = create_table_stmt.rstrip(",\n") + "\n);"
         return create_table_stmt
 
@@ -86,78 +943,95 @@ class PostgresDB:
         get_all_tables_stmt = (
             "SELECT tablename FROM pg_tables WHERE schemaname = 'public';"
         )
-        self.cur.execute(get_all_tables_stmt)
-        return [row[0] for row in self.cur.fetchall()]
+        with tracer.span("catalog.get_all_table_names") as span, self.cursor() as cur:
+            cur.execute(get_all_tables_stmt)
+            rows = cur.fetchall()
+            span.set(rows=len(rows))
+            return [row[0] for row in rows]
 
-    def get_table_definitions_for_prompt(self):
+    def get_table_definitions_for_prompt(self, bulk=True):
         """
         Get all table 'create' definitions in the database
+
+        With bulk=True every definition comes from a single catalog query,
+        otherwise one query is issued per table.
         """
-        table_names = self.get_all_table_names()
-        definitions = []
-        for table_name in table_names:
-            definitions.append(self.get_table_definition(table_name))
-        return "\n\n".join(definitions)
+        return "\n\n".join(self.get_table_definition_map_for_embeddings(bulk).values())
 
-    def get_table_definition_map_for_embeddings(self):
+    def get_table_definition_map_for_embeddings(self, bulk=True):
         """
         Creates a map of table names to table definitions
+
+        With bulk=True every definition comes from a single catalog query,
+        otherwise one query is issued per table.
         """
+        if bulk:
+            return self.get_all_table_definitions()
+
         table_names = self.get_all_table_names()
         definitions = {}
         for table_name in table_names:
             definitions[table_name] = self.get_table_definition(table_name)
         return definitions
 
-    def get_related_tables(self, table_list, n=2):
-        """
-        Get tables that have foreign keys referencing the given table
+    def get_foreign_keys(self):
         """
+        Every foreign key between tables of the public schema, in a single
+        catalog query. Returns a list of {"table", "columns",
+        "referenced_table", "referenced_columns"}.
 
-        related_tables_dict = {}
-
-        for table in table_list:
-            # Query to fetch tables that have foreign keys referencing the given table
-            self.cur.execute(
-                """
-                SELECT 
-                    a.relname AS table_name
-                FROM 
-                    pg_constraint con 
-                    JOIN pg_class a ON a.oid = con.conrelid 
-                WHERE 
-                    confrelid = (SELECT oid FROM pg_class WHERE relname = %s)
-                LIMIT %s;
-                """,
-                (table, n),
+        The primary keys come with the same query, as entries whose
+        referenced_table is None, see ForeignKeyGraph.primary_keys.
+        """
+        get_foreign_keys_stmt = """
+        SELECT src.relname,
+            ARRAY(
+                SELECT attname FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+                JOIN pg_attribute ON attrelid = con.conrelid AND pg_attribute.attnum = k.attnum
+                ORDER BY k.ord
+            ),
+            dst.relname,
+            ARRAY(
+                SELECT attname FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+                JOIN pg_attribute ON attrelid = con.confrelid AND pg_attribute.attnum = k.attnum
+                ORDER BY k.ord
             )
-
-            related_tables = [row[0] for row in self.cur.fetchall()]
-
-            # Query to fetch tables that the given table references
-            self.cur.execute(
-                """
-                SELECT 
-                    a.relname AS referenced_table_name
-                FROM 
-                    pg_constraint con 
-                    JOIN pg_class a ON a.oid = con.confrelid 
-                WHERE 
-                    conrelid = (SELECT oid FROM pg_class WHERE relname = %s)
-                LIMIT %s;
-                """,
-                (table, n),
+        FROM pg_constraint con
+        JOIN pg_class src ON src.oid = con.conrelid
+        JOIN pg_namespace src_ns ON src_ns.oid = src.relnamespace
+        LEFT JOIN pg_class dst ON dst.oid = con.confrelid
+        LEFT JOIN pg_namespace dst_ns ON dst_ns.oid = dst.relnamespace
+        WHERE src_ns.nspname = 'public'
+            AND (
+                (con.contype = 'f' AND dst_ns.nspname = 'public')
+                OR (con.contype = 'p' AND src.relkind IN ('r', 'p'))
             )
+        ORDER BY src.relname, con.conname
+        """
+        with tracer.span("catalog.get_foreign_keys") as span, self.cursor() as cur:
+            cur.execute(get_foreign_keys_stmt)
+            rows = cur.fetchall()
+            span.set(rows=len(rows))
 
-            related_tables += [row[0] for row in self.cur.fetchall()]
+        return [
+            {
+                "table": table,
+                "columns": list(columns),
+                "referenced_table": referenced_table,
+                "referenced_columns": list(referenced_columns),
+            }
+            for table, columns, referenced_table, referenced_columns in rows
+        ]
 
-            related_tables_dict[table] = related_tables
+    def get_related_tables(self, table_list, n=2):
+        """
+        Get tables that have foreign keys referencing the given tables, or
+        that the given tables reference, at most 'n' per given table
+        """
+        graph = ForeignKeyGraph(self.get_foreign_keys())
 
-        # convert dict to list and remove dups
         related_tables_list = []
-        for table, related_tables in related_tables_dict.items():
-            related_tables_list += related_tables
-
-        related_tables_list = list(set(related_tables_list))
+        for table in table_list:
+            related_tables_list += list(graph.neighbors(table))[:n]
 
-        return related_tables_list
\ No newline at end of file
+        return list(dict.fromkeys(related_tables_list))
@@ -1,5 +1,246 @@
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import BertTokenizer, BertModel
+from abc import ABC, abstractmethod
+import os
+import re
+import numpy as np
+from postgres_da_ai_agent.modules.config.config import (
+    EMBEDDING_MODEL_NAME,
+    get_embedding_backend_config,
+)
+from postgres_da_ai_agent.modules.graph.graph import ForeignKeyGraph
+from postgres_da_ai_agent.modules.index.index import (
+    EmbeddingMatrix,
+    SchemaIndex,
+    hash_definition,
+)
+from postgres_da_ai_agent.modules.lexical.lexical import (
+    LexicalIndex,
+    parse_columns,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+from postgres_da_ai_agent.modules.schema.schema import render_compact_schema
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
+
+# Embedding backends turn texts into one float32 row each. torch and
+# transformers are only imported by the backends that need them, so the
+# hashing backend runs without either.
+#
+# A backend's index_name() identifies its vector space. Each one keeps its
+# schema index in its own subdirectory of the index path (see
+# get_schema_index_path), so switching backends and back reuses the index
+# built before, and an index built by another backend (or model) is never
+# read, see SchemaIndex.load.
+
+
+class EmbeddingBackend(ABC):
+    model_name = None
+    dimension = None
+
+    @classmethod
+    @abstractmethod
+    def index_name(cls, model_name: str = None) -> str:
+        """
+        The name of the vector space of this backend with 'model_name'
+        """
+
+    @abstractmethod
+    def embed(self, texts: list, batch_size: int = 32):
+        """
+        One embedding row per text, in input order
+        """
+
+
+class BertBackend(EmbeddingBackend):
+    """
+    BERT's pooler output (bert-base-uncased by default, ~440MB resident)
+    """
+
+    default_model_name = EMBEDDING_MODEL_NAME
+
+    def __init__(self, model_name: str = None, num_threads: int = None):
+        """
+        num_threads sets the number of intra-op threads torch uses for
+        inference, defaults to torch's own choice (all physical cores).
+        """
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.torch = torch
+        self.model_name = model_name or self.default_model_name
+        self.max_length = 512
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = self.load_model(AutoModel.from_pretrained(self.model_name))
+        self.model.eval()
+        self.dimension = self.model.config.hidden_size
+
+    @classmethod
+    def index_name(cls, model_name: str = None) -> str:
+        return model_name or cls.default_model_name
+
+    def load_model(self, model):
+        return model
+
+    def pool(self, outputs, attention_mask):
+        return outputs["pooler_output"]
+
+    def embed(self, texts: list, batch_size: int = 32):
+        """
+        Texts are tokenized once, sorted by token length and run through the
+        model in padded batches, so each batch pads to a similar length.
+
+        A text longer than the model's window (wide tables) is cut into
+        windows, and embedded as the mean of its windows' embeddings.
+        """
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        with tracer.span("compute_embeddings_batch", texts=len(texts), batch_size=batch_size) as span:
+            encodings = self.tokenizer(
+                texts, truncation=True, max_length=self.max_length, return_overflowing_tokens=True
+            )
+            text_of_window = np.asarray(encodings.pop("overflow_to_sample_mapping"))
+            window_embeddings = np.empty((len(text_of_window), self.dimension), dtype=np.float32)
+            order = sorted(
+                range(len(text_of_window)), key=lambda idx: len(encodings["input_ids"][idx])
+            )
+            if tracer.enabled:
+                span.set(tokens=sum(len(ids) for ids in encodings["input_ids"]), windows=len(order))
+
+            for start in range(0, len(order), batch_size):
+                batch_idx = order[start: start + batch_size]
+                with tracer.span("compute_embeddings", texts=len(batch_idx)) as batch_span:
+                    inputs = self.tokenizer.pad(
+                        {key: [values[idx] for idx in batch_idx]
+                            for key, values in encodings.items()},
+                        return_tensors="pt",
+                    )
+                    batch_span.set(padded_tokens=inputs["input_ids"].numel())
+                    with self.torch.inference_mode():
+                        outputs = self.model(**inputs)
+                    window_embeddings[batch_idx] = self.pool(outputs, inputs["attention_mask"]).numpy()
+
+        np.add.at(embeddings, text_of_window, window_embeddings)
+        embeddings /= np.bincount(text_of_window, minlength=len(texts))[:, None]
+        return embeddings
+
+
+class QuantizedBertBackend(BertBackend):
+    """
+    BERT with its linear layers dynamically quantized to int8: about a
+    quarter of the weights' memory and faster CPU inference, for slightly
+    different embeddings
+    """
+
+    @classmethod
+    def index_name(cls, model_name: str = None) -> str:
+        return f"{model_name or cls.default_model_name}+int8"
+
+    def load_model(self, model):
+        return self.torch.quantization.quantize_dynamic(
+            model, {self.torch.nn.Linear}, dtype=self.torch.qint8
+        )
+
+
+class SentenceEmbeddingBackend(BertBackend):
+    """
+    A small sentence-embedding model (all-MiniLM-L6-v2 by default, ~90MB),
+    mean-pooled over the tokens as it was trained to be
+    """
+
+    default_model_name = "sentence-transformers/all-MiniLM-L6-v2"
+
+    def __init__(self, model_name: str = None, num_threads: int = None):
+        super().__init__(model_name, num_threads)
+        self.max_length = min(self.max_length, self.tokenizer.model_max_length)
+
+    def pool(self, outputs, attention_mask):
+        mask = attention_mask.unsqueeze(-1).to(outputs["last_hidden_state"].dtype)
+        return (outputs["last_hidden_state"] * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    No model: the terms of a text (see lexical.tokenize) hashed into a fixed
+    number of buckets, term frequencies scaled sublinearly. Loads instantly
+    and needs neither torch nor transformers, at the cost of matching words
+    only, not meanings. Stateless, so tables can be re-embedded one by one.
+    """
+
+    def __init__(self, model_name: str = None, num_threads: int = None, dimension: int = 2 ** 12):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        if model_name:
+            raise ValueError(
+                f"The hashing embedding backend loads no model, got model '{model_name}': unset EMBEDDING_MODEL")
+
+        self.dimension = dimension
+        self.vectorizer = HashingVectorizer(
+            analyzer=tokenize, n_features=dimension, alternate_sign=False, norm=None
+        )
+
+    @classmethod
+    def index_name(cls, model_name: str = None) -> str:
+        return "hashing"
+
+    def embed(self, texts: list, batch_size: int = 32):
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        with tracer.span("compute_embeddings_batch", texts=len(texts)):
+            counts = self.vectorizer.transform(texts)
+            counts.data = 1 + np.log(counts.data)
+            return counts.toarray().astype(np.float32)
+
+
+EMBEDDING_BACKENDS = {
+    "bert": BertBackend,
+    "bert-int8": QuantizedBertBackend,
+    "minilm": SentenceEmbeddingBackend,
+    "hashing": HashingBackend,
+}
+
+
+def get_embedding_backend_class(backend: str):
+    try:
+        return EMBEDDING_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown embedding backend '{backend}', expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def get_embedding_index_name(backend: str = None, model_name: str = None) -> str:
+    """
+    The name a schema index built by this backend is saved under, without
+    loading the backend. Defaults to the configured backend.
+    """
+    if backend is None:
+        config = get_embedding_backend_config()
+        backend, model_name = config["backend"], config["model_name"]
+    return get_embedding_backend_class(backend).index_name(model_name)
+
+
+def get_schema_index_path(index_path: str, index_name: str = None) -> str:
+    """
+    The directory under 'index_path' the schema index of 'index_name' is
+    kept in, the configured backend's by default
+    """
+    if index_name is None:
+        index_name = get_embedding_index_name()
+    return os.path.join(index_path, re.sub(r"[^\w.+-]", "_", index_name))
+
+
+def create_embedding_backend(backend: str = None, model_name: str = None, num_threads: int = None):
+    """
+    Load an embedding backend by name, the configured one by default
+    """
+    if backend is None:
+        config = get_embedding_backend_config()
+        backend, model_name = config["backend"], config["model_name"]
+    return get_embedding_backend_class(backend)(model_name, num_threads)
 
 
 class DatabaseEmbedder:
@@ -8,32 +249,183 @@ class DatabaseEmbedder:
     computing similarity between user queries and table definitions.
     """
 
-    def __init__(self):
-        self.tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
-        self.model = BertModel.from_pretrained("bert-base-uncased")
-        self.map_name_to_embeddings = {}
+    def __init__(self, num_threads: int = None, ann_threshold: int = 100_000, backend=None):
+        """
+        num_threads sets the number of intra-op threads torch uses for
+        inference, defaults to torch's own choice (all physical cores).
+        ann_threshold is the number of embeddings past which retrieval uses an
+        approximate nearest neighbour index, when hnswlib is installed.
+        backend is an EmbeddingBackend or the name of one, defaults to the
+        configured backend (EMBEDDING_BACKEND).
+        """
+        if backend is None or isinstance(backend, str):
+            backend = create_embedding_backend(backend, num_threads=num_threads)
+
+        self.backend = backend
+        # what the schema index is saved under
+        self.model_name = backend.index_name(backend.model_name)
+        self.embeddings = EmbeddingMatrix(backend.dimension, ann_threshold)
         self.map_name_to_table_def = {}
+        # built from map_name_to_table_def on first use, see get_lexical_index
+        self.lexical_index = None
+        # foreign keys between the tables, see set_foreign_keys
+        self.fk_graph = None
+        # normalized column embeddings by column text, computed on first use
+        self.column_embeddings = {}
+        self.max_column_embeddings = 100_000
 
     def add_table(self, table_name: str, text_representation: str):
         """
         Add a table to the database embedder.
         Map the table name to its embedding and text representation.
         """
-        self.map_name_to_embeddings[table_name] = self.compute_embeddings(
-            text_representation
-        )
+        self.embeddings.set(
+            [table_name], self.compute_embeddings(text_representation))
 
         self.map_name_to_table_def[table_name] = text_representation
+        self.lexical_index = None
 
-    def compute_embeddings(self, text):
+    def add_tables(self, map_table_name_to_table_def: dict, batch_size: int = 32):
+        """
+        Add many tables at once, embedding their definitions in batches.
+        Much faster than calling add_table() for each table.
         """
-        Compute embeddings for a given text using the BERT model.
+        table_names = list(map_table_name_to_table_def.keys())
+        embeddings = self.compute_embeddings_batch(
+            [map_table_name_to_table_def[name] for name in table_names], batch_size
+        )
+
+        self.embeddings.set(table_names, embeddings)
+
+        for table_name in table_names:
+            self.map_name_to_table_def[table_name] = map_table_name_to_table_def[table_name]
+        self.lexical_index = None
+
+    def update_tables(self, map_table_name_to_table_def: dict, removed_tables=(), batch_size: int = 32):
+        """
+        Re-embed the tables of 'map_table_name_to_table_def' (changed or new)
+        and forget 'removed_tables', e.g. after DDL changes.
+
+        Retrieval keeps using the current embeddings while the new ones are
+        computed; the updated index then replaces it in one assignment.
+        """
+        table_names = list(map_table_name_to_table_def.keys())
+        embeddings = self.compute_embeddings_batch(
+            [map_table_name_to_table_def[name] for name in table_names], batch_size
+        )
+
+        map_name_to_table_def = {
+            name: definition
+            for name, definition in self.map_name_to_table_def.items()
+            if name not in removed_tables
+        }
+        map_name_to_table_def.update(map_table_name_to_table_def)
+
+        # a search running against the old embeddings may still return a
+        # removed table, get_table_definitions_from_names() skips it
+        self.embeddings = self.embeddings.updated(table_names, embeddings, removed_tables)
+        self.map_name_to_table_def = map_name_to_table_def
+        self.lexical_index = None
+        self.column_embeddings = {}
+
+    def set_foreign_keys(self, edges: list):
+        """
+        Replace the foreign key graph with 'edges', as returned by
+        PostgresDB.get_foreign_keys()
+        """
+        self.fk_graph = ForeignKeyGraph(edges)
+
+    def save_index(self, path: str):
+        """
+        Persist the embeddings of every table added so far under 'path', in
+        the backend's own subdirectory, and the foreign key graph if there
+        is one.
+        """
+        schema_index = SchemaIndex(get_schema_index_path(path, self.model_name))
+        schema_index.save(
+            self.model_name,
+            self.embeddings.names,
+            self.map_name_to_table_def,
+            self.embeddings.get_matrix(),
+        )
+        if self.fk_graph is not None:
+            schema_index.save_foreign_keys(self.fk_graph.edges)
+
+    def load_index(self, path: str, map_table_name_to_table_def: dict = None, batch_size: int = 32):
         """
-        inputs = self.tokenizer(
-            text, return_tensors="pt", truncation=True, padding=True, max_length=512
+        Load the embeddings persisted under 'path' by this backend. The matrix
+        is memory-mapped and, when every table is fresh, searched in place
+        without a copy.
+
+        If map_table_name_to_table_def is given it is the source of truth:
+        tables whose definition hash changed, or that are missing from the
+        index, are re-embedded, and tables not in the map are left out.
+
+        The persisted foreign key graph is loaded too, unless one was set
+        already.
+
+        Returns the names of the tables that had to be (re-)embedded.
+        """
+        schema_index = SchemaIndex(get_schema_index_path(path, self.model_name))
+        if self.fk_graph is None:
+            edges = schema_index.load_foreign_keys()
+            if edges is not None:
+                self.set_foreign_keys(edges)
+
+        return self.merge_index(
+            schema_index.load(self.model_name), map_table_name_to_table_def, batch_size
         )
-        outputs = self.model(**inputs)
-        return outputs["pooler_output"].detach().numpy()
+
+    def merge_index(self, loaded, map_table_name_to_table_def: dict = None, batch_size: int = 32):
+        """
+        Same as load_index for an index already read with SchemaIndex.load(),
+        so that reading it can overlap with loading the model.
+        """
+        tables, embeddings = loaded if loaded else ([], None)
+
+        fresh_rows = []
+        for row, table in enumerate(tables):
+            if map_table_name_to_table_def is not None:
+                current_def = map_table_name_to_table_def.get(table["name"])
+                if current_def is None or hash_definition(current_def) != table["hash"]:
+                    continue
+            fresh_rows.append(row)
+
+        if fresh_rows:
+            self.embeddings.set(
+                [tables[row]["name"] for row in fresh_rows],
+                embeddings if len(fresh_rows) == len(tables) else embeddings[fresh_rows],
+                normalized=True,
+            )
+            for row in fresh_rows:
+                self.map_name_to_table_def[tables[row]["name"]] = tables[row]["definition"]
+            self.lexical_index = None
+
+        stale_tables = [
+            table_name
+            for table_name in (map_table_name_to_table_def or {})
+            if table_name not in self.embeddings
+        ]
+
+        self.add_tables(
+            {table_name: map_table_name_to_table_def[table_name]
+                for table_name in stale_tables},
+            batch_size,
+        )
+
+        return stale_tables
+
+    def compute_embeddings(self, text):
+        """
+        Compute embeddings for a given text with the embedding backend.
+        """
+        return self.backend.embed([text])
+
+    def compute_embeddings_batch(self, texts: list, batch_size: int = 32):
+        """
+        Compute embeddings for many texts, one row per text in input order.
+        """
+        return self.backend.embed(texts, batch_size)
 
     def get_similar_tables_via_embeddings(self, query, n=3):
         """
@@ -46,46 +438,159 @@ class DatabaseEmbedder:
         Returns:
         - list: Top 'n' table names ranked by their similarity to the query.
         """
-        # Compute the embedding for the user's query
-        query_embedding = self.compute_embeddings(query)
-        # Calculate cosine similarity between the query and all tables
-        similarities = {
-            table: cosine_similarity(query_embedding, emb)[0][0]
-            for table, emb in self.map_name_to_embeddings.items()
-        }
-        # Rank tables based on their similarity scores and return top 'n'
-        return sorted(similarities, key=similarities.get, reverse=True)[:n]
+        return self.get_similar_tables_via_embeddings_batch([query], n)[0]
 
-    def get_similar_table_names_via_word_match(self, query: str):
-        """
-        if any word in our query is a table name, add the table to a list
+    def get_similar_tables_via_embeddings_batch(self, queries: list, n=3):
         """
+        Same as get_similar_tables_via_embeddings for many queries at once:
+        the queries are embedded in one batch and ranked against every table
+        with a single matrix product.
 
-        tables = []
+        Returns:
+        - list: For each query, the top 'n' table names ranked by similarity.
+        """
+        query_embeddings = self.compute_embeddings_batch(queries)
+        # one reference for the search and the names, update_tables() may
+        # swap the index meanwhile
+        embeddings = self.embeddings
+        top_rows, _scores = embeddings.search(query_embeddings, n)
+        return [
+            [embeddings.names[row] for row in rows] for rows in top_rows
+        ]
 
-        for table_name in self.map_name_to_table_def.keys():
-            if table_name.lower() in query.lower():
-                tables.append(table_name)
+    def get_lexical_index(self) -> LexicalIndex:
+        """
+        The lexical index of the current tables, rebuilt after they changed
+        """
+        map_name_to_table_def = self.map_name_to_table_def
+        lexical_index = self.lexical_index
+        # update_tables() swaps the map, an index built meanwhile from the
+        # previous one is rebuilt on the next call
+        if lexical_index is None or lexical_index.source is not map_name_to_table_def:
+            lexical_index = self.lexical_index = LexicalIndex(map_name_to_table_def)
+        return lexical_index
 
-        return tables
+    def get_similar_tables_via_lexical(self, query: str, n=3):
+        """
+        The top 'n' tables whose table and column names best match the words
+        of the query (BM25), without the model
+        """
+        return [table_name for table_name, _score in self.get_lexical_index().search(query, n)]
 
-    def get_similar_tables(self, query: str, n=3):
+    def get_similar_table_names_via_word_match(self, query: str):
         """
-        combines results from get_similar_tables_via_embeddings and get_similar_table_names_via_word_match
+        The tables named in the query, plural or singular
         """
+        return self.get_lexical_index().mentioned_tables(query)
 
-        similar_tables_via_embeddings = self.get_similar_tables_via_embeddings(query, n)
+    def get_similar_tables(self, query: str, n=3, candidates=10):
+        """
+        The top 'n' tables of the embedding and lexical rankings fused
+        (reciprocal rank fusion over their top 'candidates'), followed by the
+        tables named in the query. No table is returned twice.
+        """
+        similar_tables = reciprocal_rank_fusion([
+            self.get_similar_tables_via_embeddings(query, max(n, candidates)),
+            self.get_similar_tables_via_lexical(query, max(n, candidates)),
+        ])[:n]
         similar_tables_via_word_match = self.get_similar_table_names_via_word_match(
             query
         )
 
-        return similar_tables_via_embeddings + similar_tables_via_word_match
+        return list(dict.fromkeys(similar_tables + similar_tables_via_word_match))
+
+    def get_related_tables(self, table_names: list, hops: int = 2, limit: int = 3) -> list:
+        """
+        Tables up to 'hops' foreign keys away from 'table_names', best first,
+        see ForeignKeyGraph.expand. Empty without a foreign key graph.
+        """
+        fk_graph = self.fk_graph
+        if fk_graph is None:
+            return []
+        return [
+            table_name for table_name in fk_graph.expand(table_names, hops, limit=None)
+            if table_name in self.map_name_to_table_def
+        ][:limit]
 
     def get_table_definitions_from_names(self, table_names: list) -> str:
         """
         Given a list of table names, return their table definitions.
         """
+        map_name_to_table_def = self.map_name_to_table_def
         table_defs = [
-            self.map_name_to_table_def[table_name] for table_name in table_names
+            map_name_to_table_def[table_name] for table_name in dict.fromkeys(table_names)
+            if table_name in map_name_to_table_def
         ]
         return "\n\n".join(table_defs)
+
+    def get_column_scores(self, query: str, columns_by_table: dict) -> dict:
+        """
+        The relevance to the query of each (column name, column type) of
+        'columns_by_table': the cosine similarity of their embeddings, plus 1
+        when the column name shares a term with the query.
+
+        Column embeddings are computed once per column and kept, the query
+        and the new columns are embedded in a single batch.
+        """
+        column_texts = {
+            table_name: [f"{table_name} {column_name} {column_type}" for column_name, column_type in columns]
+            for table_name, columns in columns_by_table.items()
+        }
+        column_embeddings = self.column_embeddings
+        missing = [
+            text for texts in column_texts.values() for text in texts if text not in column_embeddings
+        ]
+        missing = list(dict.fromkeys(missing))
+
+        embeddings = self.compute_embeddings_batch([query] + missing)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), np.finfo(np.float32).eps)
+        query_embedding = embeddings[0]
+
+        if len(column_embeddings) + len(missing) > self.max_column_embeddings:
+            # evict the columns of other queries, this one still needs its own
+            column_embeddings = self.column_embeddings = {
+                text: column_embeddings[text]
+                for texts in column_texts.values() for text in texts if text in column_embeddings
+            }
+        column_embeddings.update(zip(missing, embeddings[1:]))
+
+        query_terms = set(tokenize(query))
+        return {
+            table_name: [
+                float(column_embeddings[text] @ query_embedding)
+                + (1.0 if query_terms.intersection(tokenize(column_name)) else 0.0)
+                for text, (column_name, _column_type) in zip(column_texts[table_name], columns)
+            ]
+            for table_name, columns in columns_by_table.items()
+        }
+
+    def get_compact_table_definitions_from_names(
+        self, query: str, table_names: list, max_columns: int = None, token_budget: int = None
+    ) -> str:
+        """
+        The definitions of 'table_names' in compact notation, pruned to their
+        keys and the columns most relevant to the query, see
+        schema.render_compact_schema.
+        """
+        map_name_to_table_def = self.map_name_to_table_def
+        fk_graph = self.fk_graph
+
+        columns_by_table = {
+            table_name: parse_columns(map_name_to_table_def[table_name])
+            for table_name in dict.fromkeys(table_names) if table_name in map_name_to_table_def
+        }
+        scores = self.get_column_scores(query, columns_by_table)
+
+        tables = []
+        for table_name, columns in columns_by_table.items():
+            # without the catalog's keys, assume the usual "id"
+            keys = fk_graph.key_columns(table_name) if fk_graph is not None else {"id"}
+            tables.append({
+                "name": table_name,
+                "columns": columns,
+                "scores": scores[table_name],
+                "keys": keys,
+                "references": fk_graph.references.get(table_name, {}) if fk_graph is not None else {},
+            })
+
+        return render_compact_schema(tables, max_columns, token_budget)
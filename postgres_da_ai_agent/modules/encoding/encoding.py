@@ -0,0 +1,213 @@
+from abc import ABC, abstractmethod
+import csv
+from datetime import datetime
+import io
+import json
+from postgres_da_ai_agent.modules.llm.llm import count_tokens
+
+# Text encodings of query results handed back to the LLM.
+#
+#   json          [{"col": value, ...}, ...] indented by 4, the original run_sql format
+#   compact_json  same without whitespace
+#   columnar      {"columns": [...], "rows": [[...], ...]}, column names only once
+#   csv / tsv     header line followed by one line per row
+#   auto          whichever of the compact formats takes the fewest tokens on a sample
+#
+# Every format is a header, the rows joined by a separator, and a footer, so a
+# result can be encoded row by row while it streams from the database.
+
+COMPACT_FORMATS = ["columnar", "csv", "tsv", "compact_json"]
+
+# tokens kept free for the truncation note when fitting a result to a budget
+TRUNCATION_NOTE_TOKENS = 60
+
+
+def json_default(obj):
+    """
+    Handle datetime objects when serializing to JSON.
+    """
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+class ResultEncoder(ABC):
+    name = None
+    separator = ""
+
+    def header(self, columns: list) -> str:
+        return ""
+
+    @abstractmethod
+    def row(self, columns: list, values) -> str:
+        """
+        The text of one row, without the separator
+        """
+
+    def footer(self) -> str:
+        return ""
+
+    def empty(self, columns: list) -> str:
+        return self.header(columns) + self.footer()
+
+    def encode(self, columns: list, row_texts: list) -> str:
+        """
+        Assemble rows already encoded with row()
+        """
+        if not row_texts:
+            return self.empty(columns)
+        return self.header(columns) + self.separator.join(row_texts) + self.footer()
+
+
+class JsonEncoder(ResultEncoder):
+    name = "json"
+    separator = ",\n"
+
+    def header(self, columns):
+        return "[\n"
+
+    def row(self, columns, values):
+        text = json.dumps(dict(zip(columns, values)), indent=4, default=json_default)
+        return "\n".join("    " + line for line in text.split("\n"))
+
+    def footer(self):
+        return "\n]"
+
+    def empty(self, columns):
+        return "[]"
+
+
+class CompactJsonEncoder(ResultEncoder):
+    name = "compact_json"
+    separator = ","
+
+    def header(self, columns):
+        return "["
+
+    def row(self, columns, values):
+        return json.dumps(dict(zip(columns, values)), separators=(",", ":"), default=json_default)
+
+    def footer(self):
+        return "]"
+
+
+class ColumnarEncoder(ResultEncoder):
+    name = "columnar"
+    separator = ","
+
+    def header(self, columns):
+        return '{"columns":' + json.dumps(columns, separators=(",", ":")) + ',"rows":['
+
+    def row(self, columns, values):
+        return json.dumps(list(values), separators=(",", ":"), default=json_default)
+
+    def footer(self):
+        return "]}"
+
+
+class DelimitedEncoder(ResultEncoder):
+    separator = "\n"
+
+    def __init__(self, name: str, delimiter: str):
+        self.name = name
+        self.delimiter = delimiter
+
+    def line(self, values) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter=self.delimiter, lineterminator="").writerow(values)
+        return buffer.getvalue()
+
+    def header(self, columns):
+        return self.line(columns) + "\n"
+
+    def row(self, columns, values):
+        return self.line(
+            ["" if value is None else json_default(value) if isinstance(value, datetime) else value
+             for value in values]
+        )
+
+
+ENCODERS = {
+    "json": JsonEncoder(),
+    "compact_json": CompactJsonEncoder(),
+    "columnar": ColumnarEncoder(),
+    "csv": DelimitedEncoder("csv", ","),
+    "tsv": DelimitedEncoder("tsv", "\t"),
+}
+
+
+def get_encoder(result_format: str) -> ResultEncoder:
+    if result_format not in ENCODERS:
+        raise ValueError(
+            f"Unknown result format '{result_format}', expected one of {list(ENCODERS)} or 'auto'")
+    return ENCODERS[result_format]
+
+
+def choose_encoder(columns: list, sample_rows: list) -> ResultEncoder:
+    """
+    The compact encoder that takes the fewest tokens on 'sample_rows'
+    """
+    def sample_tokens(encoder):
+        return count_tokens(encoder.encode(
+            columns, [encoder.row(columns, row) for row in sample_rows]))
+
+    return min((ENCODERS[name] for name in COMPACT_FORMATS), key=sample_tokens)
+
+
+def sample_indices(n_total: int, n: int, sampling: str = "head") -> list:
+    """
+    Indices of the 'n' rows kept out of 'n_total': the first ones ("head"), or
+    spread evenly across the result ("even")
+    """
+    if n >= n_total:
+        return list(range(n_total))
+    if n <= 0:
+        return []
+    if sampling == "even" and n > 1:
+        return sorted({round(i * (n_total - 1) / (n - 1)) for i in range(n)})
+    return list(range(n))
+
+
+def fit_to_token_budget(
+    encoder: ResultEncoder,
+    columns: list,
+    row_texts: list,
+    token_budget: int,
+    sampling: str = "head",
+    reserve_tokens: int = 0,
+) -> list:
+    """
+    Keep as many of 'row_texts' as fit, once encoded, in 'token_budget' tokens
+    minus 'reserve_tokens'. Returns the kept rows, in order.
+    """
+    if not row_texts:
+        return row_texts
+
+    budget = token_budget - reserve_tokens
+
+    if count_tokens(encoder.encode(columns, row_texts)) <= budget:
+        return row_texts
+
+    # estimate from per-row token counts, then check the real encoding
+    overhead = count_tokens(encoder.encode(columns, row_texts[:1])) - count_tokens(row_texts[0])
+    row_tokens = [count_tokens(text + encoder.separator) for text in row_texts]
+
+    def estimate(n):
+        return overhead + sum(row_tokens[idx] for idx in sample_indices(len(row_texts), n, sampling))
+
+    low, high = 0, len(row_texts)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate(mid) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+
+    n = low
+    while n > 0:
+        kept = [row_texts[idx] for idx in sample_indices(len(row_texts), n, sampling)]
+        if count_tokens(encoder.encode(columns, kept)) <= budget:
+            return kept
+        n -= max(1, n // 20)
+
+    return []
@@ -0,0 +1,131 @@
+import json
+import re
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.llm import llm
+from postgres_da_ai_agent.modules.metrics.metrics import Metrics, run_metrics
+from postgres_da_ai_agent.modules.prompts.prompts import FAST_PATH_PROMPT
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
+from postgres_da_ai_agent.modules.usage.usage import (
+    TokenUsage,
+    install_usage_hook,
+    recording_responses,
+)
+
+# Single agent fast path for simple questions.
+#
+# One completion writes the query along with how confident it is and what it
+# found ambiguous, and the query is run right away: one LLM round trip instead
+# of the four or more of the data engineering team. The answer is only kept
+# if every check passes, otherwise the prompt is escalated to the team with
+# the reason:
+#
+#   - the reply is a single row-returning query
+#   - the stated confidence is at least 'min_confidence'
+#   - no ambiguity was reported
+#   - the query ran without error and wasn't rejected by the plan limits
+#   - the result has rows
+#
+# The messages follow the shape of the team's, so the result is found the
+# same way in both (pipeline.get_data_analyst_result).
+
+FAST_PATH_AGENT_NAME = "Fast_Data_Analyst"
+
+JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+
+class FastPath:
+    def __init__(
+        self,
+        db: PostgresDB,
+        min_confidence: float = 0.8,
+        model: str = "gpt-4",
+        usage: TokenUsage = None,
+        metrics: Metrics = None,
+    ):
+        """
+        The completion is recorded in 'usage' under FAST_PATH_AGENT_NAME, in
+        the "fast_path" turn
+        """
+        self.db = db
+        self.min_confidence = min_confidence
+        self.model = model
+        self.usage = usage or TokenUsage()
+        self.metrics = metrics or run_metrics
+
+        install_usage_hook()
+
+    @staticmethod
+    def parse_reply(reply: str):
+        """
+        The json object of the reply, None if there is none
+        """
+        match = JSON_OBJECT_PATTERN.search(reply or "")
+        if not match:
+            return None
+        try:
+            parsed = json.loads(match.group(0))
+        except ValueError:
+            return None
+        return parsed if isinstance(parsed, dict) else None
+
+    def run(self, prompt: str, stream: bool = False) -> dict:
+        """
+        Try to answer 'prompt' with one query, printing the completion as it
+        arrives with 'stream'. Returns:
+            "answered": whether every check passed
+            "reason": why not, None if answered
+            "sql", "confidence", "ambiguities": from the reply
+            "messages": the prompt, the reply and the run_sql result, if run
+            "streams": the stream stats of the completion, if streamed
+        """
+        self.metrics.mark_once("time_to_first_llm_request")
+
+        def record(params, response):
+            self.usage.record_response(FAST_PATH_AGENT_NAME, "fast_path", params, response)
+
+        streams = []
+        with recording_responses(record):
+            # temperature 0 like the agents: the same question gets the same
+            # query, and the completion can be served from the response cache
+            reply = llm.prompt(
+                prompt, model=self.model, temperature=0, system_prompt=FAST_PATH_PROMPT,
+                stream=stream, on_stats=streams.append)
+
+        messages = [prompt, {"role": "assistant", "name": FAST_PATH_AGENT_NAME, "content": reply}]
+        parsed = self.parse_reply(reply) or {}
+        sql = parsed.get("sql")
+        ambiguities = [str(ambiguity) for ambiguity in parsed.get("ambiguities") or []]
+        try:
+            confidence = float(parsed.get("confidence", 0))
+        except (TypeError, ValueError):
+            confidence = 0.0
+
+        attempt = {
+            "answered": False,
+            "reason": None,
+            "sql": sql,
+            "confidence": confidence,
+            "ambiguities": ambiguities,
+            "messages": messages,
+            "streams": streams,
+        }
+
+        if not isinstance(sql, str) or not PostgresDB.is_single_query(sql):
+            return {**attempt, "reason": "the reply is not a single query"}
+        if confidence < self.min_confidence:
+            return {**attempt, "reason": f"confidence {confidence} is under {self.min_confidence}"}
+        if ambiguities:
+            return {**attempt, "reason": f"the question is ambiguous: {'; '.join(ambiguities)}"}
+
+        status = self.db.run_sql_status(sql)
+        messages.append({"role": "function", "name": "run_sql", "content": status["result"]})
+
+        if status["error"]:
+            return {**attempt, "reason": f"the query failed: {status['error']}"}
+        if status["rejected"]:
+            return {**attempt, "reason": "the query was rejected by the plan limits"}
+        if not status["rows"]:
+            return {**attempt, "reason": "the query returned no rows"}
+
+        tracer.annotate(confidence=confidence)
+        return {**attempt, "answered": True}
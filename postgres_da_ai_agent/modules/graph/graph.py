@@ -0,0 +1,92 @@
+class ForeignKeyGraph:
+    """
+    The foreign keys between tables as an undirected, weighted adjacency map,
+    built from the edges PostgresDB.get_foreign_keys() returns in one catalog
+    query.
+
+    An edge's weight is the number of foreign keys between its two tables,
+    in either direction. Entries without a referenced_table are primary
+    keys rather than edges.
+    """
+
+    def __init__(self, edges: list):
+        # {"table", "columns", "referenced_table", "referenced_columns"} per foreign key
+        self.edges = edges
+        self.adjacency = {}
+        # {table: {column: "referenced_table.referenced_column"}}
+        self.references = {}
+        # {table: columns other tables reference}
+        self.referenced_columns = {}
+        # {table: primary key columns}
+        self.primary_keys = {}
+
+        for edge in edges:
+            table, referenced_table = edge["table"], edge["referenced_table"]
+            if referenced_table is None:
+                self.primary_keys[table] = set(edge["columns"])
+                continue
+            references = self.references.setdefault(table, {})
+            for column, referenced_column in zip(edge["columns"], edge["referenced_columns"]):
+                references[column] = f"{referenced_table}.{referenced_column}"
+            self.referenced_columns.setdefault(referenced_table, set()).update(edge["referenced_columns"])
+
+            if table == referenced_table:
+                continue
+            for a, b in ((table, referenced_table), (referenced_table, table)):
+                neighbors = self.adjacency.setdefault(a, {})
+                neighbors[b] = neighbors.get(b, 0) + 1
+
+        self.total_weight = {
+            table: sum(neighbors.values()) for table, neighbors in self.adjacency.items()
+        }
+
+    def __len__(self):
+        return len(self.adjacency)
+
+    def neighbors(self, table_name: str) -> dict:
+        return self.adjacency.get(table_name, {})
+
+    def key_columns(self, table_name: str) -> set:
+        """
+        The primary key columns of 'table_name' and its columns on either
+        end of a foreign key
+        """
+        return (
+            self.primary_keys.get(table_name, set())
+            | set(self.references.get(table_name, ()))
+            | self.referenced_columns.get(table_name, set())
+        )
+
+    def expand(self, table_names: list, hops: int = 2, limit: int = None, decay: float = 0.5) -> list:
+        """
+        Tables related to 'table_names' by foreign keys, up to 'hops' hops
+        away, best first.
+
+        Each seed table starts with a score of 1 and passes 'decay' times its
+        score on to its neighbours, split by edge weight. A table reached from
+        several seeds adds up their shares, while a hub referenced by many
+        tables gets only a small share from each. Seeds are never returned.
+        """
+        seeds = set(table_names)
+        frontier = {name: 1.0 for name in seeds if name in self.adjacency}
+        visited = set(frontier)
+        scores = {}
+
+        for _ in range(hops):
+            reached = {}
+            for table_name, score in frontier.items():
+                share = score * decay / self.total_weight[table_name]
+                for neighbor, weight in self.adjacency[table_name].items():
+                    if neighbor not in seeds:
+                        reached[neighbor] = reached.get(neighbor, 0.0) + share * weight
+
+            for table_name, score in reached.items():
+                scores[table_name] = scores.get(table_name, 0.0) + score
+
+            frontier = {name: score for name, score in reached.items() if name not in visited}
+            visited.update(frontier)
+            if not frontier:
+                break
+
+        ranked = sorted(scores, key=lambda name: (-scores[name], name))
+        return ranked if limit is None else ranked[:limit]
@@ -0,0 +1,117 @@
+import json
+from postgres_da_ai_agent.modules.llm.llm import count_tokens, message_text
+
+# Keeps the chat history an agent re-sends on every completion small.
+#
+# autogen sends an agent's whole history with each generate_reply(), so
+# without compaction every run_sql payload is paid for again on every later
+# turn. Before each reply, HistoryCompaction rewrites the agent's history:
+#
+#   1. only the latest function call keeps its arguments (the latest SQL),
+#      older function results are cut down to a digest
+#   2. over the agent's token ceiling, the latest function result is cut
+#      down to a digest too
+#   3. still over it, the oldest messages are elided, except the first one
+#      (the task and table definitions) and the last two
+#
+# Messages are replaced, never edited in place: the orchestrator's own
+# message list shares dicts with the agents' histories.
+
+ELIDED = "[elided to keep the conversation short]"
+DIGEST_SUFFIX = "characters in total]"
+
+
+class HistoryCompaction:
+    def __init__(self, token_ceiling: int = 3000, digest_tokens: int = 200, agent_token_ceilings: dict = None):
+        """
+        token_ceiling is the history size, in tokens, past which an agent's
+        history is compacted further than step 1, agent_token_ceilings
+        overrides it per agent name. A function result digest keeps the
+        first lines of the result, up to 'digest_tokens'.
+        """
+        self.token_ceiling = token_ceiling
+        self.digest_tokens = digest_tokens
+        self.agent_token_ceilings = agent_token_ceilings or {}
+
+    def token_ceiling_for(self, agent_name: str) -> int:
+        return self.agent_token_ceilings.get(agent_name, self.token_ceiling)
+
+    def compact_agent(self, agent) -> int:
+        """
+        Compact every conversation of an autogen agent, returns the tokens
+        saved
+        """
+        ceiling = self.token_ceiling_for(agent.name)
+        return sum(self.compact(messages, ceiling) for messages in agent._oai_messages.values())
+
+    def compact(self, messages: list, token_ceiling: int = None) -> int:
+        """
+        Compact 'messages' in place, returns the tokens saved
+        """
+        token_ceiling = self.token_ceiling if token_ceiling is None else token_ceiling
+        tokens = [count_tokens(message_text(message)) for message in messages]
+        before = sum(tokens)
+
+        def replace(idx, message):
+            messages[idx] = message
+            tokens[idx] = count_tokens(message_text(message))
+
+        function_calls = [idx for idx, message in enumerate(messages) if message.get("function_call")]
+        function_results = [idx for idx, message in enumerate(messages) if message.get("role") == "function"]
+
+        for idx in function_calls[:-1]:
+            replace(idx, self.elide_function_call(messages[idx]))
+        for idx in function_results[:-1]:
+            replace(idx, self.digest(messages[idx]))
+
+        if sum(tokens) > token_ceiling and function_results:
+            replace(function_results[-1], self.digest(messages[function_results[-1]]))
+
+        for idx in range(1, len(messages) - 2):
+            if sum(tokens) <= token_ceiling:
+                break
+            if messages[idx].get("content") and messages[idx]["content"] != ELIDED:
+                replace(idx, {**messages[idx], "content": ELIDED})
+
+        return before - sum(tokens)
+
+    def digest(self, message: dict) -> dict:
+        """
+        'message' with only the first lines of its content that fit in
+        digest_tokens
+        """
+        content = message.get("content") or ""
+        if content.endswith(DIGEST_SUFFIX) or count_tokens(content) <= self.digest_tokens:
+            return message
+
+        lines = content.splitlines()
+        kept, used = [], 0
+        for line in lines:
+            used += count_tokens(line) + 1
+            if used > self.digest_tokens:
+                break
+            kept.append(line)
+        if not kept:
+            # one long line, e.g. compact json: about 4 characters per token
+            kept.append(lines[0][:self.digest_tokens * 4])
+
+        kept.append(f"[{len(lines) - len(kept)} more lines elided, {len(content)} {DIGEST_SUFFIX}")
+        return {**message, "content": "\n".join(kept)}
+
+    @staticmethod
+    def elide_function_call(message: dict) -> dict:
+        """
+        'message' with the argument values of its function call elided
+        """
+        function_call = message["function_call"]
+        try:
+            arguments = json.loads(function_call.get("arguments") or "{}")
+        except ValueError:
+            arguments = None
+        if not isinstance(arguments, dict):
+            return message
+
+        elided = json.dumps({name: "(superseded by a later call)" for name in arguments})
+        if elided == function_call.get("arguments"):
+            return message
+        return {**message, "function_call": {**function_call, "arguments": elided}}
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.json"
+FOREIGN_KEYS_FILE = "foreign_keys.json"
+# version 2: rows are stored L2-normalized
+# version 3: definitions longer than the model's window are embedded whole
+INDEX_VERSION = 3
+
+
+def hash_definition(text: str) -> str:
+    """
+    Content hash of a table definition, used to detect stale embeddings
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize each row so that a dot product is the cosine similarity
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, np.finfo(np.float32).eps)
+
+
+class AnnIndex:
+    """
+    Approximate nearest neighbour search over normalized rows, backed by
+    hnswlib. hnswlib is an optional dependency, check available() first.
+    """
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 200, ef: int = 64):
+        self.dim = dim
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.index = None
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            import hnswlib  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def build(self, matrix):
+        import hnswlib
+
+        self.index = hnswlib.Index(space="ip", dim=self.dim)
+        self.index.init_index(
+            max_elements=max(len(matrix), 1), ef_construction=self.ef_construction, M=self.m
+        )
+        self.index.add_items(matrix, np.arange(len(matrix)))
+        return self
+
+    def search(self, queries, k: int):
+        self.index.set_ef(max(self.ef, k))
+        labels, distances = self.index.knn_query(queries, k=k)
+        # hnswlib's inner product distance is 1 - <q, x>
+        return labels.astype(np.int64), (1.0 - distances).astype(np.float32)
+
+
+class EmbeddingMatrix:
+    """
+    Named embeddings kept as one contiguous matrix of L2-normalized float32
+    rows, so that ranking all rows against a batch of queries is a single
+    matrix product.
+
+    Past 'ann_threshold' rows, and if hnswlib is installed, searches go
+    through an approximate nearest neighbour index built on first use.
+    """
+
+    def __init__(self, dim: int, ann_threshold: int = 100_000):
+        self.dim = dim
+        self.ann_threshold = ann_threshold
+        self.names = []
+        self.map_name_to_row = {}
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.ann = None
+        # blocks of new rows, concatenated on the next read
+        self._pending = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.map_name_to_row
+
+    def set(self, names: list, embeddings, normalized: bool = False):
+        """
+        Add or replace the embeddings of 'names', one row per name.
+        Already normalized input (e.g. a memory-mapped index) is kept as is,
+        without a copy.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(
+            len(names), self.dim)
+        if not normalized:
+            embeddings = normalize_rows(embeddings)
+
+        existing = [idx for idx, name in enumerate(names)
+                    if name in self.map_name_to_row]
+        if existing:
+            self._flush()
+            if not self.matrix.flags.writeable:
+                self.matrix = np.array(self.matrix)
+            rows = [self.map_name_to_row[names[idx]] for idx in existing]
+            self.matrix[rows] = embeddings[existing]
+
+        new = [idx for idx, name in enumerate(names)
+               if name not in self.map_name_to_row]
+        for idx in new:
+            self.map_name_to_row[names[idx]] = len(self.names)
+            self.names.append(names[idx])
+        if new:
+            self._pending.append(
+                embeddings if len(new) == len(names) else embeddings[new])
+
+        self.ann = None
+
+    def get_matrix(self):
+        self._flush()
+        return self.matrix
+
+    def updated(self, names: list, embeddings, removed=()) -> "EmbeddingMatrix":
+        """
+        A copy with the embeddings of 'names' added or replaced and the rows
+        of 'removed' dropped, flushed and ready to search.
+
+        This matrix is left untouched, so it can keep serving searches while
+        the copy is built; publishing the copy is a single assignment.
+        """
+        dropped = set(removed) | set(names)
+        kept = [row for row, name in enumerate(self.names) if name not in dropped]
+
+        copy = EmbeddingMatrix(self.dim, self.ann_threshold)
+        copy.set([self.names[row] for row in kept], self.get_matrix()[kept], normalized=True)
+        copy.set(names, embeddings)
+        matrix = copy.get_matrix()
+
+        if len(matrix) >= copy.ann_threshold and AnnIndex.available():
+            copy.ann = AnnIndex(copy.dim).build(matrix)
+        return copy
+
+    def _flush(self):
+        if not self._pending:
+            return
+        if len(self.matrix) == 0 and len(self._pending) == 1:
+            self.matrix = self._pending[0]
+        else:
+            self.matrix = np.concatenate([self.matrix, *self._pending])
+        self._pending = []
+
+    def search(self, queries, k: int):
+        """
+        Find the 'k' rows most similar to each query.
+
+        Returns (indices, scores), both of shape (len(queries), k), sorted
+        by decreasing cosine similarity.
+        """
+        queries = normalize_rows(
+            np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        matrix = self.get_matrix()
+        k = min(k, len(matrix))
+
+        if k == 0:
+            return (np.empty((len(queries), 0), dtype=np.int64),
+                    np.empty((len(queries), 0), dtype=np.float32))
+
+        if self.ann is None and len(matrix) >= self.ann_threshold and AnnIndex.available():
+            self.ann = AnnIndex(self.dim).build(matrix)
+        if self.ann is not None:
+            return self.ann.search(queries, k)
+
+        scores = queries @ matrix.T
+        if k < len(matrix):
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(len(matrix)), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class SchemaIndex:
+    """
+    Persisted table embeddings.
+
+    An index is a directory holding the embeddings matrix (one float32 row
+    per table, as .npy so it can be memory-mapped) and a json file with the
+    table names, definitions and definition hashes, in row order. The
+    foreign keys between the tables are kept next to them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def embeddings_path(self):
+        return os.path.join(self.path, EMBEDDINGS_FILE)
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.path, META_FILE)
+
+    @property
+    def foreign_keys_path(self):
+        return os.path.join(self.path, FOREIGN_KEYS_FILE)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.embeddings_path) and os.path.isfile(self.meta_path)
+
+    def save(self, model_name: str, table_names: list, table_defs: dict, embeddings):
+        """
+        Write the index. Each file is written to a temporary name and then
+        renamed, so readers never see a half written file.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.shape[0] != len(table_names):
+            raise ValueError(
+                f"Got {embeddings.shape[0]} embeddings for {len(table_names)} tables")
+
+        os.makedirs(self.path, exist_ok=True)
+
+        meta = {
+            "version": INDEX_VERSION,
+            "model": model_name,
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "tables": [
+                {
+                    "name": name,
+                    "hash": hash_definition(table_defs[name]),
+                    "definition": table_defs[name],
+                }
+                for name in table_names
+            ],
+        }
+
+        tmp_embeddings_path = self.embeddings_path + ".tmp"
+        with open(tmp_embeddings_path, "wb") as file:
+            np.save(file, embeddings)
+        tmp_meta_path = self.meta_path + ".tmp"
+        with open(tmp_meta_path, "w") as file:
+            json.dump(meta, file)
+
+        os.replace(tmp_embeddings_path, self.embeddings_path)
+        os.replace(tmp_meta_path, self.meta_path)
+
+    def load(self, model_name: str):
+        """
+        Load the index, memory-mapping the (normalized) embeddings matrix
+        read-only.
+
+        Returns (tables, embeddings) where tables is the list of
+        {"name", "hash", "definition"} entries in row order, or None if there
+        is no usable index for this model.
+        """
+        if not self.exists():
+            return None
+
+        with open(self.meta_path) as file:
+            meta = json.load(file)
+
+        if meta.get("version") != INDEX_VERSION or meta.get("model") != model_name:
+            return None
+
+        embeddings = np.load(self.embeddings_path, mmap_mode="r")
+
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(meta["tables"]):
+            # the two files come from different builds
+            return None
+
+        return meta["tables"], embeddings
+
+    def save_foreign_keys(self, edges: list):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.foreign_keys_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(edges, file)
+        os.replace(tmp_path, self.foreign_keys_path)
+
+    def load_foreign_keys(self):
+        """
+        The persisted foreign key edges, None if there are none
+        """
+        if not os.path.isfile(self.foreign_keys_path):
+            return None
+        with open(self.foreign_keys_path) as file:
+            return json.load(file)
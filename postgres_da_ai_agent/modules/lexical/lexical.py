@@ -0,0 +1,175 @@
+import re
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+# Keyword retrieval over table and column names, without any model.
+#
+# Identifiers and questions are cut into the same terms: snake_case and
+# camelCase pieces, lowercased and singularized, so "order_items" matches
+# "items of an order" and "userAddresses" matches "user address". Every
+# table is a document made of its name (counted TABLE_NAME_WEIGHT times) and
+# its column names, scored with BM25 against the terms of the question.
+#
+# The BM25 weights are precomputed into a term-major sparse matrix, so a
+# lookup only touches the postings of the question's terms.
+
+TABLE_NAME_WEIGHT = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+IDENTIFIER_PART_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+# words of a question that are noise when they happen to be identifier pieces too
+STOP_WORDS = frozenset(
+    "a an and are as at be by do for from get give how i in is it list me my of on or "
+    "show that the their them there these this to was what when where which who with".split()
+)
+
+
+def singularize(word: str) -> str:
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "zes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """
+    The terms of an identifier or a question, in order
+    """
+    return [
+        singularize(part.lower())
+        for part in IDENTIFIER_PART_PATTERN.findall(text)
+        if part.lower() not in STOP_WORDS
+    ]
+
+
+def parse_columns(table_definition: str) -> list:
+    """
+    The (column name, column type) of a 'CREATE TABLE name (\\ncolumn type,\\n...\\n);'
+    definition, as rendered by PostgresDB.format_create_table_stmt
+    """
+    columns = []
+    for line in table_definition.splitlines()[1:-1]:
+        column_name, _, column_type = line.strip().rstrip(",").partition(" ")
+        if column_name:
+            columns.append((column_name, column_type))
+    return columns
+
+
+def parse_column_names(table_definition: str) -> list:
+    return [column_name for column_name, _column_type in parse_columns(table_definition)]
+
+
+class LexicalIndex:
+    """
+    BM25 over the table and column names of 'map_table_name_to_table_def'.
+    Immutable: build a new one when the tables change.
+    """
+
+    def __init__(self, map_table_name_to_table_def: dict):
+        # the map this index was built from
+        self.source = map_table_name_to_table_def
+        self.names = list(map_table_name_to_table_def.keys())
+
+        # table names as term sequences, to find the tables a question names
+        self.names_by_terms = {}
+        for table_name in self.names:
+            self.names_by_terms.setdefault(tuple(tokenize(table_name)), []).append(table_name)
+        self.max_name_terms = max(map(len, self.names_by_terms), default=0)
+
+        documents = [
+            tokenize(table_name) * TABLE_NAME_WEIGHT
+            + [term for column_name in parse_column_names(definition) for term in tokenize(column_name)]
+            for table_name, definition in map_table_name_to_table_def.items()
+        ]
+
+        self.vocabulary = {}
+        self.postings = None
+        if any(documents):
+            vectorizer = CountVectorizer(analyzer=lambda terms: terms)
+            counts = vectorizer.fit_transform(documents).tocsr().astype(np.float32)
+            self.vocabulary = vectorizer.vocabulary_
+            self.postings = self.bm25_weights(counts).tocsc()
+
+    @staticmethod
+    def bm25_weights(counts):
+        """
+        Replace each term frequency of the (documents x terms) 'counts' with
+        its BM25 weight
+        """
+        n_documents = counts.shape[0]
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() or 1.0
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log1p((n_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        weights = counts.copy()
+        rows = np.repeat(np.arange(n_documents), np.diff(counts.indptr))
+        tf = weights.data
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[rows] / average_length)
+        weights.data = (idf[weights.indices] * tf * (BM25_K1 + 1) / (tf + norm)).astype(np.float32)
+        return weights
+
+    def __len__(self):
+        return len(self.names)
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        The BM25 score of every table for 'query', in self.names order
+        """
+        scores = np.zeros(len(self.names), dtype=np.float32)
+        if self.postings is None:
+            return scores
+
+        indptr, indices, data = self.postings.indptr, self.postings.indices, self.postings.data
+        for term in set(tokenize(query)):
+            column = self.vocabulary.get(term)
+            if column is None:
+                continue
+            start, end = indptr[column], indptr[column + 1]
+            # a column has at most one entry per table, no index repeats
+            scores[indices[start:end]] += data[start:end]
+        return scores
+
+    def search(self, query: str, n: int = 3) -> list:
+        """
+        The top 'n' (table name, score) for 'query', best first, only tables
+        sharing at least one term with it
+        """
+        scores = self.scores(query)
+        matches = np.flatnonzero(scores)
+        if len(matches) > n:
+            matches = matches[np.argpartition(-scores[matches], n - 1)[:n]]
+        matches = sorted(matches, key=lambda row: (-scores[row], self.names[row]))
+        return [(self.names[row], float(scores[row])) for row in matches]
+
+    def mentioned_tables(self, query: str) -> list:
+        """
+        The tables whose whole name appears in 'query', plural or singular,
+        in order of appearance
+        """
+        terms = tokenize(query)
+        mentioned = {}
+        for start in range(len(terms)):
+            for length in range(1, min(self.max_name_terms, len(terms) - start) + 1):
+                for table_name in self.names_by_terms.get(tuple(terms[start:start + length]), ()):
+                    mentioned[table_name] = None
+        return list(mentioned)
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Merge several rankings of names into one, without duplicates: each name
+    scores the sum of 1 / (k + rank) over the rankings it is in
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, name in enumerate(ranking, start=1):
+            scores[name] = scores.get(name, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda name: -scores[name])
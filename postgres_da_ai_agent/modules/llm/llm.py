@@ -1,3 +1,6 @@
+from contextlib import nullcontext
+from functools import lru_cache
+import json
 import sys
 from dotenv import load_dotenv
 import os
@@ -8,9 +11,7 @@ from tiktoken import get_encoding
 # load .env file
 load_dotenv()
 
-assert os.environ.get("OPENAI_API_KEY")
-
-# get openai api key
+# get openai api key, prompt() exits with a helpful message if it is missing
 openai.api_key = os.environ.get("OPENAI_API_KEY")
 
 # ------------------ helpers ------------------
@@ -40,7 +41,24 @@ def response_parser(response: Dict[str, Any]):
 # ------------------ content generators ------------------
 
 
-def prompt(prompt: str, model: str = "gpt-4") -> str:
+def prompt(
+    prompt: str,
+    model: str = "gpt-4",
+    temperature: float = None,
+    system_prompt: str = None,
+    stream: bool = False,
+    on_stats=None,
+) -> str:
+    """
+    The completion of 'prompt'. With 'stream', it is printed as it arrives
+    and 'on_stats' is called with its time to first token and tokens/sec,
+    see modules/streaming. 'temperature' is only sent if given, the API
+    default applies otherwise; the response cache keeps temperature 0
+    completions only.
+    """
+    # imported here, modules/streaming counts tokens with this module
+    from postgres_da_ai_agent.modules.streaming.streaming import install_stream_hook, streaming_completions
+
     # validate the openai api key - if it's not valid, raise an error
     if not openai.api_key:
         sys.exit(
@@ -51,15 +69,24 @@ Example bash command:
             """
         )
 
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            }
-        ],
-    )
+    messages = [
+        {
+            "role": "user",
+            "content": prompt,
+        }
+    ]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+
+    if stream:
+        install_stream_hook()
+
+    params = {"model": model, "messages": messages}
+    if temperature is not None:
+        params["temperature"] = temperature
+
+    with streaming_completions(on_stats=on_stats) if stream else nullcontext():
+        response = openai.ChatCompletion.create(**params)
 
     return response_parser(response)
 
@@ -82,24 +109,74 @@ def add_cap_ref(
     return new_prompt
 
 
+# USD per 1k tokens (prompt, completion), matched on the longest model prefix
+MODEL_PRICES = {
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+}
+DEFAULT_MODEL = "gpt-4"
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding_name: str = "cl100k_base"):
+    """
+    The tiktoken encoding, loaded once per process
+    """
+    return get_encoding(encoding_name)
+
+
 def count_tokens(text: str):
     """
     Count the number of tokens in a string.
     """
-    enc = get_encoding("cl100k_base")
-    return len(enc.encode(text))
+    return len(get_tokenizer().encode(text))
+
+
+def message_text(message) -> str:
+    """
+    The text of a chat message that counts towards tokens: its content and
+    function call
+    """
+    if isinstance(message, str):
+        return message
+    text = message.get("content") or ""
+    if message.get("function_call"):
+        text += json.dumps(message["function_call"])
+    return text
+
+
+def get_model_prices(model: str = None):
+    """
+    (prompt, completion) USD per 1k tokens of 'model', gpt-4 prices for
+    unknown models
+    """
+    model = model or DEFAULT_MODEL
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return MODEL_PRICES[DEFAULT_MODEL]
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int, model: str = None) -> float:
+    """
+    Price in USD of a completion
+    """
+    prompt_price, completion_price = get_model_prices(model)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
 
 
-def estimate_price_and_tokens(text):
+def estimate_price_and_tokens(text, model: str = None):
     """
     Conservative estimate the price and tokens for a given text.
     """
     # round up to the output tokens
-    COST_PER_1k_TOKENS = 0.06
+    cost_per_1k_tokens = get_model_prices(model)[1]
 
     tokens = count_tokens(text)
 
-    estimated_cost = (tokens / 1000) * COST_PER_1k_TOKENS
+    estimated_cost = (tokens / 1000) * cost_per_1k_tokens
 
     # round
     estimated_cost = round(estimated_cost, 2)
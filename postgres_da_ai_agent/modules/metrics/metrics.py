@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import time
+
+# Taken when this module is first imported. main.py imports it before anything
+# else so that marks are relative to process start.
+PROCESS_START = time.perf_counter()
+
+
+class Metrics:
+    """
+    Named timings (in seconds) and values collected during one run
+    """
+
+    def __init__(self, start: float = None):
+        self.start = PROCESS_START if start is None else start
+        self.values = {}
+
+    def record(self, name: str, value):
+        self.values[name] = value
+
+    def mark(self, name: str):
+        """
+        Record the time elapsed since start under 'name'
+        """
+        self.values[name] = round(time.perf_counter() - self.start, 4)
+
+    def mark_once(self, name: str):
+        """
+        Like mark(), but only the first call for a given name counts
+        """
+        if name not in self.values:
+            self.mark(name)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Record the duration of the 'with' block under 'name'
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.values[name] = round(time.perf_counter() - started, 4)
+
+    def write(self, path: str, **extra):
+        """
+        Append the collected values as one json line to 'path'
+        """
+        line = {"date": datetime.now().isoformat(), **extra, **self.values}
+        with open(path, "a") as file:
+            file.write(json.dumps(line) + "\n")
+
+
+run_metrics = Metrics()
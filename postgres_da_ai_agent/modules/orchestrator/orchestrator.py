@@ -1,15 +1,65 @@
-from postgres_da_ai_agent.modules.llm.llm import estimate_price_and_tokens
+from postgres_da_ai_agent.modules.history.history import HistoryCompaction
+from postgres_da_ai_agent.modules.metrics.metrics import Metrics, run_metrics
+from postgres_da_ai_agent.modules.streaming.streaming import streaming_completions
+from postgres_da_ai_agent.modules.usage.usage import (
+    TokenUsage,
+    install_usage_hook,
+    recording_responses,
+)
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
 from typing import List, Optional, Tuple
+import asyncio
+import itertools
 import autogen
 
 
 class Orchestrator:
-    def __init__(self, name: str, agents: List[autogen.ConversableAgent]):
+    """
+    Runs a conversation between agents, sequentially or broadcast from the
+    first agent to the others.
+
+    The async variants (asequential_conversation, abroadcast_conversation)
+    run the blocking agent replies in worker threads: at most
+    'max_concurrency' at a time, each given up to 'agent_timeout' seconds.
+
+    With a 'compaction' policy, an agent's history is compacted before each
+    of its replies, see modules/history.
+
+    Completions are totalled in 'usage', a new TokenUsage by default.
+
+    With 'stream_final_turn', the completions of the last step of a
+    sequential conversation are streamed to the terminal as they arrive,
+    their stats (time to first token, tokens/sec) are kept in self.streams.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        agents: List[autogen.ConversableAgent],
+        metrics: Metrics = None,
+        max_concurrency: int = 4,
+        agent_timeout: float = None,
+        compaction: HistoryCompaction = None,
+        usage: TokenUsage = None,
+        stream_final_turn: bool = False,
+    ):
         self.name = name
         self.agents = agents
+        self.metrics = metrics or run_metrics
+        self.max_concurrency = max_concurrency
+        self.agent_timeout = agent_timeout
+        self.compaction = compaction
+        self.compacted_tokens = 0
+        self.stream_final_turn = stream_final_turn
+        self.streams = []
         self.messages = []
         self.complete_keyword = "APPROVED"
         self.error_keyword = "ERROR"
+        # token and cost totals, updated after every reply
+        self.usage = usage or TokenUsage()
+        self.turns = itertools.count()
+
+        install_usage_hook()
 
         if len(self.agents) < 2:
             raise Exception(
@@ -41,32 +91,64 @@ class Orchestrator:
             return None
         return self.messages[-1]
 
-    def add_message(self, message):
-        self.messages.append(message)
-
-    def last_message_is_function_call(self):
-        return self.last_message_is_dictionary and self.latest_message.get("function_call", None)
+    def add_message(self, message, messages: list = None):
+        (self.messages if messages is None else messages).append(message)
 
     def has_functions(self, agent: autogen.ConversableAgent) -> bool:
         return bool(agent.function_map)
 
-    def function_chat(self, agent_a, agent_b, message):
+    def generate_reply(self, agent: autogen.ConversableAgent, sender: autogen.ConversableAgent):
+        """
+        agent.generate_reply(), recording the tokens of the completions it
+        makes under the agent and the turn
+        """
+        with tracer.span("generate_reply", agent=agent.name, sender=sender.name) as span:
+            if not agent.llm_config:
+                return agent.generate_reply(sender=sender)
+
+            self.metrics.mark_once("time_to_first_llm_request")
+
+            turn = next(self.turns)
+
+            if self.compaction:
+                compacted_tokens = self.compaction.compact_agent(agent)
+                self.compacted_tokens += compacted_tokens
+                span.set(compacted_tokens=compacted_tokens)
+
+            def record(params, response):
+                self.usage.record_response(agent.name, turn, params, response)
+
+            with recording_responses(record):
+                reply = agent.generate_reply(sender=sender)
+
+            turn_usage = self.usage.by_turn.get(turn)
+            if turn_usage:
+                span.set(
+                    turn=turn,
+                    prompt_tokens=turn_usage["prompt_tokens"],
+                    completion_tokens=turn_usage["completion_tokens"],
+                )
+            return reply
+
+    def function_chat(self, agent_a, agent_b, message, messages: list = None):
         print(f"function_chat(): {agent_a.name} ➡️ {agent_b.name}")
 
-        self.basic_chat(agent_a, agent_b, message)
+        messages = self.messages if messages is None else messages
+
+        self.basic_chat(agent_a, agent_b, message, messages)
 
         # assert self.last_message_is_content
 
-        self.basic_chat(agent_b, agent_a, self.latest_message)
+        self.basic_chat(agent_b, agent_a, messages[-1], messages)
 
-        reply = agent_b.generate_reply(sender=agent_a)
+        reply = self.generate_reply(agent_b, agent_a)
 
         if (reply == None):
             reply = "APPROVED"
 
         agent_b.send(reply, agent_b)
 
-        self.add_message(reply)
+        self.add_message(reply, messages)
 
         print(f"function_chat() replied with: {reply}")
 
@@ -75,15 +157,16 @@ class Orchestrator:
         agent_a: autogen.ConversableAgent,
         agent_b: autogen.ConversableAgent,
         message: str,
+        messages: list = None,
     ):
         print(f"basic_chat(): {agent_a.name} ➡️ {agent_b.name}")
 
         agent_a.send(message, agent_b)
 
-        reply = agent_b.generate_reply(sender=agent_a)
+        reply = self.generate_reply(agent_b, agent_a)
         if (reply == None):
             reply = "APPROVED"
-        self.add_message(reply)
+        self.add_message(reply, messages)
 
         print(f"basic_chat() replied with: {reply}")
 
@@ -92,26 +175,73 @@ class Orchestrator:
         agent_a: autogen.ConversableAgent,
         agent_b: autogen.ConversableAgent,
         message: str,
+        messages: list = None,
     ):
         print(f"memory_chat(): {agent_a.name} ➡️ {agent_b.name}")
 
         agent_a.send(message, agent_b)
 
-        reply = agent_b.generate_reply(sender=agent_a)
+        reply = self.generate_reply(agent_b, agent_a)
 
         agent_b.send(reply, agent_b)
 
-        self.add_message(reply)
+        self.add_message(reply, messages)
 
         print(f"memory_chat() replied with: {reply}")
 
+    def sequential_step(self, agent_a, agent_b, messages: list):
+        """
+        One iteration of the sequential conversation, adding the replies to
+        'messages'
+        """
+        with tracer.span("turn", agent_a=agent_a.name, agent_b=agent_b.name):
+
+            # agent_a -> chat -> agent_b
+
+            if isinstance(messages[-1], str):
+
+                self.basic_chat(agent_a, agent_b, messages[-1], messages)
+
+            # agent_a -> function_call -> agent_b
+
+            if isinstance(messages[-1], dict) and messages[-1].get("function_call"):
+
+                self.function_chat(agent_a, agent_b, messages[-1], messages)
+
+    def record_stream(self, stats: dict):
+        self.metrics.mark_once("time_to_first_streamed_token")
+        self.streams.append(stats)
+
+    def run_step(self, idx: int, step, *args):
+        """
+        step(*args) for iteration 'idx' of a sequential conversation, its
+        completions streamed if it is the last one and stream_final_turn
+        """
+        if not (self.stream_final_turn and idx == self.total_agents - 2):
+            return step(*args)
+        with streaming_completions(on_stats=self.record_stream):
+            return step(*args)
+
+    def sequential_result(self) -> Tuple[bool, List[str]]:
+        print(f" -------- ◻︎ Orchestrator Complete ◻︎ ----------\n\n")
+
+        was_successful = self.complete_keyword in self.latest_message
+
+        if was_successful:
+            print(f"✅ -------- Orchestrator SUCCESSFUL ----------\n\n")
+
+        else:
+            print(f"❌ -------- Orchestrator FAILED ----------\n\n")
+
+        return was_successful, self.messages
+
     def sequential_conversation(self, prompt: str) -> Tuple[bool, List[str]]:
 
         print(f"\n\n--------{self.name} 🤖 Orchestrator Starting ---------\n\n")
 
         self.add_message(prompt)
 
-        for idx, agent in enumerate(self.agents):
+        for idx in range(self.total_agents - 1):
             agent_a = self.agents[idx]
             agent_b = self.agents[idx + 1]
 
@@ -119,30 +249,63 @@ class Orchestrator:
                 f"\n\n-------- Running iteration {idx} with (agent_a: {agent_a.name}, agent_b: {agent_b.name}) ---------\n\n"
             )
 
-            # agent_a -> chat -> agent_b
+            self.run_step(idx, self.sequential_step, agent_a, agent_b, self.messages)
+
+        return self.sequential_result()
 
-            if self.last_message_is_string:
+    async def asequential_conversation(self, prompt: str) -> Tuple[bool, List[str]]:
+        """
+        sequential_conversation() without blocking the event loop, so many
+        conversations can run side by side. Each step runs in a worker thread
+        and is given up to 'agent_timeout' seconds; a step that times out
+        ends the conversation as failed.
+        """
+        print(f"\n\n--------{self.name} 🤖 Orchestrator Starting ---------\n\n")
 
-                self.basic_chat(agent_a, agent_b, self.latest_message)
+        self.add_message(prompt)
 
-            # agent_a -> function_call -> agent_b
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        for idx in range(self.total_agents - 1):
+            agent_a = self.agents[idx]
+            agent_b = self.agents[idx + 1]
+
+            print(
+                f"\n\n-------- Running iteration {idx} with (agent_a: {agent_a.name}, agent_b: {agent_b.name}) ---------\n\n"
+            )
+
+            # the step works on its own list, so a step still running after
+            # its timeout can't add messages out of order
+            step_messages = [self.latest_message]
+            completed = await self.run_agent_step(
+                semaphore, agent_b, self.run_step, idx, self.sequential_step, agent_a, agent_b, step_messages)
 
-            if self.last_message_is_function_call:
+            if not completed:
+                self.add_message(self.timeout_message(agent_b))
+                print(f"❌ -------- Orchestrator FAILED ----------\n\n")
+                return False, self.messages
 
-                self.function_chat(agent_a, agent_b, self.latest_message)
+            self.messages.extend(step_messages[1:])
 
-            if idx == self.total_agents - 2:
-                print(f" -------- ◻︎ Orchestrator Complete ◻︎ ----------\n\n")
+        return self.sequential_result()
 
-                was_successful = self.complete_keyword in self.latest_message
+    def broadcast_step(self, broadcast_agent, agent_iterate, prompt: str, messages: list):
+        """
+        Send the broadcast prompt to one agent, adding the replies to 'messages'
+        """
+        with tracer.span("turn", agent_a=broadcast_agent.name, agent_b=agent_iterate.name):
 
-                if was_successful:
-                    print(f"✅ -------- Orchestrator SUCCESSFUL ----------\n\n")
+            # broadcast_agent -> chat -> agents[idx]
 
-                else:
-                    print(f"❌ -------- Orchestrator FAILED ----------\n\n")
+            if isinstance(messages[-1], str):
 
-                return was_successful, self.messages
+                self.memory_chat(broadcast_agent, agent_iterate,
+                                 prompt, messages)
+
+            if isinstance(messages[-1], dict) and messages[-1].get("function_call") and self.has_functions(agent_iterate):
+
+                self.function_chat(agent_iterate, agent_iterate,
+                                   messages[-1], messages)
 
     def broadcast_conversation(self, prompt: str) -> Tuple[bool, List[str]]:
         """Broadcast a message to all agents
@@ -169,30 +332,81 @@ class Orchestrator:
                 f"\n\n-------- ◻︎ Running iteration {idx} with (broadcast_agent: {broadcast_agent.name}, agent_iteration: {agent_iterate.name}) ◻︎ --------- \n\n"
             )
 
-            # broadcast_agent -> chat -> agents[idx]
+            self.broadcast_step(broadcast_agent, agent_iterate, prompt, self.messages)
+
+        print(f" -------- ◻︎ Orchestrator Complete ◻︎ ----------\n\n")
 
-            if self.last_message_is_string:
+        print(f"✅ -------- Orchestrator SUCCESSFUL ----------\n\n")
 
-                self.memory_chat(broadcast_agent, agent_iterate,
-                                 prompt)
+        return True, self.messages
 
-            if self.last_message_is_function_call and self.has_functions(agent_iterate):
+    async def abroadcast_conversation(self, prompt: str) -> Tuple[bool, List[str]]:
+        """
+        broadcast_conversation() with the agents replying concurrently, up to
+        'max_concurrency' at a time, so it takes about as long as the slowest
+        agent.
+
+        Every agent gets the prompt, whatever the agent before it replied,
+        and its replies are added to self.messages in agent order, as in
+        broadcast_conversation(). An agent that doesn't reply within
+        'agent_timeout' seconds gets an ERROR message instead, and the
+        conversation is reported as failed.
+        """
+        print(f"\n\n--------{self.name} 🤖 Orchestrator Starting ---------\n\n")
 
-                self.function_chat(agent_iterate, agent_iterate,
-                                   self.latest_message)
+        self.add_message(prompt)
+
+        broadcast_agent = self.agents[0]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        branches = [[prompt] for _ in self.agents[1:]]
+        completed = await asyncio.gather(*[
+            self.run_agent_step(
+                semaphore, agent_iterate, self.broadcast_step, broadcast_agent, agent_iterate, prompt, branch)
+            for agent_iterate, branch in zip(self.agents[1:], branches)
+        ])
+
+        for agent_iterate, branch, branch_completed in zip(self.agents[1:], branches, completed):
+            if branch_completed:
+                self.messages.extend(branch[1:])
+            else:
+                self.add_message(self.timeout_message(agent_iterate))
 
         print(f" -------- ◻︎ Orchestrator Complete ◻︎ ----------\n\n")
 
-        print(f"✅ -------- Orchestrator SUCCESSFUL ----------\n\n")
+        was_successful = all(completed)
 
-        return True, self.messages
+        if was_successful:
+            print(f"✅ -------- Orchestrator SUCCESSFUL ----------\n\n")
+
+        else:
+            print(f"❌ -------- Orchestrator FAILED ----------\n\n")
+
+        return was_successful, self.messages
+
+    async def run_agent_step(self, semaphore: asyncio.Semaphore, agent, step, *args) -> bool:
+        """
+        Run the blocking step(*args) in a worker thread once 'semaphore' lets
+        it, waiting up to 'agent_timeout' seconds. False if it timed out; the
+        thread itself can't be interrupted and finishes in the background.
+        """
+        async with semaphore:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(step, *args), self.agent_timeout)
+                return True
+            except asyncio.TimeoutError:
+                print(f"⏱️ {agent.name} did not reply within {self.agent_timeout}s")
+                return False
+
+    def timeout_message(self, agent) -> str:
+        return f"{self.error_keyword}: {agent.name} did not reply within {self.agent_timeout}s"
 
     def get_message_as_str(self):
         """
         Get all messages as a string
         """
 
-        messages_as_str = ""
+        messages_as_str = []
 
         for message in self.messages:
             if message is None:
@@ -204,11 +418,15 @@ class Orchestrator:
                 content = content_from_dict or func_call_from_dict
                 if not content:
                     continue
-                messages_as_str += str(content)
+                messages_as_str.append(str(content))
             else:
-                messages_as_str += str(message)
+                messages_as_str.append(str(message))
 
-        return messages_as_str
+        return "".join(messages_as_str)
 
     def get_cost_and_tokens(self):
-        return estimate_price_and_tokens(self.get_message_as_str())
+        """
+        Cost in USD and tokens (prompt + completion) of every completion so
+        far, see self.usage.summary() for the split by agent and turn
+        """
+        return self.usage.cost, self.usage.total_tokens
@@ -0,0 +1,186 @@
+from postgres_da_ai_agent.modules.agents.agents import create_data_engineering_agents
+from postgres_da_ai_agent.modules.config.config import (
+    get_fast_path_config,
+    get_fk_expansion_config,
+    get_history_compaction_config,
+    get_schema_prompt_config,
+)
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
+from postgres_da_ai_agent.modules.fastpath.fastpath import FastPath
+from postgres_da_ai_agent.modules.history.history import HistoryCompaction
+from postgres_da_ai_agent.modules.metrics.metrics import Metrics
+from postgres_da_ai_agent.modules.orchestrator.orchestrator import Orchestrator
+from postgres_da_ai_agent.modules.prompts.prompts import (
+    get_first_instruction_pompt,
+)
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
+from postgres_da_ai_agent.modules.usage.usage import TokenUsage
+
+AGENT_TEAM_NAME = "::: 🤖 Postgres Data Analytics Multi-Agent Team 🤖 :::"
+
+
+def get_first_prompt(database_embedder: DatabaseEmbedder, user_prompt: str) -> str:
+    """
+    Build the first instruction prompt with the definitions of the tables
+    most relevant to the user prompt, and of the tables they are joined to
+    by foreign keys. Unless turned off, definitions are compact and keep only
+    the keys and the columns relevant to the user prompt.
+    """
+    with tracer.span("get_similar_tables") as span:
+        similar_tables = database_embedder.get_similar_tables(user_prompt)
+        span.set(tables=similar_tables)
+
+    fk_expansion_config = get_fk_expansion_config()
+    if fk_expansion_config:
+        with tracer.span("get_related_tables") as span:
+            related_tables = database_embedder.get_related_tables(
+                similar_tables, **fk_expansion_config)
+            span.set(tables=related_tables)
+        similar_tables = similar_tables + related_tables
+
+    schema_prompt_config = get_schema_prompt_config()
+    with tracer.span("build_prompt", compact=bool(schema_prompt_config)):
+        if schema_prompt_config:
+            table_definitions = database_embedder.get_compact_table_definitions_from_names(
+                user_prompt, similar_tables, **schema_prompt_config)
+        else:
+            table_definitions = database_embedder.get_table_definitions_from_names(
+                similar_tables)
+
+        return get_first_instruction_pompt(
+            user_prompt, table_definitions, compact=bool(schema_prompt_config))
+
+
+def get_data_analyst_result(messages: list):
+    """
+    The result of the last run_sql call in the messages of the data
+    engineering team or the fast path, None if no query was run
+    """
+    for message in reversed(messages):
+        if isinstance(message, dict) and message.get("role") == "function" and message.get("name") == "run_sql":
+            return message.get("content")
+    return None
+
+
+def run_data_engineering_team(
+    db: PostgresDB,
+    database_embedder: DatabaseEmbedder,
+    user_prompt: str,
+    agents: list = None,
+    metrics: Metrics = None,
+    prompt: str = None,
+    usage: TokenUsage = None,
+    stream: bool = False,
+) -> dict:
+    """
+    Answer one user prompt with a fresh data engineering team.
+
+    'agents' defaults to a newly created team bound to 'db'; agents keep
+    conversation state, so a team must not be shared between prompts.
+    'prompt' is the first prompt, if already built, and 'usage' the
+    TokenUsage to add the team's completions to. 'stream' prints the final
+    turn as it arrives, for interactive use only: concurrent conversations
+    would interleave their output.
+    """
+    prompt = prompt or get_first_prompt(database_embedder, user_prompt)
+
+    history_compaction_config = get_history_compaction_config()
+
+    orchestrator = Orchestrator(
+        name=AGENT_TEAM_NAME,
+        agents=agents or create_data_engineering_agents(db),
+        metrics=metrics,
+        compaction=HistoryCompaction(**history_compaction_config) if history_compaction_config else None,
+        usage=usage,
+        stream_final_turn=stream,
+    )
+
+    with tracer.span("conversation", team=orchestrator.name) as span:
+        success, messages = orchestrator.sequential_conversation(prompt)
+        span.set(success=success, messages=len(messages))
+
+    cost, tokens = orchestrator.get_cost_and_tokens()
+
+    return {
+        "success": success,
+        "result": get_data_analyst_result(messages),
+        "cost": cost,
+        "tokens": tokens,
+        "usage": orchestrator.usage.summary(),
+        "compacted_tokens": orchestrator.compacted_tokens,
+        "streams": orchestrator.streams,
+        "messages": messages,
+    }
+
+
+def get_escalation_prompt(prompt: str, attempt: dict) -> str:
+    """
+    The first prompt, with the fast path query and why it was set aside
+    """
+    if not attempt["sql"]:
+        return prompt
+    return (
+        f"{prompt}\n\nA first single query attempt was set aside because {attempt['reason']}:\n\n{attempt['sql']}"
+    )
+
+
+def run_adaptive(
+    db: PostgresDB,
+    database_embedder: DatabaseEmbedder,
+    user_prompt: str,
+    agents: list = None,
+    metrics: Metrics = None,
+    stream: bool = False,
+) -> dict:
+    """
+    Answer one user prompt with the fast path (modules/fastpath), escalating
+    to the data engineering team on errors, empty results, low confidence or
+    ambiguity. Without a fast path config, the team answers directly.
+    'stream' prints the completions as they arrive, see
+    run_data_engineering_team.
+
+    Returns run_data_engineering_team()'s result, with "mode" being "fast",
+    "escalated" or "sequential", and the "escalation_reason" if escalated.
+    """
+    fast_path_config = get_fast_path_config()
+    if not fast_path_config:
+        result = run_data_engineering_team(db, database_embedder, user_prompt, agents, metrics, stream=stream)
+        return {**result, "mode": "sequential", "escalation_reason": None}
+
+    prompt = get_first_prompt(database_embedder, user_prompt)
+
+    usage = TokenUsage()
+    fast_path = FastPath(db, usage=usage, metrics=metrics, **fast_path_config)
+
+    with tracer.span("fast_path") as span:
+        attempt = fast_path.run(prompt, stream=stream)
+        span.set(answered=attempt["answered"], reason=attempt["reason"])
+
+    if attempt["answered"]:
+        print(f"⚡ Answered with a single query (confidence {attempt['confidence']})")
+        return {
+            "success": True,
+            "result": get_data_analyst_result(attempt["messages"]),
+            "cost": usage.cost,
+            "tokens": usage.total_tokens,
+            "usage": usage.summary(),
+            "compacted_tokens": 0,
+            "streams": attempt["streams"],
+            "messages": attempt["messages"],
+            "mode": "fast",
+            "escalation_reason": None,
+        }
+
+    print(f"↗️ Escalating to the data engineering team: {attempt['reason']}")
+
+    result = run_data_engineering_team(
+        db, database_embedder, user_prompt, agents, metrics,
+        prompt=get_escalation_prompt(prompt, attempt), usage=usage, stream=stream)
+
+    return {
+        **result,
+        "streams": attempt["streams"] + result["streams"],
+        "mode": "escalated",
+        "escalation_reason": attempt["reason"],
+    }
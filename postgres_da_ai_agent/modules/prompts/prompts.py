@@ -1,4 +1,5 @@
 from postgres_da_ai_agent.modules.llm.llm import add_cap_ref
+from postgres_da_ai_agent.modules.schema.schema import COMPACT_SCHEMA_LEGEND
 
 COMPLETION_PROMPT = "If everything looks good overall, respond with the word APPROVED"
 
@@ -16,15 +17,27 @@ PRODUCT_MANAGER_PROMPT = (
     "A Product Manager. You validate the response to make sure it is correct. You review the response, check carefully if the response fits the desired request from the admin and approve the execution result. Finally create a natural language response based on the results of the query that generates de Data Analyst and follow the next instruction: " + COMPLETION_PROMPT
 )
 
+FAST_PATH_PROMPT = (
+    "A Sr Data Analyst answering a question on your own with a single PostgreSQL query. Reply with only a JSON object: "
+    '{"sql": "the query", "confidence": how sure you are, from 0 to 1, that the query answers the question exactly, '
+    '"ambiguities": ["each part of the question that could be read in several ways or that the tables do not cover"]}. '
+    "Leave 'ambiguities' empty only if there are none."
+)
+
 TEXT_REPORT_ANALYSIS_PROMPT = "Text file Report Analyst. You exclusively use the write_file function on a summarized report."
 
 POSTGRES_TABLE_DEFINITIONS_CAP_REF = "TABLE_DEFINITIONS"
 
 
-def get_first_instruction_pompt(prompt: str, table_definitions: str) -> str:
+def get_first_instruction_pompt(prompt: str, table_definitions: str, compact: bool = False) -> str:
+    """
+    'compact' explains the notation of table definitions rendered by
+    schema.render_compact_schema
+    """
     FIRST_INSTRUCTION_PROMPT = add_cap_ref(
         prompt,
-        f"Use this {POSTGRES_TABLE_DEFINITIONS_CAP_REF} to satisfy the database query.",
+        f"Use this {POSTGRES_TABLE_DEFINITIONS_CAP_REF} to satisfy the database query."
+        + (f" {COMPACT_SCHEMA_LEGEND}" if compact else ""),
         POSTGRES_TABLE_DEFINITIONS_CAP_REF,
         table_definitions,
     )
@@ -0,0 +1,103 @@
+import re
+from postgres_da_ai_agent.modules.llm.llm import count_tokens
+
+# Compact table definitions for the first instruction prompt, one line per
+# table instead of a CREATE TABLE block:
+#
+#     orders(id int, customer_id int -> customers.id, status text, ...4 more)
+#
+# Only the key columns (either end of a foreign key, and 'id') and the
+# columns most relevant to the question are kept. That prompt is re-sent with
+# every turn, so every token saved here is saved on each LLM call.
+
+COMPACT_SCHEMA_LEGEND = (
+    "Tables are written as table(column type, ...), 'column type -> table.column' "
+    "is a foreign key and '...N more' stands for columns left out."
+)
+
+SHORT_TYPES = [
+    (re.compile(r"^character varying"), "varchar"),
+    (re.compile(r"^character\b"), "char"),
+    (re.compile(r"^timestamp without time zone"), "timestamp"),
+    (re.compile(r"^timestamp with time zone"), "timestamptz"),
+    (re.compile(r"^time without time zone"), "time"),
+    (re.compile(r"^time with time zone"), "timetz"),
+    (re.compile(r"^integer\b"), "int"),
+    (re.compile(r"^double precision"), "float8"),
+    (re.compile(r"^boolean"), "bool"),
+]
+
+
+def short_type(column_type: str) -> str:
+    for pattern, short in SHORT_TYPES:
+        column_type = pattern.sub(short, column_type)
+    return column_type
+
+
+def render_compact_table(table_name: str, columns: list, references: dict = None, omitted: int = 0) -> str:
+    """
+    One line for 'table_name' with 'columns' (name, type), 'omitted' more
+    left out
+    """
+    references = references or {}
+    parts = [
+        f"{column_name} {short_type(column_type)}".rstrip()
+        + (f" -> {references[column_name]}" if column_name in references else "")
+        for column_name, column_type in columns
+    ]
+    if omitted:
+        parts.append(f"...{omitted} more")
+    return f"{table_name}({', '.join(parts)})"
+
+
+def render_compact_schema(tables: list, max_columns: int = None, token_budget: int = None) -> str:
+    """
+    Render 'tables', best first, each a dict of:
+        "name", "columns" [(name, type)], "scores" [relevance per column],
+        "keys" (column names always kept) and "references" {column: "table.column"}
+
+    Each table keeps its keys and its 'max_columns' best other columns, in
+    their original order. Past 'token_budget', the least relevant columns
+    are dropped across all tables, then the last tables.
+    """
+    kept = []
+    for table in tables:
+        keys = [idx for idx, (name, _type) in enumerate(table["columns"]) if name in table["keys"]]
+        others = sorted(
+            (idx for idx, (name, _type) in enumerate(table["columns"]) if name not in table["keys"]),
+            key=lambda idx: -table["scores"][idx],
+        )
+        if max_columns is not None:
+            others = others[:max(max_columns - len(keys), 0)]
+        kept.append(set(keys + others))
+
+    def render(position):
+        table = tables[position]
+        columns = [column for idx, column in enumerate(table["columns"]) if idx in kept[position]]
+        return render_compact_table(
+            table["name"], columns, table["references"], len(table["columns"]) - len(columns))
+
+    lines = [render(position) for position in range(len(tables))]
+    if not token_budget:
+        return "\n".join(lines)
+
+    tokens = [count_tokens(line) for line in lines]
+    while lines and sum(tokens) + len(lines) - 1 > token_budget:
+        droppable = [
+            (tables[position]["scores"][idx], position, idx)
+            for position in range(len(lines))
+            for idx in kept[position]
+            if tables[position]["columns"][idx][0] not in tables[position]["keys"]
+        ]
+        if droppable:
+            _score, position, idx = min(droppable)
+            kept[position].discard(idx)
+            lines[position] = render(position)
+            tokens[position] = count_tokens(lines[position])
+        elif len(lines) > 1:
+            lines.pop()
+            tokens.pop()
+        else:
+            break
+
+    return "\n".join(lines)
@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import time
+from postgres_da_ai_agent.modules.cache.cache import (
+    STALE_RESULTS_WARNING,
+    QueryResultCache,
+    ResponseCache,
+    install_response_cache,
+)
+from postgres_da_ai_agent.modules.config.config import (
+    get_llm_cache_config,
+    get_result_cache_config,
+    get_run_sql_config,
+    get_schema_watch_config,
+)
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
+from postgres_da_ai_agent.modules.metrics.metrics import Metrics
+from postgres_da_ai_agent.modules.pipeline.pipeline import run_adaptive
+from postgres_da_ai_agent.modules.watcher.watcher import SchemaWatcher
+
+
+class AgentServer:
+    """
+    Keeps the embedder, the schema index and a pool of database connections
+    warm across prompts.
+
+    Every prompt gets its own agents and orchestrator, and a pooled
+    connection of its own for as long as it runs, so prompts can be answered
+    concurrently.
+
+    Unless turned off, a SchemaWatcher re-embeds the tables changed by DDL
+    while the server runs. watch_schema=False leaves it off whatever the
+    configuration, e.g. for a batch run that sizes the pool to its workers.
+    """
+
+    def __init__(self, db_url: str, index_path: str, pool_size: int = 4, watch_schema: bool = True):
+        self.db_url = db_url
+        self.index_path = index_path
+        self.pool_size = pool_size
+        self.watch_schema = watch_schema
+        result_cache_config = get_result_cache_config()
+        self.result_cache = None
+        if result_cache_config:
+            print(STALE_RESULTS_WARNING)
+            self.result_cache = QueryResultCache(**result_cache_config)
+
+        self.db = PostgresDB(**get_run_sql_config(), result_cache=self.result_cache)
+        self.db.connect_with_pool(db_url, max_size=pool_size)
+        self.database_embedder = None
+        self.schema_watcher = None
+
+        llm_cache_config = get_llm_cache_config()
+        self.llm_cache = ResponseCache(**llm_cache_config) if llm_cache_config else None
+
+    def start(self):
+        """
+        Load the model and the index
+        """
+        if self.llm_cache:
+            install_response_cache(self.llm_cache)
+
+        schema_watch_config = get_schema_watch_config() if self.watch_schema else None
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            embedder_future = executor.submit(DatabaseEmbedder)
+
+            # read before the catalog, so DDL made meanwhile is caught by the watcher
+            fingerprints = self.db.get_table_fingerprints() if schema_watch_config else None
+            map_table_name_to_table_def = self.db.get_table_definition_map_for_embeddings()
+            foreign_keys = self.db.get_foreign_keys()
+
+            self.database_embedder = embedder_future.result()
+            self.database_embedder.set_foreign_keys(foreign_keys)
+
+        stale_tables = self.database_embedder.load_index(
+            self.index_path, map_table_name_to_table_def)
+
+        if stale_tables:
+            self.database_embedder.save_index(self.index_path)
+
+        if schema_watch_config:
+            self.schema_watcher = SchemaWatcher(
+                self.db,
+                self.database_embedder,
+                index_path=self.index_path,
+                db_url=self.db_url,
+                fingerprints=fingerprints,
+                **schema_watch_config,
+            )
+            self.schema_watcher.start()
+
+        print(
+            f"Agent server ready: {len(map_table_name_to_table_def)} tables, {self.pool_size} connections")
+
+    def close(self):
+        if self.schema_watcher:
+            self.schema_watcher.stop()
+        self.db.close()
+        if self.llm_cache:
+            self.llm_cache.close()
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.db.pool.stats(),
+            "llm_cache": self.llm_cache.stats() if self.llm_cache else None,
+            "result_cache": self.result_cache.stats() if self.result_cache else None,
+            "schema_watcher": self.schema_watcher.stats() if self.schema_watcher else None,
+        }
+
+    def answer(self, user_prompt: str) -> dict:
+        """
+        Answer 'user_prompt' with the fast path or the data engineering team,
+        see pipeline.run_adaptive
+        """
+        metrics = Metrics(start=time.perf_counter())
+
+        with self.db.session() as db:
+            # answers run concurrently, streamed output would interleave
+            result = run_adaptive(
+                db, self.database_embedder, user_prompt, metrics=metrics, stream=False)
+
+        result["metrics"] = metrics.values
+        return result
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health  -> {"status": "ok", "pool": {...}, "llm_cache": {...}, "result_cache": {...}}
+    POST /prompt  {"prompt": "..."} -> {"success", "mode", "result", "cost", "tokens", "messages", "metrics"}
+    """
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        self.send_json(
+            200, {"status": "ok", **self.server.agent_server.stats()})
+
+    def do_POST(self):
+        if self.path != "/prompt":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            user_prompt = json.loads(self.rfile.read(length))["prompt"]
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": 'Expected a json body like {"prompt": "..."}'})
+            return
+
+        try:
+            result = self.server.agent_server.answer(user_prompt)
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+
+        self.send_json(200, result)
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve(agent_server: AgentServer, host: str = "127.0.0.1", port: int = 8000):
+    """
+    Serve prompts over HTTP until interrupted, one thread per request
+    """
+    agent_server.start()
+
+    httpd = ThreadingHTTPServer((host, port), AgentRequestHandler)
+    httpd.agent_server = agent_server
+
+    print(f"Listening on http://{host}:{port}")
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        agent_server.close()
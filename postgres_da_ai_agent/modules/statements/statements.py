@@ -0,0 +1,106 @@
+import re
+
+# Splitting SQL text into statements, the way Postgres' lexer sees them:
+# '--' and (nested) '/* */' comments are dropped, and a ';' only ends a
+# statement outside of 'strings', E'escaped \' strings', "identifiers" and
+# $tag$ dollar-quoted bodies $tag$. Checks on the statements an LLM writes
+# (one row-returning statement? which one to EXPLAIN?) rely on this rather
+# than on the raw text, which often starts with a comment.
+
+DOLLAR_QUOTE_PATTERN = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)?\$")
+
+# statements run through a server-side cursor
+ROW_RETURNING_KEYWORDS = ("select", "with", "values", "table")
+
+# statements EXPLAIN can plan
+EXPLAINABLE_KEYWORDS = ROW_RETURNING_KEYWORDS + ("insert", "update", "delete", "merge", "execute")
+
+
+def is_identifier_char(char: str) -> bool:
+    return char.isalnum() or char in "_$"
+
+
+def split_statements(sql: str) -> list:
+    """
+    The statements of 'sql', without comments, stripped, empty ones left out
+    """
+    statements, current = [], []
+    i, length = 0, len(sql)
+
+    while i < length:
+        char = sql[i]
+        previous = sql[i - 1] if i else ""
+
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = length if end == -1 else end
+            current.append(" ")
+        elif sql.startswith("/*", i):
+            depth, i = 1, i + 2
+            while i < length and depth:
+                if sql.startswith("/*", i):
+                    depth, i = depth + 1, i + 2
+                elif sql.startswith("*/", i):
+                    depth, i = depth - 1, i + 2
+                else:
+                    i += 1
+            current.append(" ")
+        elif char == "'":
+            # E'...' strings take backslash escapes
+            escapes = previous in "eE" and not (i > 1 and is_identifier_char(sql[i - 2]))
+            end = i + 1
+            while end < length:
+                if escapes and sql[end] == "\\":
+                    end += 2
+                elif sql[end] == "'":
+                    if sql.startswith("''", end):
+                        end += 2
+                    else:
+                        break
+                else:
+                    end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+        elif char == '"':
+            end = i + 1
+            while end < length:
+                if sql.startswith('""', end):
+                    end += 2
+                elif sql[end] == '"':
+                    break
+                else:
+                    end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+        elif char == "$" and not is_identifier_char(previous):
+            match = DOLLAR_QUOTE_PATTERN.match(sql, i)
+            if match:
+                end = sql.find(match.group(0), match.end())
+                end = length if end == -1 else end + len(match.group(0))
+                current.append(sql[i:end])
+                i = end
+            else:
+                current.append(char)
+                i += 1
+        elif char == ";":
+            statements.append("".join(current))
+            current = []
+            i += 1
+        else:
+            current.append(char)
+            i += 1
+
+    statements.append("".join(current))
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def statement_keyword(statement: str) -> str:
+    """
+    The first keyword of a statement, lowercased, past any opening parenthesis
+    """
+    words = statement.lstrip("( \t\r\n").split(None, 1)
+    return words[0].lower().rstrip("(") if words else ""
+
+
+def is_row_returning(statement: str) -> bool:
+    return statement_keyword(statement) in ROW_RETURNING_KEYWORDS
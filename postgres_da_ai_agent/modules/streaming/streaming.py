@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+import sys
+import threading
+import time
+import openai
+from openai.util import convert_to_openai_object
+from postgres_da_ai_agent.modules.llm.llm import count_tokens, message_text
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
+
+# Streamed chat completions, printed as they arrive.
+#
+# install_stream_hook() wraps openai.ChatCompletion.create; any completion
+# created inside a 'with streaming_completions()' block on the same thread is
+# requested with stream=True, each content delta is passed to 'on_token' as
+# it arrives, and the chunks are assembled back into the response a
+# non-streamed request returns. Callers (autogen, llm.prompt()) don't see the
+# difference, except that streamed responses come without 'usage': the
+# tokenizer counts it instead, and the response is flagged "estimated_usage".
+#
+# The hook must be the innermost wrapper, so that the response cache stores
+# and the usage hook records the assembled response: install_response_cache()
+# and install_usage_hook() install it first.
+#
+# Each streamed completion gets stats, passed to 'on_stats' and set on its
+# "stream_completion" span:
+#     {"model", "time_to_first_token", "duration", "completion_tokens", "tokens_per_second"}
+# completion_tokens counts the streamed deltas, about one token each.
+
+_local = threading.local()
+_installed = False
+
+
+def print_token(text: str):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+@contextmanager
+def streaming_completions(on_token=print_token, on_stats=None):
+    """
+    Stream every chat completion created on this thread inside the block
+    """
+    previous = getattr(_local, "stream", None)
+    _local.stream = (on_token, on_stats)
+    try:
+        yield
+    finally:
+        _local.stream = previous
+
+
+def install_stream_hook():
+    """
+    Wrap openai.ChatCompletion.create so completions are streamed inside
+    streaming_completions(). Installing twice is a no-op.
+    """
+    global _installed
+    if _installed:
+        return
+
+    create = openai.ChatCompletion.create
+
+    def streamed_create(*args, **params):
+        stream = getattr(_local, "stream", None)
+        if stream is None or args or params.get("stream"):
+            return create(*args, **params)
+        on_token, on_stats = stream
+        return stream_completion(create, params, on_token, on_stats)
+
+    openai.ChatCompletion.create = streamed_create
+    _installed = True
+
+
+def stream_completion(create, params: dict, on_token=print_token, on_stats=None):
+    """
+    'create(**params)' with stream=True, returned as the non-streamed response
+    """
+    with tracer.span("stream_completion", model=params.get("model")) as span:
+        started = time.perf_counter()
+        first_token_at = None
+        completion_tokens = 0
+        response_id, model = None, params.get("model")
+        messages, finish_reasons = {}, {}
+
+        for chunk in create(**params, stream=True):
+            response_id = response_id or chunk.get("id")
+            model = chunk.get("model") or model
+            for choice in chunk.get("choices", []):
+                index = choice.get("index", 0)
+                delta = choice.get("delta") or {}
+                message = messages.setdefault(index, {"role": "assistant", "content": None})
+
+                if delta.get("role"):
+                    message["role"] = delta["role"]
+                if delta.get("content"):
+                    message["content"] = (message["content"] or "") + delta["content"]
+                    if index == 0:
+                        on_token(delta["content"])
+                if delta.get("function_call"):
+                    function_call = message.setdefault("function_call", {"name": "", "arguments": ""})
+                    function_call["name"] += delta["function_call"].get("name") or ""
+                    function_call["arguments"] += delta["function_call"].get("arguments") or ""
+                if delta.get("content") or delta.get("function_call"):
+                    first_token_at = first_token_at or time.perf_counter()
+                    completion_tokens += 1
+
+                if choice.get("finish_reason"):
+                    finish_reasons[index] = choice["finish_reason"]
+
+        finished = time.perf_counter()
+        if messages.get(0, {}).get("content"):
+            on_token("\n")
+
+        generation_time = finished - (first_token_at or finished)
+        stats = {
+            "model": model,
+            "time_to_first_token": round(first_token_at - started, 4) if first_token_at else None,
+            "duration": round(finished - started, 4),
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": round(completion_tokens / generation_time, 1) if generation_time else None,
+        }
+        span.set(**stats)
+
+    if on_stats is not None:
+        on_stats(stats)
+
+    prompt_tokens = sum(count_tokens(message_text(message)) for message in params.get("messages", []))
+    completion_tokens = sum(count_tokens(message_text(message)) for message in messages.values())
+
+    return convert_to_openai_object({
+        "id": response_id,
+        "object": "chat.completion",
+        "model": model,
+        "choices": [
+            {"index": index, "message": messages[index], "finish_reason": finish_reasons.get(index)}
+            for index in sorted(messages)
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+        "estimated_usage": True,
+    })
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+
+# Nested timing spans, exported in the Chrome trace event format: open the
+# file in chrome://tracing or https://ui.perfetto.dev.
+#
+#     with tracer.span("run_sql", sql=sql):
+#         ...
+#         tracer.annotate(rows=len(rows))
+#
+# Tracing is off until tracer.enable(); span() then returns a shared no-op
+# span, so instrumented code costs one attribute check per span.
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+
+    def __enter__(self):
+        self.tracer.stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.perf_counter() - self.start
+        self.tracer.stack().pop()
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc_val}"
+        self.tracer.record(self, duration)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def stack(self) -> list:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def span(self, name: str, **attributes):
+        """
+        A span timing the 'with' block, nested in the span open on this
+        thread, if any
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def annotate(self, **attributes):
+        """
+        Add attributes to the innermost open span of this thread
+        """
+        if not self.enabled:
+            return
+        stack = self.stack()
+        if stack:
+            stack[-1].set(**attributes)
+
+    def record(self, span: Span, duration: float):
+        # list.append is atomic, spans from many threads can be recorded
+        self.events.append({
+            "name": span.name,
+            "ph": "X",
+            "ts": round((span.start - self.origin) * 1_000_000, 1),
+            "dur": round(duration * 1_000_000, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": span.attributes,
+        })
+
+    def export(self, path: str):
+        """
+        Write the spans recorded so far as a Chrome trace JSON file
+        """
+        with open(path, "w") as file:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms"}, file, default=str)
+        print(f"🔎 Trace with {len(self.events)} spans written to {path}")
+
+
+tracer = Tracer()
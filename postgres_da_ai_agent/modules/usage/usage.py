@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+import threading
+import openai
+from postgres_da_ai_agent.modules.llm.llm import count_tokens, estimate_cost, message_text
+from postgres_da_ai_agent.modules.streaming.streaming import install_stream_hook
+
+# Token accounting as a conversation goes, from the 'usage' the API returns
+# with every completion.
+#
+# install_usage_hook() wraps openai.ChatCompletion.create; the request params
+# and response of any completion created inside a
+# 'with recording_responses(callback)' block on the same thread are passed to
+# the callback. The orchestrator uses this to attribute the completions
+# autogen makes to the agent and turn that made them.
+
+_local = threading.local()
+
+
+@contextmanager
+def recording_responses(callback):
+    """
+    Call 'callback(params, response)' for every chat completion created on
+    this thread inside the block
+    """
+    previous = getattr(_local, "callback", None)
+    _local.callback = callback
+    try:
+        yield
+    finally:
+        _local.callback = previous
+
+
+def install_usage_hook():
+    """
+    Wrap openai.ChatCompletion.create so responses reach recording_responses().
+    Installing twice is a no-op.
+
+    The usage hook is always the outermost wrapper, so cached responses are
+    recorded too: install_response_cache() (modules/cache) takes it off and
+    puts it back on top. The stream hook (modules/streaming) is installed
+    first, so streamed responses are recorded once assembled.
+    """
+    install_stream_hook()
+
+    create = openai.ChatCompletion.create
+    if getattr(create, "records_usage", False):
+        return
+
+    def recorded_create(*args, **params):
+        response = create(*args, **params)
+        callback = getattr(_local, "callback", None)
+        if callback is not None and not params.get("stream"):
+            callback(params, response)
+        return response
+
+    recorded_create.records_usage = True
+    recorded_create.wrapped = create
+    openai.ChatCompletion.create = recorded_create
+
+
+def uninstall_usage_hook() -> bool:
+    """
+    Unwrap openai.ChatCompletion.create if the usage hook is its outermost
+    wrapper. Returns whether it was installed.
+    """
+    create = openai.ChatCompletion.create
+    if not getattr(create, "records_usage", False):
+        return False
+    openai.ChatCompletion.create = create.wrapped
+    return True
+
+
+class TokenUsage:
+    """
+    Prompt and completion tokens and cost, totalled per agent and per turn
+    as completions are recorded, so the totals never need the whole history.
+
+    Cached responses count their tokens but cost nothing. Responses without
+    a 'usage' are counted with the tokenizer and flagged as estimated, as are
+    streamed responses.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = self.empty_totals()
+        self.by_agent = {}
+        self.by_turn = {}
+
+    @staticmethod
+    def empty_totals() -> dict:
+        return {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "cost": 0.0,
+            "calls": 0,
+            "cached_calls": 0,
+            "estimated_calls": 0,
+        }
+
+    def record(
+        self,
+        agent_name: str,
+        turn: int,
+        prompt_tokens: int,
+        completion_tokens: int,
+        model: str = None,
+        cached: bool = False,
+        estimated: bool = False,
+    ):
+        """
+        Add one completion to the totals of 'agent_name' and of 'turn'
+        """
+        cost = 0.0 if cached else estimate_cost(prompt_tokens, completion_tokens, model)
+
+        with self.lock:
+            agent_totals = self.by_agent.setdefault(agent_name, self.empty_totals())
+            turn_totals = self.by_turn.setdefault(
+                turn, {"agent": agent_name, **self.empty_totals()})
+
+            for totals in (self.totals, agent_totals, turn_totals):
+                totals["prompt_tokens"] += prompt_tokens
+                totals["completion_tokens"] += completion_tokens
+                totals["total_tokens"] += prompt_tokens + completion_tokens
+                totals["cost"] += cost
+                totals["calls"] += 1
+                totals["cached_calls"] += int(cached)
+                totals["estimated_calls"] += int(estimated)
+
+    def record_response(self, agent_name: str, turn: int, params: dict, response):
+        """
+        Add a chat completion, from its 'usage' when the API returned one
+        """
+        usage = response.get("usage")
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        else:
+            prompt_tokens = sum(
+                count_tokens(message_text(message)) for message in params.get("messages", []))
+            completion_tokens = sum(
+                count_tokens(message_text(choice.get("message") or {}))
+                for choice in response.get("choices", []))
+
+        self.record(
+            agent_name,
+            turn,
+            prompt_tokens,
+            completion_tokens,
+            model=response.get("model") or params.get("model"),
+            cached=bool(response.get("cached")),
+            estimated=not usage or bool(response.get("estimated_usage")),
+        )
+
+    @property
+    def cost(self) -> float:
+        return round(self.totals["cost"], 4)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.totals["total_tokens"]
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "totals": dict(self.totals),
+                "by_agent": {name: dict(totals) for name, totals in self.by_agent.items()},
+                "by_turn": {turn: dict(totals) for turn, totals in self.by_turn.items()},
+            }
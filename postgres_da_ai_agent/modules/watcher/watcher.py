@@ -0,0 +1,173 @@
+import select
+import threading
+import psycopg2
+import psycopg2.extensions
+from psycopg2.sql import SQL, Identifier, Literal
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.embeddings.embeddings import DatabaseEmbedder
+from postgres_da_ai_agent.modules.tracing.tracing import tracer
+
+# Keeps the schema index in sync with DDL while the agents run.
+#
+# Every 'interval' seconds the watcher fetches one fingerprint per table (a
+# hash of its columns and foreign keys, see PostgresDB.get_table_fingerprints),
+# and only the tables whose fingerprint changed, appeared or disappeared are
+# fetched and re-embedded. The foreign key graph is then reloaded whole, it is
+# a single query.
+#
+# With a 'channel', the watcher also LISTENs on it and checks as soon as a
+# notification arrives. install_ddl_event_trigger() sets up an event trigger
+# notifying the channel after every DDL command (it needs superuser rights).
+
+# event trigger functions take no arguments, the channel is part of the body
+DDL_EVENT_TRIGGER_SQL = SQL("""
+CREATE OR REPLACE FUNCTION notify_schema_change() RETURNS event_trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify({channel}, tg_tag);
+END;
+$$;
+
+DROP EVENT TRIGGER IF EXISTS notify_schema_change;
+
+CREATE EVENT TRIGGER notify_schema_change ON ddl_command_end
+    EXECUTE FUNCTION notify_schema_change();
+""")
+
+
+def install_ddl_event_trigger(url: str, channel: str = "schema_change"):
+    """
+    Make every DDL command in the database notify 'channel'
+    """
+    conn = psycopg2.connect(url)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(DDL_EVENT_TRIGGER_SQL.format(channel=Literal(channel)))
+    finally:
+        conn.close()
+
+
+class SchemaWatcher:
+    """
+    Re-embeds the tables whose definition changed, in a background thread.
+
+    Changes are detected against 'fingerprints', by default those read by
+    start(). Pass the fingerprints read before the catalog the index was
+    built from, so that DDL happening in between is picked up by the first
+    check.
+    """
+
+    def __init__(
+        self,
+        db: PostgresDB,
+        database_embedder: DatabaseEmbedder,
+        interval: float = 60.0,
+        index_path: str = None,
+        db_url: str = None,
+        channel: str = None,
+        fingerprints: dict = None,
+    ):
+        self.db = db
+        self.database_embedder = database_embedder
+        self.interval = interval
+        # the refreshed index is saved here, if given
+        self.index_path = index_path
+        self.db_url = db_url
+        self.channel = channel
+
+        self.fingerprints = fingerprints
+        self.listen_conn = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+        self.checks = 0
+        self.updates = 0
+
+    def check(self):
+        """
+        Re-embed the tables changed since the last check.
+        Returns (changed or new tables, removed tables).
+        """
+        with tracer.span("schema_watcher.check") as span:
+            fingerprints = self.db.get_table_fingerprints()
+            previous = self.fingerprints or {}
+            self.checks += 1
+
+            changed = sorted(
+                table_name for table_name, fingerprint in fingerprints.items()
+                if previous.get(table_name) != fingerprint
+            )
+            removed = sorted(set(previous) - set(fingerprints))
+            span.set(changed=len(changed), removed=len(removed))
+
+            if changed or removed:
+                definitions = self.db.get_all_table_definitions(changed) if changed else {}
+                self.database_embedder.update_tables(definitions, removed)
+                self.database_embedder.set_foreign_keys(self.db.get_foreign_keys())
+                self.updates += 1
+
+                if self.index_path:
+                    self.database_embedder.save_index(self.index_path)
+
+                print(
+                    f"🔄 Schema index updated: {len(changed)} tables re-embedded, {len(removed)} removed")
+
+            self.fingerprints = fingerprints
+            return changed, removed
+
+    def start(self):
+        if self.fingerprints is None:
+            self.fingerprints = self.db.get_table_fingerprints()
+
+        if self.channel and self.db_url:
+            self.listen_conn = psycopg2.connect(self.db_url)
+            self.listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with self.listen_conn.cursor() as cur:
+                cur.execute(SQL("LISTEN {}").format(Identifier(self.channel)))
+
+        self.thread = threading.Thread(target=self.run, name="schema-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=self.interval)
+        if self.listen_conn:
+            self.listen_conn.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wait()
+            if self.stopped.is_set():
+                return
+            try:
+                self.check()
+            except Exception as e:
+                # keep watching, the next check compares against the last good snapshot
+                print(f"⚠️ Schema watcher check failed: {e}")
+
+    def wait(self):
+        """
+        Sleep until the next check is due or a notification arrives
+        """
+        if self.listen_conn is None:
+            self.stopped.wait(self.interval)
+            return
+
+        # wake up regularly to notice stop()
+        remaining = self.interval
+        while remaining > 0 and not self.stopped.is_set():
+            timeout = min(remaining, 1.0)
+            if select.select([self.listen_conn], [], [], timeout)[0]:
+                self.listen_conn.poll()
+                if self.listen_conn.notifies:
+                    self.listen_conn.notifies.clear()
+                    return
+            remaining -= timeout
+
+    def stats(self) -> dict:
+        return {
+            "tables": len(self.fingerprints or {}),
+            "checks": self.checks,
+            "updates": self.updates,
+        }
@@ -0,0 +1,112 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import openai
+import pytest
+from postgres_da_ai_agent.modules.cache import cache
+from postgres_da_ai_agent.modules.streaming import streaming
+
+# Tests that need Postgres run against TEST_DATABASE_URL (use a throwaway
+# database, tables named test_* are created and dropped) and are skipped
+# without it.
+#
+# Tests that need completions get the fake_completions fixture: a local
+# endpoint openai is pointed at for the duration of the test.
+
+
+@pytest.fixture
+def database_url():
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return url
+
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(request)
+        content = self.server.reply(request)
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            deltas = [{"role": "assistant"}] + [{"content": word} for word in content.split(" ")]
+            for idx, delta in enumerate(deltas):
+                if idx > 1:
+                    delta["content"] = " " + delta["content"]
+                self.send_event({"choices": [{"index": 0, "delta": delta, "finish_reason": None}]}, request)
+            self.send_event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}, request)
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        prompt_tokens = sum(len((message.get("content") or "").split()) for message in request["messages"])
+        completion_tokens = len(content.split())
+        self.send_json({
+            "id": f"chatcmpl-{len(self.server.requests)}",
+            "object": "chat.completion",
+            "model": request["model"],
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def send_event(self, chunk: dict, request: dict):
+        chunk = {"id": f"chatcmpl-{len(self.server.requests)}", "object": "chat.completion.chunk",
+                 "model": request["model"], **chunk}
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+    def send_json(self, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCompletionServer(ThreadingHTTPServer):
+    """
+    A chat completions endpoint answering every request with reply(request),
+    streamed word by word when asked to. Requests are kept in 'requests'.
+    """
+
+    def __init__(self, reply=None):
+        super().__init__(("127.0.0.1", 0), FakeCompletionHandler)
+        self.reply = reply or (lambda request: "Hello from the fake endpoint")
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+@pytest.fixture
+def fake_completions(monkeypatch):
+    """
+    Point openai at a FakeCompletionServer. The completion hooks tests
+    install (stream, response cache, usage) are removed afterwards.
+    """
+    server = FakeCompletionServer()
+    server.thread.start()
+
+    monkeypatch.setattr(openai, "api_base", server.url)
+    monkeypatch.setattr(openai, "api_key", "test")
+    monkeypatch.setattr(openai.ChatCompletion, "create", openai.ChatCompletion.create)
+    monkeypatch.setattr(streaming, "_installed", False)
+    monkeypatch.setattr(cache, "_original_chat_completion_create", None)
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,184 @@
+import pytest
+from postgres_da_ai_agent.modules.cache import cache
+from postgres_da_ai_agent.modules.cache.cache import (
+    QueryResultCache,
+    ResponseCache,
+    install_response_cache,
+    uninstall_response_cache,
+)
+from postgres_da_ai_agent.modules.llm import llm
+from postgres_da_ai_agent.modules.usage.usage import install_usage_hook, recording_responses
+
+REQUEST = {
+    "model": "gpt-4",
+    "messages": [{"role": "user", "content": "How many users?"}],
+    "temperature": 0,
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    yield response_cache
+    response_cache.close()
+
+
+def response(content: str) -> dict:
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+
+def test_response_key_ignores_parameter_order_and_transport_settings(response_cache):
+    reordered = {"temperature": 0, "messages": REQUEST["messages"], "model": "gpt-4"}
+    assert response_cache.key_for(REQUEST) == response_cache.key_for(reordered)
+    assert response_cache.key_for(REQUEST) == response_cache.key_for(
+        {**REQUEST, "request_timeout": 60, "api_key": "other"})
+
+
+def test_response_key_changes_with_the_answer_parameters(response_cache):
+    key = response_cache.key_for(REQUEST)
+    assert response_cache.key_for({**REQUEST, "model": "gpt-3.5-turbo"}) != key
+    assert response_cache.key_for({**REQUEST, "messages": [{"role": "user", "content": "Hi"}]}) != key
+    assert response_cache.key_for({**REQUEST, "max_tokens": 10}) != key
+
+
+@pytest.mark.parametrize("params", [
+    {**REQUEST, "temperature": 0.7},
+    {key: value for key, value in REQUEST.items() if key != "temperature"},
+    {**REQUEST, "stream": True},
+])
+def test_response_key_skips_nondeterministic_and_streamed_requests(response_cache, params):
+    assert response_cache.key_for(params) is None
+
+
+def test_response_cache_counts_hits_and_misses(response_cache):
+    key = response_cache.key_for(REQUEST)
+    assert response_cache.get(key) is None
+    response_cache.set(key, response("42"))
+    assert response_cache.get(key) == response("42")
+    assert response_cache.get(key) == response("42")
+
+    stats = response_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+
+
+def test_response_cache_expires_entries(clock, tmp_path):
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite3"), max_age=60)
+    response_cache.set("key", response("42"))
+    clock.now += 61
+    assert response_cache.get("key") is None
+    response_cache.set("other", response("43"))
+    assert response_cache.stats()["evictions"] == 1
+    response_cache.close()
+
+
+def test_response_cache_evicts_least_recently_used(clock, tmp_path):
+    size = len(cache.json.dumps(response("a")))
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite3"), max_bytes=2 * size)
+    for key in ("a", "b"):
+        response_cache.set(key, response(key))
+        clock.now += 1
+    response_cache.get("a")
+    clock.now += 1
+    response_cache.set("c", response("c"))
+
+    assert response_cache.get("b") is None
+    assert response_cache.get("a") == response("a")
+    assert response_cache.stats()["evictions"] == 1
+    response_cache.close()
+
+
+def test_llm_prompt_is_served_from_the_response_cache(fake_completions, response_cache):
+    install_response_cache(response_cache)
+
+    first = llm.prompt("How many users?", temperature=0)
+    second = llm.prompt("How many users?", temperature=0)
+
+    assert first == second == "Hello from the fake endpoint"
+    assert len(fake_completions.requests) == 1
+    assert response_cache.stats()["hits"] == 1
+
+
+def test_llm_prompt_keeps_the_api_default_temperature(fake_completions, response_cache):
+    install_response_cache(response_cache)
+
+    llm.prompt("How many users?")
+    llm.prompt("How many users?")
+
+    assert "temperature" not in fake_completions.requests[0]
+    assert len(fake_completions.requests) == 2
+    assert response_cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("usage_hook_first", [True, False])
+def test_completions_are_recorded_once_whatever_the_install_order(
+        fake_completions, response_cache, usage_hook_first):
+    if usage_hook_first:
+        install_usage_hook()
+        install_response_cache(response_cache)
+    else:
+        install_response_cache(response_cache)
+        install_usage_hook()
+    # e.g. the next orchestrator
+    install_usage_hook()
+
+    recorded = []
+    with recording_responses(lambda params, response: recorded.append(bool(response.get("cached")))):
+        llm.prompt("How many users?", temperature=0)
+        llm.prompt("How many users?", temperature=0)
+        uninstall_response_cache()
+        llm.prompt("How many users?", temperature=0)
+
+    assert recorded == [False, True, False]
+    assert len(fake_completions.requests) == 2
+
+
+def test_query_result_key_normalizes_whitespace_and_case_outside_literals():
+    result_cache = QueryResultCache()
+    key = result_cache.key_for("SELECT name FROM users WHERE city = 'Paris';")
+    assert result_cache.key_for("select   name\nfrom users where city = 'Paris'") == key
+    assert result_cache.key_for("SELECT name FROM users WHERE city = 'PARIS'") != key
+    assert result_cache.key_for("SELECT now()") is None
+
+
+def test_query_result_cache_counts_hits_misses_and_stale_entries():
+    result_cache = QueryResultCache()
+    key = result_cache.key_for("SELECT 1")
+    assert result_cache.get(key) is None
+    result_cache.set(key, {"result": "[1]", "rows": 1}, ["public.t"], {"public.t": (1, 0, 0, 1)})
+
+    assert result_cache.get(key)[0] == {"result": "[1]", "rows": 1}
+    result_cache.record_hit()
+    result_cache.invalidate(key)
+
+    stats = result_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stale"], stats["entries"]) == (1, 2, 1, 0)
+
+
+def test_query_result_cache_expires_and_evicts(clock):
+    result_cache = QueryResultCache(max_bytes=8, ttl=60)
+    for key in ("a", "b"):
+        result_cache.set(key, {"result": "1234", "rows": 1}, [], {})
+    result_cache.get("a")
+    result_cache.set("c", {"result": "1234", "rows": 1}, [], {})
+
+    assert result_cache.get("b") is None
+    assert result_cache.stats()["evictions"] == 1
+    clock.now += 61
+    assert result_cache.get("a") is None
@@ -0,0 +1,171 @@
+import json
+import psycopg2
+import pytest
+from postgres_da_ai_agent.modules.cache.cache import QueryResultCache
+from postgres_da_ai_agent.modules.db.db import QUERY_REJECTED, PostgresDB
+
+SANDBOX = {"read_only": True, "statement_timeout": 2000, "work_mem": "7MB"}
+
+
+@pytest.fixture
+def table(database_url):
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS test_items")
+        cur.execute("CREATE TABLE test_items (id int PRIMARY KEY, name text)")
+        cur.execute("INSERT INTO test_items SELECT i, 'item ' || i FROM generate_series(1, 50) i")
+    yield "test_items"
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS test_items")
+    conn.close()
+
+
+@pytest.fixture(params=["dedicated", "pool"])
+def db(request, database_url):
+    db = PostgresDB(**SANDBOX)
+    if request.param == "dedicated":
+        db.connect_with_url(database_url)
+    else:
+        db.connect_with_pool(database_url, max_size=2)
+    yield db
+    db.close()
+
+
+def test_sandboxed_select_through_named_cursor(db, table):
+    assert '"name": "item 1"' in db.run_sql(f"SELECT name FROM {table} WHERE id = 1")
+
+
+def test_sandboxed_truncated_select(db, table):
+    result = db.run_sql(f"SELECT * FROM {table} ORDER BY id", max_rows=5)
+    assert "-- TRUNCATED: showing the first 5 rows" in result
+
+
+def test_sandbox_is_read_only(db, table):
+    with pytest.raises(psycopg2.errors.ReadOnlySqlTransaction):
+        db.run_sql(f"DELETE FROM {table}")
+    assert '"count": 50' in db.run_sql(f"SELECT count(*) FROM {table}")
+
+
+def test_sandbox_statement_timeout(db):
+    with pytest.raises(psycopg2.errors.QueryCanceled):
+        db.run_sql("SELECT pg_sleep(5)")
+    assert '"a": 1' in db.run_sql("SELECT 1 AS a")
+
+
+def test_sandbox_settings_do_not_outlive_the_query(database_url):
+    db = PostgresDB(**SANDBOX)
+    db.connect_with_url(database_url)
+    db.run_sql("SELECT 1")
+    with db.cursor() as cur:
+        cur.execute("SHOW transaction_read_only")
+        assert cur.fetchone()[0] == "off"
+        cur.execute("SHOW work_mem")
+        assert cur.fetchone()[0] != "7MB"
+    db.close()
+
+
+@pytest.fixture
+def guarded_db(database_url, table):
+    db = PostgresDB(**SANDBOX, max_total_cost=1e6, max_estimated_rows=10)
+    db.connect_with_url(database_url)
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "-- every item\nSELECT * FROM test_items",
+    "(SELECT * FROM test_items)",
+    "SELECT ';' AS s, * FROM test_items",
+])
+def test_plan_limits_are_checked_past_comments_and_literals(guarded_db, table, sql):
+    result = json.loads(guarded_db.run_sql(sql))
+    assert result["error"] == QUERY_REJECTED
+    assert result["estimated_rows"] > 10
+
+
+def test_plan_limits_reject_several_statements(guarded_db, table):
+    result = json.loads(guarded_db.run_sql(f"SELECT 1; SELECT * FROM {table}"))
+    assert result["error"] == QUERY_REJECTED
+    assert "2 SQL statements" in result["reason"]
+
+
+def test_plan_limits_reject_statements_explain_cannot_plan(guarded_db, table):
+    result = json.loads(guarded_db.run_sql(f"DROP TABLE {table}"))
+    assert result["error"] == QUERY_REJECTED
+
+
+def test_plan_limits_pass_a_commented_query(guarded_db, table):
+    assert '"name": "item 1"' in guarded_db.run_sql(f"-- one item\nSELECT name FROM {table} WHERE id = 1;")
+
+
+@pytest.fixture
+def cached_db(database_url, table):
+    db = PostgresDB(result_cache=QueryResultCache())
+    db.connect_with_url(database_url)
+    yield db
+    db.close()
+
+
+def test_result_cache_serves_repeated_reads(cached_db, table):
+    sql = f"SELECT count(*) FROM {table}"
+    assert cached_db.run_sql(sql) == cached_db.run_sql(sql)
+    assert cached_db.result_cache.stats()["hits"] == 1
+
+
+def test_result_cache_bypasses_data_modifying_ctes(cached_db, table):
+    cached_db.run_sql(f"SELECT count(*) FROM {table}")
+    sql = f"WITH d AS (DELETE FROM {table} WHERE id <= 10 RETURNING *) SELECT count(*) FROM d"
+
+    assert '"count": 10' in cached_db.run_sql(sql)
+    cached_db.run_sql(sql)
+    assert cached_db.result_cache.stats()["entries"] == 0
+    assert cached_db.result_cache.stats()["hits"] == 0
+
+
+def test_truncated_result_does_not_count_omitted_rows_by_default(db, table):
+    result = db.run_sql(f"SELECT * FROM {table} ORDER BY id", max_rows=5)
+    assert "More rows were left out" in result
+
+
+# 5 rows shown, 5 more fetched in the second batch, the rest skipped server-side
+@pytest.mark.parametrize("count_omitted_rows, note", [(100, ". 45 more rows"), (10, ". At least 15 more rows")])
+def test_truncated_result_counts_omitted_rows_up_to_the_cap(database_url, table, count_omitted_rows, note):
+    with PostgresDB(fetch_size=5, count_omitted_rows=count_omitted_rows) as db:
+        db.connect_with_url(database_url)
+        assert note in db.run_sql(f"SELECT * FROM {table} ORDER BY id", max_rows=5)
+
+
+def test_run_sql_status(db, table):
+    status = db.run_sql_status(f"SELECT * FROM {table} WHERE id <= 3")
+    assert (status["rows"], status["rejected"], status["error"]) == (3, False, None)
+    assert db.run_sql_status(f"SELECT * FROM {table} WHERE id < 0")["rows"] == 0
+
+
+def test_run_sql_status_reports_errors(db, table):
+    status = db.run_sql_status("SELECT * FROM test_missing_table")
+    assert 'relation "test_missing_table" does not exist' in status["error"]
+    assert status["result"].startswith("Error: ")
+    assert '"id": 1' in db.run_sql(f"SELECT id FROM {table} WHERE id = 1")
+
+
+def test_run_sql_status_reports_rejections(guarded_db, table):
+    status = guarded_db.run_sql_status(f"SELECT * FROM {table}")
+    assert status["rejected"] and status["rows"] is None
+    assert json.loads(status["result"])["error"] == QUERY_REJECTED
+
+
+def test_run_sql_status_reports_statements_without_rows(database_url, table):
+    with PostgresDB() as db:
+        db.connect_with_url(database_url)
+        status = db.run_sql_status(f"UPDATE {table} SET name = 'renamed' WHERE id <= 3")
+        assert (status["rows"], status["error"]) == (None, None)
+        assert json.loads(status["result"]) == {"status": "UPDATE 3", "rowcount": 3}
+        assert '"count": 3' in db.run_sql(f"SELECT count(*) FROM {table} WHERE name = 'renamed'")
+
+
+def test_foreign_keys_come_with_the_primary_keys(database_url, table):
+    with PostgresDB() as db:
+        db.connect_with_url(database_url)
+        edges = [edge for edge in db.get_foreign_keys() if edge["table"] == table]
+    assert edges == [{"table": table, "columns": ["id"], "referenced_table": None, "referenced_columns": []}]
@@ -0,0 +1,80 @@
+import os
+import pytest
+from postgres_da_ai_agent.modules.embeddings.embeddings import (
+    DatabaseEmbedder,
+    EmbeddingBackend,
+    HashingBackend,
+    get_schema_index_path,
+)
+
+TABLES = {
+    "users": "CREATE TABLE users (id int, name text, email text)",
+    "orders": "CREATE TABLE orders (id int, user_id int, total numeric)",
+}
+
+
+class OtherHashingBackend(HashingBackend):
+    @classmethod
+    def index_name(cls, model_name: str = None) -> str:
+        return "other/hashing"
+
+
+def test_embedding_backends_must_implement_embed():
+    class NoEmbed(EmbeddingBackend):
+        @classmethod
+        def index_name(cls, model_name: str = None) -> str:
+            return "none"
+
+    with pytest.raises(TypeError):
+        NoEmbed()
+
+
+def test_hashing_backend_rejects_a_model():
+    with pytest.raises(ValueError, match="EMBEDDING_MODEL"):
+        HashingBackend("bert-base-uncased")
+
+
+def test_schema_index_path_is_per_backend(tmp_path):
+    assert get_schema_index_path(str(tmp_path), "hashing") == os.path.join(str(tmp_path), "hashing")
+    assert get_schema_index_path(str(tmp_path), "sentence-transformers/all-MiniLM-L6-v2") == os.path.join(
+        str(tmp_path), "sentence-transformers_all-MiniLM-L6-v2")
+
+
+def test_each_backend_keeps_its_own_schema_index(tmp_path):
+    index_path = str(tmp_path)
+    for backend in (HashingBackend(), OtherHashingBackend()):
+        embedder = DatabaseEmbedder(backend=backend)
+        embedder.add_tables(TABLES)
+        embedder.save_index(index_path)
+
+    assert sorted(os.listdir(index_path)) == ["hashing", "other_hashing"]
+
+    embedder = DatabaseEmbedder(backend=HashingBackend())
+    assert embedder.load_index(index_path, TABLES) == []
+    assert embedder.get_similar_tables_via_embeddings("user emails", n=1) == ["users"]
+
+
+def test_column_embedding_cache_keeps_the_columns_of_the_current_query():
+    embedder = DatabaseEmbedder(backend=HashingBackend())
+    embedder.max_column_embeddings = 3
+    users = {"users": [("id", "int"), ("name", "text")]}
+    orders = {"orders": [("id", "int"), ("total", "numeric")]}
+
+    embedder.get_column_scores("user names", users)
+    scores = embedder.get_column_scores("order totals", {**users, **orders})
+
+    assert [len(table_scores) for table_scores in scores.values()] == [2, 2]
+    assert len(embedder.column_embeddings) == 4
+
+
+def test_compact_definitions_keep_the_primary_key_not_id():
+    embedder = DatabaseEmbedder(backend=HashingBackend())
+    embedder.add_tables({
+        "products": "CREATE TABLE products (\nsku text,\nid int,\nname text,\nprice numeric,\ncolour text\n);",
+    })
+    embedder.set_foreign_keys([
+        {"table": "products", "columns": ["sku"], "referenced_table": None, "referenced_columns": []},
+    ])
+
+    compact = embedder.get_compact_table_definitions_from_names("product price", ["products"], max_columns=2)
+    assert compact == "products(sku text, price numeric, ...3 more)"
@@ -0,0 +1,30 @@
+import re
+import pytest
+from postgres_da_ai_agent.modules.encoding import encoding
+from postgres_da_ai_agent.modules.encoding.encoding import fit_to_token_budget, get_encoder
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # one token per word or punctuation mark, no tokenizer download needed
+    monkeypatch.setattr(encoding, "count_tokens", lambda text: len(re.findall(r"\w+|[^\w\s]", text)))
+
+
+@pytest.mark.parametrize("sampling", ["head", "even"])
+def test_fit_to_token_budget_keeps_an_empty_result(sampling):
+    assert fit_to_token_budget(get_encoder("csv"), ["id"], [], 10, sampling, reserve_tokens=20) == []
+
+
+def test_fit_to_token_budget_keeps_the_first_rows():
+    encoder = get_encoder("csv")
+    rows = [encoder.row(["id"], (idx,)) for idx in range(100)]
+    kept = fit_to_token_budget(encoder, ["id"], rows, 11)
+    assert kept == rows[:10]
+
+
+def test_result_encoders_must_implement_row():
+    class NoRow(encoding.ResultEncoder):
+        name = "none"
+
+    with pytest.raises(TypeError):
+        NoRow()
@@ -0,0 +1,81 @@
+import json
+import pytest
+from postgres_da_ai_agent.modules.fastpath.fastpath import FAST_PATH_AGENT_NAME, FastPath
+
+
+class StubDB:
+    """
+    Answers every query with the same run_sql_status()
+    """
+
+    def __init__(self, rows=3, error=None, rejected=False):
+        self.status = {"result": "[...]", "rows": rows, "rejected": rejected, "error": error}
+        self.queries = []
+
+    def run_sql_status(self, sql):
+        self.queries.append(sql)
+        return self.status
+
+
+def reply(sql="SELECT count(*) FROM users", confidence=0.95, ambiguities=()):
+    return json.dumps({"sql": sql, "confidence": confidence, "ambiguities": list(ambiguities)})
+
+
+def test_parse_reply_finds_the_json_object():
+    assert FastPath.parse_reply('Here you go:\n```json\n{"sql": "SELECT 1"}\n```') == {"sql": "SELECT 1"}
+    assert FastPath.parse_reply("no json here") is None
+    assert FastPath.parse_reply("{not json}") is None
+
+
+def test_answers_when_every_check_passes(fake_completions):
+    fake_completions.reply = lambda request: reply()
+    db = StubDB(rows=1)
+
+    attempt = FastPath(db).run("How many users?")
+
+    assert attempt["answered"] and attempt["reason"] is None
+    assert db.queries == ["SELECT count(*) FROM users"]
+    assert [message["role"] for message in attempt["messages"][1:]] == ["assistant", "function"]
+    assert attempt["messages"][1]["name"] == FAST_PATH_AGENT_NAME
+
+
+@pytest.mark.parametrize("db, reason", [
+    (StubDB(error='relation "users" does not exist'), 'the query failed: relation "users" does not exist'),
+    (StubDB(rows=0), "the query returned no rows"),
+    (StubDB(rows=None, rejected=True), "the query was rejected by the plan limits"),
+])
+def test_escalates_on_the_query_result(fake_completions, db, reason):
+    fake_completions.reply = lambda request: reply()
+
+    attempt = FastPath(db).run("How many users?")
+
+    assert not attempt["answered"]
+    assert attempt["reason"] == reason
+    assert attempt["messages"][-1]["role"] == "function"
+
+
+@pytest.mark.parametrize("content, reason", [
+    (reply(confidence=0.5), "confidence 0.5 is under 0.8"),
+    (reply(ambiguities=["which signup date?"]), "the question is ambiguous: which signup date?"),
+    (reply(sql="SELECT 1; SELECT 2"), "the reply is not a single query"),
+    (reply(sql="DELETE FROM users"), "the reply is not a single query"),
+    ("I can't answer that", "the reply is not a single query"),
+])
+def test_escalates_before_running_a_doubtful_reply(fake_completions, content, reason):
+    fake_completions.reply = lambda request: content
+    db = StubDB()
+
+    attempt = FastPath(db).run("How many users?")
+
+    assert (attempt["answered"], attempt["reason"]) == (False, reason)
+    assert db.queries == []
+
+
+def test_records_the_completion_under_the_fast_path(fake_completions):
+    fake_completions.reply = lambda request: reply()
+    fast_path = FastPath(StubDB())
+
+    fast_path.run("How many users?")
+
+    assert fast_path.usage.by_turn["fast_path"]["agent"] == FAST_PATH_AGENT_NAME
+    assert fake_completions.requests[0]["temperature"] == 0
@@ -0,0 +1,35 @@
+from postgres_da_ai_agent.modules.graph.graph import ForeignKeyGraph
+
+
+def foreign_key(table: str, column: str, referenced_table: str) -> dict:
+    return {"table": table, "columns": [column], "referenced_table": referenced_table, "referenced_columns": ["id"]}
+
+
+# users <- orders <- order_items -> products <- reviews
+GRAPH = ForeignKeyGraph([
+    foreign_key("orders", "user_id", "users"),
+    foreign_key("order_items", "order_id", "orders"),
+    foreign_key("order_items", "product_id", "products"),
+    foreign_key("reviews", "product_id", "products"),
+])
+
+
+def test_expand_stops_at_the_hop_limit():
+    assert GRAPH.expand(["users"], hops=1) == ["orders"]
+    assert GRAPH.expand(["users"], hops=2) == ["orders", "order_items"]
+    assert GRAPH.expand(["users"], hops=4) == ["orders", "order_items", "products", "reviews"]
+
+
+def test_expand_never_returns_the_seeds():
+    assert "orders" not in GRAPH.expand(["users", "orders"], hops=3)
+    assert GRAPH.expand(["unknown"]) == []
+
+
+def test_expand_favours_tables_reached_from_several_seeds():
+    assert GRAPH.expand(["orders", "products"], hops=1, limit=1) == ["order_items"]
+
+
+def test_self_references_are_keys_but_not_edges():
+    graph = ForeignKeyGraph([foreign_key("employees", "manager_id", "employees")])
+    assert graph.neighbors("employees") == {}
+    assert graph.key_columns("employees") == {"manager_id", "id"}
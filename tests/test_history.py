@@ -0,0 +1,67 @@
+import json
+import re
+import pytest
+from postgres_da_ai_agent.modules.history import history
+from postgres_da_ai_agent.modules.history.history import ELIDED, HistoryCompaction
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # one token per word or punctuation mark, no tokenizer download needed
+    monkeypatch.setattr(history, "count_tokens", lambda text: len(re.findall(r"\w+|[^\w\s]", text)))
+
+
+def function_call(sql: str) -> dict:
+    return {"role": "assistant", "content": None,
+            "function_call": {"name": "run_sql", "arguments": json.dumps({"sql": sql})}}
+
+
+def function_result(rows: int) -> dict:
+    return {"role": "function", "name": "run_sql", "content": "\n".join(f"row {idx}" for idx in range(rows))}
+
+
+def conversation() -> list:
+    return [
+        {"role": "system", "content": "You are a data analyst. " * 20},
+        {"role": "user", "content": "How many users signed up? " * 10},
+        function_call("SELECT * FROM users"),
+        function_result(100),
+        {"role": "assistant", "content": "Let me count them instead. " * 10},
+        function_call("SELECT count(*) FROM users"),
+        function_result(1),
+    ]
+
+
+def test_compact_keeps_the_latest_call_and_digests_older_results():
+    messages = conversation()
+    saved = HistoryCompaction(token_ceiling=10_000, digest_tokens=10).compact(messages)
+
+    assert saved > 0
+    assert json.loads(messages[2]["function_call"]["arguments"]) == {"sql": "(superseded by a later call)"}
+    assert messages[3]["content"].endswith("characters in total]")
+    assert messages[5:] == conversation()[5:]
+
+
+def test_compact_under_the_ceiling_keeps_the_first_and_last_messages():
+    original = conversation()
+    messages = conversation()
+    HistoryCompaction(token_ceiling=50, digest_tokens=10).compact(messages)
+
+    assert messages[0] == original[0]
+    assert messages[-2:] == original[-2:]
+    assert messages[1]["content"] == ELIDED
+    assert messages[4]["content"] == ELIDED
+
+
+def test_compact_replaces_messages_instead_of_editing_them():
+    messages = conversation()
+    shared = messages[1]
+    HistoryCompaction(token_ceiling=50, digest_tokens=10).compact(messages)
+    assert shared["content"].startswith("How many users")
+
+
+def test_compact_twice_saves_nothing_more():
+    compaction = HistoryCompaction(token_ceiling=50, digest_tokens=10)
+    messages = conversation()
+    compaction.compact(messages)
+    assert compaction.compact(messages) == 0
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from postgres_da_ai_agent.modules.embeddings.embeddings import (
+    DatabaseEmbedder,
+    HashingBackend,
+    get_schema_index_path,
+)
+from postgres_da_ai_agent.modules.index.index import EmbeddingMatrix, SchemaIndex, normalize_rows
+
+
+def random_rows(count: int, dim: int = 16, seed: int = 0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+@pytest.mark.parametrize("k", [1, 5, 49, 50, 80])
+def test_search_matches_a_brute_force_ranking(k):
+    embeddings = EmbeddingMatrix(16)
+    embeddings.set([f"table_{idx}" for idx in range(50)], random_rows(50))
+    queries = random_rows(7, seed=1)
+
+    top, scores = embeddings.search(queries, k)
+
+    expected_scores = normalize_rows(queries) @ normalize_rows(random_rows(50)).T
+    expected_top = np.argsort(-expected_scores, axis=1, kind="stable")[:, :min(k, 50)]
+    np.testing.assert_array_equal(top, expected_top)
+    np.testing.assert_allclose(scores, np.take_along_axis(expected_scores, expected_top, axis=1), rtol=1e-5)
+
+
+def test_search_sees_rows_added_and_replaced_since_the_last_one():
+    embeddings = EmbeddingMatrix(2)
+    embeddings.set(["a", "b"], [[1, 0], [0, 1]])
+    assert embeddings.search([[1, 0.1]], 1)[0].tolist() == [[0]]
+
+    embeddings.set(["c"], [[1, 0.2]])
+    embeddings.set(["a"], [[-1, 0]])
+    top, _scores = embeddings.search([[1, 0.1]], 3)
+    assert [embeddings.names[row] for row in top[0]] == ["c", "b", "a"]
+
+
+def test_search_on_an_empty_matrix():
+    top, scores = EmbeddingMatrix(4).search(random_rows(2, dim=4), 3)
+    assert top.shape == scores.shape == (2, 0)
+
+
+TABLES = {
+    "users": "CREATE TABLE users (\nid int,\nemail text\n);",
+    "orders": "CREATE TABLE orders (\nid int,\nuser_id int,\ntotal numeric\n);",
+    "products": "CREATE TABLE products (\nid int,\nname text,\nprice numeric\n);",
+}
+
+
+def saved_index(path: str):
+    embedder = DatabaseEmbedder(backend=HashingBackend())
+    embedder.add_tables(TABLES)
+    embedder.save_index(path)
+    return embedder
+
+
+def test_schema_index_round_trip_is_memory_mapped(tmp_path):
+    saved = saved_index(str(tmp_path))
+
+    schema_index = SchemaIndex(get_schema_index_path(str(tmp_path), "hashing"))
+    tables, embeddings = schema_index.load("hashing")
+    assert [table["name"] for table in tables] == list(TABLES)
+    assert isinstance(embeddings, np.memmap) and not embeddings.flags.writeable
+    assert schema_index.load("other-model") is None
+
+    embedder = DatabaseEmbedder(backend=HashingBackend())
+    assert embedder.merge_index((tables, embeddings), TABLES) == []
+    # every table is fresh: searched in place, without a copy
+    assert np.shares_memory(embedder.embeddings.get_matrix(), embeddings)
+    np.testing.assert_array_equal(embeddings, saved.embeddings.get_matrix())
+
+
+def test_merge_index_re_embeds_stale_tables_and_drops_removed_ones(tmp_path):
+    saved_index(str(tmp_path))
+    current = {
+        "users": TABLES["users"],
+        "orders": "CREATE TABLE orders (\nid int,\nuser_id int,\nstatus text\n);",
+        "reviews": "CREATE TABLE reviews (\nid int,\nproduct_id int,\nrating int\n);",
+    }
+
+    embedder = DatabaseEmbedder(backend=HashingBackend())
+    stale_tables = embedder.load_index(str(tmp_path), current)
+
+    assert sorted(stale_tables) == ["orders", "reviews"]
+    assert sorted(embedder.embeddings.names) == ["orders", "reviews", "users"]
+    assert embedder.map_name_to_table_def == current
+
+    fresh = DatabaseEmbedder(backend=HashingBackend())
+    fresh.add_tables(current)
+    for table_name in current:
+        np.testing.assert_allclose(
+            embedder.embeddings.get_matrix()[embedder.embeddings.map_name_to_row[table_name]],
+            fresh.embeddings.get_matrix()[fresh.embeddings.map_name_to_row[table_name]],
+            rtol=1e-6,
+        )
+
+
+def test_replacing_a_memory_mapped_row_leaves_the_file_untouched(tmp_path):
+    saved = saved_index(str(tmp_path))
+    schema_index = SchemaIndex(get_schema_index_path(str(tmp_path), "hashing"))
+    tables, embeddings = schema_index.load("hashing")
+
+    matrix = EmbeddingMatrix(embeddings.shape[1])
+    matrix.set([table["name"] for table in tables], embeddings, normalized=True)
+    matrix.set(["users"], np.ones((1, embeddings.shape[1])))
+
+    np.testing.assert_array_equal(schema_index.load("hashing")[1], saved.embeddings.get_matrix())
@@ -0,0 +1,36 @@
+from postgres_da_ai_agent.modules.lexical.lexical import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+TABLES = {
+    "users": "CREATE TABLE users (\nid int,\nemail text,\nsignup_date date\n);",
+    "orders": "CREATE TABLE orders (\nid int,\nuser_id int,\ntotal numeric\n);",
+    "order_items": "CREATE TABLE order_items (\nid int,\norder_id int,\nproduct_id int,\nquantity int\n);",
+    "products": "CREATE TABLE products (\nid int,\nname text,\nprice numeric\n);",
+}
+
+
+def test_tokenize_splits_and_singularizes_identifiers():
+    assert tokenize("order_items") == ["order", "item"]
+    assert tokenize("userAddresses") == ["user", "address"]
+    assert tokenize("Show me the categories") == ["category"]
+
+
+def test_search_ranks_tables_by_name_and_columns():
+    index = LexicalIndex(TABLES)
+    assert [name for name, _score in index.search("total of each order", n=2)] == ["orders", "order_items"]
+    assert [name for name, _score in index.search("product prices")][0] == "products"
+    assert index.search("weather") == []
+
+
+def test_mentioned_tables_matches_whole_names():
+    index = LexicalIndex(TABLES)
+    assert index.mentioned_tables("order items per user") == ["orders", "order_items", "users"]
+    assert index.mentioned_tables("items of an order") == ["orders"]
+
+
+def test_reciprocal_rank_fusion_favours_names_in_several_rankings():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]]) == ["b", "c", "a", "d"]
+
+
+def test_reciprocal_rank_fusion_keeps_the_order_of_a_single_ranking():
+    assert reciprocal_rank_fusion([["c", "a", "b"]]) == ["c", "a", "b"]
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+import autogen
+import pytest
+from postgres_da_ai_agent.modules.orchestrator.orchestrator import Orchestrator
+
+
+class SleepingReplies:
+    """
+    Replies of the fake endpoint: each agent's system message is the number
+    of seconds it takes to reply. Tracks how many replies run at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.finished = 0
+
+    def __call__(self, request):
+        seconds = float(request["messages"][0]["content"])
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(seconds)
+        with self.lock:
+            self.running -= 1
+            self.finished += 1
+        return f"replied after {seconds}s"
+
+
+@pytest.fixture
+def replies(fake_completions):
+    replies = fake_completions.reply = SleepingReplies()
+    return replies
+
+
+def create_agent(name: str, seconds: float, url: str):
+    return autogen.AssistantAgent(
+        name=name,
+        system_message=str(seconds),
+        llm_config={
+            "use_cache": False,
+            "temperature": 0,
+            "config_list": [{"model": "gpt-4", "api_key": "test", "api_base": url}],
+            "request_timeout": 10,
+        },
+        human_input_mode="NEVER",
+        code_execution_config=False,
+    )
+
+
+def create_admin():
+    return autogen.UserProxyAgent(name="Admin", human_input_mode="NEVER", code_execution_config=False)
+
+
+def test_broadcast_replies_in_agent_order_within_the_concurrency_limit(fake_completions, replies):
+    agents = [create_admin()] + [
+        create_agent(f"Agent_{idx}", seconds, fake_completions.url)
+        for idx, seconds in enumerate([0.4, 0.1, 0.3, 0.2])
+    ]
+    orchestrator = Orchestrator("test", agents, max_concurrency=2)
+
+    was_successful, messages = asyncio.run(orchestrator.abroadcast_conversation("Hi"))
+
+    assert was_successful
+    assert messages == ["Hi", "replied after 0.4s", "replied after 0.1s", "replied after 0.3s", "replied after 0.2s"]
+    assert replies.max_running == 2
+    assert orchestrator.usage.totals["calls"] == 4
+
+
+def test_broadcast_reports_agents_that_time_out(fake_completions, replies):
+    agents = [
+        create_admin(),
+        create_agent("Slow", 1.0, fake_completions.url),
+        create_agent("Fast", 0.0, fake_completions.url),
+    ]
+    orchestrator = Orchestrator("test", agents, agent_timeout=0.3)
+
+    async def converse():
+        result = await orchestrator.abroadcast_conversation("Hi")
+        return result, orchestrator.usage.totals["calls"]
+
+    # asyncio.run() returns once the worker thread of the timed out reply is done
+    (was_successful, messages), calls_on_return = asyncio.run(converse())
+
+    assert not was_successful
+    assert messages == ["Hi", "ERROR: Slow did not reply within 0.3s", "replied after 0.0s"]
+
+    # the timed out reply finished in the background and is still counted
+    assert calls_on_return == 1
+    assert orchestrator.usage.totals["calls"] == 2
+    assert orchestrator.usage.by_agent["Slow"]["total_tokens"] > 0
+    # without adding its reply to the conversation
+    assert len(messages) == 3
+
+
+def test_sequential_conversation_fails_on_a_step_timeout(fake_completions, replies):
+    agents = [
+        create_admin(),
+        create_agent("Fast", 0.0, fake_completions.url),
+        create_agent("Slow", 1.0, fake_completions.url),
+        create_agent("Never", 0.0, fake_completions.url),
+    ]
+    orchestrator = Orchestrator("test", agents, agent_timeout=0.3)
+
+    was_successful, messages = asyncio.run(orchestrator.asequential_conversation("Hi"))
+
+    assert not was_successful
+    assert messages == ["Hi", "replied after 0.0s", "ERROR: Slow did not reply within 0.3s"]
+    assert len(fake_completions.requests) == 2
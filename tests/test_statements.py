@@ -0,0 +1,30 @@
+import pytest
+from postgres_da_ai_agent.modules.statements.statements import split_statements, statement_keyword
+
+
+@pytest.mark.parametrize("sql, statements", [
+    ("SELECT 1", ["SELECT 1"]),
+    ("SELECT 1;", ["SELECT 1"]),
+    ("-- the count\nSELECT count(*) FROM t;", ["SELECT count(*) FROM t"]),
+    ("/* outer /* nested; */ still a comment; */ SELECT 1", ["SELECT 1"]),
+    ("SELECT ';' AS semicolon", ["SELECT ';' AS semicolon"]),
+    ("SELECT 'it''s; fine'", ["SELECT 'it''s; fine'"]),
+    ("SELECT E'\\'; still the string'", ["SELECT E'\\'; still the string'"]),
+    ('SELECT "a;b" FROM t', ['SELECT "a;b" FROM t']),
+    ("SELECT $$a;b$$, $tag$c;$$;d$tag$", ["SELECT $$a;b$$, $tag$c;$$;d$tag$"]),
+    ("SELECT 1; DELETE FROM t", ["SELECT 1", "DELETE FROM t"]),
+    ("SELECT 1 -- trailing; comment\n; DROP TABLE t", ["SELECT 1", "DROP TABLE t"]),
+    (" ;; -- nothing\n", []),
+])
+def test_split_statements(sql, statements):
+    assert split_statements(sql) == statements
+
+
+@pytest.mark.parametrize("statement, keyword", [
+    ("SELECT 1", "select"),
+    ("(SELECT 1) UNION (SELECT 2)", "select"),
+    ("with d AS (DELETE FROM t RETURNING *) SELECT * FROM d", "with"),
+    ("", ""),
+])
+def test_statement_keyword(statement, keyword):
+    assert statement_keyword(statement) == keyword
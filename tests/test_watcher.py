@@ -0,0 +1,51 @@
+import time
+import psycopg2
+import pytest
+from postgres_da_ai_agent.modules.db.db import PostgresDB
+from postgres_da_ai_agent.modules.watcher.watcher import SchemaWatcher, install_ddl_event_trigger
+
+CHANNEL = 'test "schema" change'
+
+
+class RecordingEmbedder:
+    def __init__(self):
+        self.updates = []
+
+    def update_tables(self, definitions, removed):
+        self.updates.append((sorted(definitions), list(removed)))
+
+    def set_foreign_keys(self, edges):
+        pass
+
+
+@pytest.fixture
+def ddl_trigger(database_url):
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    install_ddl_event_trigger(database_url, CHANNEL)
+    yield conn
+    with conn.cursor() as cur:
+        cur.execute("DROP EVENT TRIGGER IF EXISTS notify_schema_change")
+        cur.execute("DROP FUNCTION IF EXISTS notify_schema_change()")
+        cur.execute("DROP TABLE IF EXISTS test_watched")
+    conn.close()
+
+
+def test_ddl_notification_wakes_the_watcher(database_url, ddl_trigger):
+    db = PostgresDB()
+    db.connect_with_pool(database_url, max_size=1)
+    embedder = RecordingEmbedder()
+    watcher = SchemaWatcher(db, embedder, interval=30, db_url=database_url, channel=CHANNEL)
+    watcher.start()
+    try:
+        with ddl_trigger.cursor() as cur:
+            cur.execute("CREATE TABLE test_watched (id int)")
+
+        # well before the 30s interval
+        deadline = time.monotonic() + 5
+        while not embedder.updates and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert embedder.updates == [(["test_watched"], [])]
+    finally:
+        watcher.stop()
+        db.close()